@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import yaml
+from pathlib import Path
+from checkpoints import file_digest
+from structure_io import read_structure
+
+###############################################################################
+#         CONTENT-ADDRESSED CACHE OF WHOLE CALCULATIONS ACROSS CAMPAIGNS      #
+###############################################################################
+
+# Bump when the workflow changes what a calculation produces, so older entries no longer match
+CACHE_VERSION = 1
+ENTRY_FILE = 'cache_entry.yml'
+DEFAULT_MAX_SIZE_MB = 20000
+
+# Settings that change how a calculation is run or stored, but not its results
+UNKEYED_SETTINGS = (
+    'title', 'warm start', 'warm start root', 'monitor rules', 'hessian sources', 'seed hessian',
+    'archive codec', 'archive level', 'archive threads', 'blob store', 'calc cache', 'calc cache size',
+    'ricore',  # RI memory; fanout/campaign cap it per job
+)
+COORDINATE_DECIMALS = 6  # Angstrom; differences below this are formatting noise
+
+
+def normalized_structure(settings: dict, structure_file: str = 'initial_structure') -> dict:
+    """
+    Returns the input structure as element symbols and coordinates in Angstrom rounded to
+    COORDINATE_DECIMALS, independent of the file format it came in. The structure is not moved or
+    rotated: dipoles, tensors and cubes refer to the input frame. Charge and multiplicity are
+    included when the file provides them (Gaussian input), since with 'charge from file' they
+    replace the settings only after the key is computed. A follow-up calculation is identified by
+    the digest of the previous calculation it starts from.
+    """
+    if settings['follow-up']:
+        return {'previous calculation': file_digest('old_calc.tar.xz')}
+    structure = read_structure(structure_file, settings['structure file type'])
+    symbols, positions = structure['symbols'], structure['positions']
+    normalized = {
+        'symbols': [symbol.capitalize() for symbol in symbols],
+        'positions': [[round(float(v), COORDINATE_DECIMALS) + 0.0 for v in position] for position in positions],
+    }
+    for key in ('charge', 'multiplicity'):
+        if structure[key] is not None:
+            normalized[key] = structure[key]
+    return normalized
+
+
+def calculation_key(settings: dict, structure_file: str = 'initial_structure') -> str:
+    """
+    Returns the cache key of a calculation: the SHA-256 of its normalized structure and the settings
+    that determine its results (charge and multiplicity included), in canonical JSON.
+    """
+    keyed = {key: value for key, value in settings.items() if key not in UNKEYED_SETTINGS}
+    canonical = json.dumps({'version': CACHE_VERSION, 'structure': normalized_structure(settings, structure_file),
+                            'settings': keyed}, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CalculationCache:
+    """
+    Finished calculations stored under <root>/<first two hex digits>/<key>/ with their results files
+    and artifacts. Entries are written to a temporary directory and renamed into place, so concurrent
+    jobs never see half an entry. A hit refreshes the entry's last use; when the cache grows beyond
+    `max_size_mb`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, root, max_size_mb: int = DEFAULT_MAX_SIZE_MB):
+        self.root = Path(root)
+        self.max_size_mb = max_size_mb
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> 'CalculationCache':
+        """
+        Returns the cache configured by $TM_CALC_CACHE or 'Calculation cache', or None if there is none.
+        """
+        if not settings.get('calc cache'):
+            return None
+        return cls(settings['calc cache'], settings.get('calc cache size') or DEFAULT_MAX_SIZE_MB)
+
+    def entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def materialize(self, key: str, directory: str = '.') -> list:
+        """
+        Copies the stored files of a cached calculation into `directory`. Returns their names,
+        or None on a miss. An entry evicted by another job while it is being copied is a miss as
+        well; the files copied from it so far are removed again.
+        """
+        entry = self.entry(key)
+        if not (entry / ENTRY_FILE).is_file():
+            return None
+        copied = []
+        try:
+            with open(entry / ENTRY_FILE, 'r') as infile:
+                files = yaml.full_load(infile)['files']
+            for filename in files:
+                target = Path(directory) / filename
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(entry / filename, target)
+                copied.append(target)
+            os.utime(entry / ENTRY_FILE)
+        except OSError:
+            for target in copied:
+                target.unlink(missing_ok=True)
+            return None
+        return files
+
+    def store(self, key: str, files: list, directory: str = '.') -> None:
+        """
+        Stores the given result files of a finished calculation under `key` (an existing entry is
+        kept), then evicts least recently used entries beyond the size limit.
+        """
+        entry = self.entry(key)
+        if (entry / ENTRY_FILE).is_file():
+            return
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = entry.with_name(f'.{key}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        stored = []
+        for filename in files:
+            source = Path(directory) / filename
+            if source.is_file():
+                (tmp_dir / filename).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(source, tmp_dir / filename)
+                stored.append(str(filename))
+        with open(tmp_dir / ENTRY_FILE, 'w') as outfile:
+            yaml.dump({'key': key, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'files': stored},
+                      outfile, default_flow_style=False)
+        try:
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # Another job stored the same calculation first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self) -> list:
+        """
+        Returns (last use, size in bytes, path) of every complete entry.
+        """
+        entries = []
+        for marker in self.root.glob(f'*/*/{ENTRY_FILE}'):
+            try:
+                size = sum(path.stat().st_size for path in marker.parent.rglob('*') if path.is_file())
+                entries.append((marker.stat().st_mtime, size, marker.parent))
+            except FileNotFoundError:
+                # Evicted by another job meanwhile
+                continue
+        return entries
+
+    def evict(self) -> None:
+        """
+        Removes least recently used entries until the cache fits into `max_size_mb`.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_size_mb * 1024 ** 2:
+            _, size, path = entries.pop(0)
+            # Unpublish the entry first, so that a concurrent lookup never copies a half-deleted one
+            (path / ENTRY_FILE).unlink(missing_ok=True)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,194 @@
+import os
+import copy
+import json
+import shutil
+import hashlib
+import yaml
+from pathlib import Path
+from telemetry import measured_stage
+
+###############################################################################
+#            STAGE COMPLETION MARKERS FOR RESTARTABLE run_tm.main            #
+###############################################################################
+
+STAGE_DIR = '.stages'
+# How the last run left the tracked files, and the stage it was in if it was interrupted
+STATE_FILE = 'state.yml'
+
+# Files handed from one stage to the next. Their state after every completed stage is kept
+# (content-addressed, so unchanged files are stored once) and put back when that stage is skipped.
+TRACKED_FILES = (
+    'coord_0', 'coord', 'control', 'basis', 'auxbasis', 'mos', 'alpha', 'beta', 'energy', 'gradient',
+    'hessapprox', 'out.ccf', 'ridft.out', 'eiger.out', 'escf.out', 'hyperpols', 'aoforce.out',
+    'hessian', 'vibspectrum', 'vib_normal_modes',
+)
+
+
+def file_digest(filename) -> str:
+    """
+    Returns the SHA-256 of a file, or None if it does not exist.
+    """
+    if not os.path.isfile(filename):
+        return None
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _changed(before: dict, after: dict) -> dict:
+    """
+    Returns the entries of `after` that are new or differ from `before`.
+    """
+    return {key: value for key, value in after.items() if key not in before or before[key] != value}
+
+
+class StageRunner:
+    """
+    Runs the stages of a calculation in order and writes a completion marker for each one.
+    A stage's fingerprint covers its name, the settings it reads (its entry in `stage_settings`, all
+    settings for a stage without one), its external input files,
+    the tracked files the stage before it handed over and the fingerprint of that stage, so a
+    changed input invalidates that stage and all later ones. A stage whose marker matches is
+    skipped: the files it left behind, its changes to settings/results and its return value are
+    restored instead. Stages named in `force` (or 'all') always run, and once one stage has run,
+    every later stage runs too. Tracked files edited by hand since the last run are not restored
+    over, so the first stage that starts from them runs again with the edits. Every stage that runs is timed
+    (see telemetry.measured_stage).
+    """
+
+    def __init__(self, force=(), directory: str = STAGE_DIR, stage_settings: dict = None):
+        self.force = set(force)
+        self.stage_settings = stage_settings or {}
+        self.directory = Path(directory)
+        self.blobs = self.directory / 'blobs'
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.previous = ''
+        self.handed = {}
+        self.rerun = False
+        self.state_file = self.directory / STATE_FILE
+        self.state = self._load_state()
+        self.edited = self._edited_files()
+
+    def _load_state(self) -> dict:
+        if not self.state_file.is_file():
+            return {'running': None, 'files': {}}
+        with open(self.state_file, 'r') as infile:
+            return yaml.full_load(infile)
+
+    def _save_state(self) -> None:
+        tmp_file = self.directory / f'{STATE_FILE}.tmp'
+        with open(tmp_file, 'w') as outfile:
+            yaml.dump(self.state, outfile, default_flow_style=False)
+        os.replace(tmp_file, self.state_file)
+
+    def _edited_files(self) -> set:
+        """
+        Returns the tracked files that differ from how the last run left them. After an interrupted
+        stage the differences are its own partial output, not edits.
+        """
+        if self.state['running'] is not None or not self.state['files']:
+            return set()
+        return {filename for filename in TRACKED_FILES
+                if os.path.isfile(filename) and file_digest(filename) != self.state['files'].get(filename)}
+
+    def fingerprint(self, name: str, settings: dict, inputs=()) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.previous.encode())
+        digest.update(name.encode())
+        # Settings other stages read (or none does, e.g. archive and cache locations) must not invalidate this one
+        if name in self.stage_settings:
+            settings = {key: settings.get(key) for key in self.stage_settings[name]}
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        for filename in inputs:
+            digest.update(f'{filename}:{file_digest(filename)}'.encode())
+        # The files this stage starts from, as they are now (hand edits included)
+        for filename in sorted(self.handed):
+            digest.update(f'{filename}:{file_digest(filename)}'.encode())
+        return digest.hexdigest()
+
+    def _marker_file(self, name: str) -> Path:
+        return self.directory / f'{name}.yml'
+
+    def _load_marker(self, name: str) -> dict:
+        marker_file = self._marker_file(name)
+        if not marker_file.is_file():
+            return None
+        with open(marker_file, 'r') as infile:
+            return yaml.full_load(infile)
+
+    def _write_marker(self, name: str, marker: dict) -> None:
+        tmp_file = self.directory / f'{name}.yml.tmp'
+        with open(tmp_file, 'w') as outfile:
+            yaml.dump(marker, outfile, default_flow_style=False)
+        os.replace(tmp_file, self._marker_file(name))
+
+    def _snapshot(self) -> dict:
+        """
+        Stores the current tracked files in the blob store and returns {filename: digest}.
+        """
+        return {filename: self._store(filename) for filename in TRACKED_FILES if os.path.isfile(filename)}
+
+    def _store(self, filename) -> str:
+        digest = file_digest(filename)
+        blob = self.blobs / digest
+        if not blob.is_file():
+            shutil.copyfile(filename, blob)
+        return digest
+
+    def _restorable(self, marker: dict) -> bool:
+        return all((self.blobs / digest).is_file() for digest in marker['files'].values())
+
+    def _restore(self, files: dict) -> None:
+        for filename, digest in files.items():
+            if filename not in self.edited and file_digest(filename) != digest:
+                shutil.copyfile(self.blobs / digest, filename)
+
+    def run(self, name: str, func, settings: dict, results_dict: dict, inputs=()):
+        """
+        Runs `func()` as stage `name` unless it already completed with the same fingerprint.
+        Returns the stage's (possibly restored) return value.
+        """
+        fingerprint = self.fingerprint(name, settings, inputs)
+        marker = self._load_marker(name)
+        forced = self.rerun or name in self.force or 'all' in self.force
+        if not forced and marker and marker['fingerprint'] == fingerprint and self._restorable(marker):
+            print(f'Stage {name} already completed, skipping.')
+            self._restore(marker['files'])
+            # Hand edits become part of what this stage hands over, so that they survive later restarts
+            edited = [filename for filename in marker['files'] if filename in self.edited]
+            if edited:
+                marker['files'].update({filename: self._store(filename) for filename in edited})
+                self._write_marker(name, marker)
+            settings.update(marker['settings'])
+            results_dict.update(marker['results'])
+            self.previous, self.handed = fingerprint, marker['files']
+            self.state['files'].update(marker['files'])
+            self._save_state()
+            return marker['returned']
+
+        # A stage interrupted halfway must not look complete on the next restart
+        if marker:
+            self._marker_file(name).unlink()
+        self.state['running'] = name
+        self._save_state()
+        settings_before, results_before = copy.deepcopy(settings), copy.deepcopy(results_dict)
+        with measured_stage(name):
+            returned = func()
+        files = self._snapshot()
+        self._write_marker(name, {
+            'stage': name,
+            'fingerprint': fingerprint,
+            'settings': _changed(settings_before, settings),
+            'results': _changed(results_before, results_dict),
+            'returned': returned,
+            'files': files,
+        })
+        self.previous, self.handed = fingerprint, files
+        # The later stages start from what this one produced, so none of their markers holds any more
+        self.rerun = True
+        self.edited = set()
+        self.state = {'running': None, 'files': files}
+        self._save_state()
+        return returned
@@ -0,0 +1,146 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+###############################################################################
+#        IN-PROCESS $DATAGROUP EDITING OF THE TURBOMOLE CONTROL FILE          #
+###############################################################################
+
+
+def _matches(header: str, name: str) -> bool:
+    """
+    True if a datagroup header (without '$') belongs to `name`. Like kdg, a name matches whole words
+    from the start of the header, so 'cosmo' matches '$cosmo' but not '$cosmo_atoms', and
+    'last step' picks '$last step' out of several '$last ...' groups.
+    """
+    key = name.lstrip('$').split()
+    return header.split()[:len(key)] == key
+
+
+class ControlFile:
+    """
+    The datagroups of a Turbomole control file, kept in their original order. Each datagroup is its
+    header line (the part after '$') plus the body lines up to the next datagroup. Everything
+    after '$end' is ignored, and '$end' is always written last.
+    """
+
+    def __init__(self, filename: str = 'control'):
+        self.filename = Path(filename)
+        self.preamble = []
+        self.groups = []
+        with open(self.filename, 'r') as infile:
+            for line in infile.read().splitlines():
+                if line.startswith('$'):
+                    header = line[1:].rstrip()
+                    if _matches(header, 'end'):
+                        break
+                    self.groups.append([header, []])
+                elif self.groups:
+                    self.groups[-1][1].append(line)
+                else:
+                    self.preamble.append(line)
+
+    def _index(self, name: str) -> int:
+        return next((i for i, (header, _) in enumerate(self.groups) if _matches(header, name)), None)
+
+    def has(self, name: str) -> bool:
+        return self._index(name) is not None
+
+    def header(self, name: str) -> str:
+        """
+        Returns the header line of a datagroup without '$', e.g. 'scfinstab hyperpol nm', or None.
+        """
+        index = self._index(name)
+        return None if index is None else self.groups[index][0]
+
+    def get(self, name: str) -> list:
+        """
+        Returns the body lines of a datagroup, or None if it does not exist.
+        """
+        index = self._index(name)
+        return None if index is None else list(self.groups[index][1])
+
+    def set(self, name: str, value: str = '', body: list = (), after: str = None) -> None:
+        """
+        Sets datagroup `name` to the header '$name value' and the given body lines. An existing
+        datagroup is replaced in place; a new one goes after datagroup `after` if given and present,
+        otherwise at the end.
+        """
+        group = [f'{name} {value}'.rstrip(), [str(line) for line in body]]
+        index = self._index(name)
+        if index is not None:
+            self.groups[index] = group
+            return
+        anchor = self._index(after) if after else None
+        self.groups.insert(len(self.groups) if anchor is None else anchor + 1, group)
+
+    def delete(self, name: str) -> None:
+        """
+        Removes every datagroup matching `name` (kdg).
+        """
+        self.groups = [group for group in self.groups if not _matches(group[0], name)]
+
+    def reactivate(self, name: str) -> None:
+        """
+        Turns commented-out datagroups starting with '#$name' back into active ones
+        (sed 's/#$max/$max/' re-enables '#$maxcor', '#$max...' alike).
+        """
+        groups = []
+        for header, body in self.groups:
+            groups.append([header, []])
+            for line in body:
+                if line.startswith('#$' + name):
+                    groups.append([line[2:].rstrip(), []])
+                else:
+                    groups[-1][1].append(line)
+        self.groups = groups
+
+    def external_file(self, name: str) -> Path:
+        """
+        Returns the path of the file a datagroup refers to ('$scfmo file=mos' -> mos), or None.
+        """
+        header = self.header(name)
+        if header is None:
+            return None
+        for token in header.split():
+            if token.startswith('file='):
+                return self.filename.parent / token[len('file='):]
+        return None
+
+    def read_external(self, name: str) -> list:
+        """
+        Returns the lines of the file a datagroup refers to, or its own body if it is kept inline.
+        """
+        path = self.external_file(name)
+        if path is None:
+            return self.get(name)
+        with open(path, 'r') as infile:
+            return infile.read().splitlines()
+
+    def text(self) -> str:
+        lines = list(self.preamble)
+        for header, body in self.groups:
+            lines.append('$' + header)
+            lines.extend(body)
+        lines.append('$end')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename: str = None) -> None:
+        """
+        Writes the control file atomically: a concurrent reader sees either the old or the new file.
+        """
+        target = Path(filename or self.filename)
+        tmp_file = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w') as outfile:
+            outfile.write(self.text())
+        os.replace(tmp_file, target)
+
+
+@contextmanager
+def edit_control(filename: str = 'control'):
+    """
+    Loads a control file once, yields it for editing and writes it back atomically on success.
+    """
+    control = ControlFile(filename)
+    yield control
+    control.write()
@@ -0,0 +1,284 @@
+import os
+import re
+import itertools
+import argparse
+import numpy as np
+from pathlib import Path
+from hyperpol_tensors import (
+    get_dipole_vector, tmole_vectors_to_3d_vec, get_pair_frequencies,
+    get_all_hyper_polarizabilities, rotate_to_dipole_frame, au_to_esu, nm_to_au,
+)
+from gaussian_parser import find_gaussian_logs, parse_gaussian_log
+
+###############################################################################
+#        DISPERSION MODELS FOR beta(-w_sigma; w1, w2) ACROSS A CORPUS         #
+###############################################################################
+
+# Frequency pairs (w1, w2) for a wavelength omega, by nonlinear optical process
+PROCESSES = {
+    'static': lambda w: (0.0 * w, 0.0 * w),
+    'EOPE': lambda w: (w, 0.0 * w),   # Pockels, beta(-w; w, 0)
+    'SHG': lambda w: (w, w),          # beta(-2w; w, w)
+    'OR': lambda w: (w, -w),          # optical rectification, beta(0; w, -w)
+}
+
+# Points whose highest frequency (|w1|, |w2|, |w_sigma|) exceeds this fraction of omega0 are near
+# resonance, where the two-state model breaks down; they are left out of the two-state fit
+NEAR_RESONANCE = 0.9
+# Frequencies below this (au) are static; Turbomole writes the static pair as 45560000000 nm
+STATIC_OMEGA = 1e-6
+
+
+def two_state_factor(omega1, omega2, omega0):
+    """
+    Two-state dispersion factor F = beta(-w_sigma; w1, w2) / beta(0; 0, 0) for an excitation energy omega0:
+
+        F = w0^4 (3 w0^2 + w1 w2 - w_sigma^2) / (3 (w0^2 - w_sigma^2)(w0^2 - w1^2)(w0^2 - w2^2))
+
+    with w_sigma = w1 + w2. All arguments broadcast against each other.
+    """
+    omega1, omega2, omega0 = np.asarray(omega1), np.asarray(omega2), np.asarray(omega0)
+    sigma = omega1 + omega2
+    w0_2 = omega0 ** 2
+    numerator = w0_2 ** 2 * (3.0 * w0_2 + omega1 * omega2 - sigma ** 2)
+    denominator = 3.0 * (w0_2 - sigma ** 2) * (w0_2 - omega1 ** 2) * (w0_2 - omega2 ** 2)
+    return numerator / denominator
+
+
+def _weighted_scale(factor, beta, weight):
+    """
+    Closed-form least-squares beta0 and residual for beta ~ beta0 * factor, reduced over the last axis.
+    """
+    fb = np.sum(weight * factor * beta, axis=-1)
+    ff = np.sum(weight * factor * factor, axis=-1)
+    beta0 = np.divide(fb, ff, out=np.zeros_like(fb), where=ff > 0)
+    residual = np.sum(weight * (beta - beta0[..., None] * factor) ** 2, axis=-1)
+    return beta0, residual
+
+
+def _anchored_scale(factor, beta, weight, anchor):
+    """
+    Like _weighted_scale, but rows with a finite `anchor` (their measured static beta) keep it as beta0.
+    """
+    beta0, _ = _weighted_scale(factor, beta, weight)
+    beta0 = np.where(np.isfinite(anchor), anchor, beta0)
+    residual = np.sum(weight * (beta - beta0[..., None] * factor) ** 2, axis=-1)
+    return beta0, residual
+
+
+def _grid_fit(omega1, omega2, beta, weight, anchor, n_grid, omega0_max, refine):
+    """
+    Grid search for omega0 of every row (above the highest resonance of its included points), zoomed
+    `refine` times around the best point. Returns (beta0, omega0, residual, omega0 at a grid bound).
+    """
+    resonance = np.max(np.abs(np.stack([omega1, omega2, omega1 + omega2])) * (weight > 0), axis=(0, 2))
+    low = np.maximum(resonance * 1.001, 1e-3)
+    high = np.full_like(low, omega0_max)
+    bounds = (low, high)
+    grid_fraction = np.linspace(0.0, 1.0, n_grid)
+    rows = np.arange(len(low))
+
+    for _ in range(refine + 1):
+        # Log-spaced trial omega0 per row: shape (n, n_grid)
+        omega0 = np.exp(np.log(low)[:, None] + (np.log(high) - np.log(low))[:, None] * grid_fraction)
+        factor = two_state_factor(omega1[:, None, :], omega2[:, None, :], omega0[..., None])
+        _, residual = _anchored_scale(factor, beta[:, None, :], weight[:, None, :], anchor[:, None])
+        best = np.argmin(residual, axis=1)
+        low = omega0[rows, np.maximum(best - 1, 0)]
+        high = omega0[rows, np.minimum(best + 1, n_grid - 1)]
+    best_omega0 = omega0[rows, best]
+    at_bound = np.isclose(best_omega0, bounds[0], rtol=1e-3) | np.isclose(best_omega0, bounds[1], rtol=1e-3)
+
+    beta0, residual = _anchored_scale(two_state_factor(omega1, omega2, best_omega0[:, None]), beta, weight, anchor)
+    return beta0, best_omega0, residual, at_bound
+
+
+def fit_two_state(omega1, omega2, beta, n_grid: int = 400, omega0_max: float = 1.5, refine: int = 3) -> tuple:
+    """
+    Fits beta0 and omega0 of the two-state model to every row of the (n, m) arrays at once.
+    Missing points are NaN. Rows with static points keep their mean as beta0; otherwise beta0 is the
+    linear least-squares solution for each trial omega0, so the fit is a vectorized grid search over
+    omega0 followed by `refine` zoomed grids around the best point. Near-resonant points (highest
+    frequency above NEAR_RESONANCE * omega0, e.g. SHG close to the excitation) would dominate the
+    fit, so while a row has such points or its omega0 ends at a grid bound, its highest-frequency
+    point is left out, as long as the row stays determined.
+    Returns (beta0, omega0, rms, at_bound, used): rms over the points used, whether omega0 ended at
+    the bound of its grid (the model does not describe the row), and the (n, m) mask of used points.
+    Rows with fewer than two distinct frequency points do not determine the model: omega0 is NaN,
+    and so is beta0 unless all their points are static (then it is their mean).
+    """
+    omega1, omega2, beta = (np.atleast_2d(np.asarray(a, dtype=float)) for a in (omega1, omega2, beta))
+    valid = np.isfinite(beta) & np.isfinite(omega1) & np.isfinite(omega2)
+    beta, omega1, omega2 = (np.where(valid, a, 0.0) for a in (beta, omega1, omega2))
+    highest = np.max(np.abs(np.stack([omega1, omega2, omega1 + omega2])), axis=0)
+    static = valid & (highest < STATIC_OMEGA)
+    n_static = static.sum(axis=1)
+    anchor = np.divide((beta * static).sum(axis=1), n_static, out=np.full(len(beta), np.nan), where=n_static > 0)
+
+    def distinct(mask):
+        return np.array([len(np.unique(np.round(s[m], 8))) for s, m in zip(omega1 ** 2 + omega2 ** 2, mask)])
+
+    used = valid.copy()
+    while True:
+        beta0, omega0, residual, at_bound = _grid_fit(omega1, omega2, beta, used.astype(float), anchor,
+                                                      n_grid, omega0_max, refine)
+        near = used & (highest > NEAR_RESONANCE * omega0[:, None])
+        # Rows with near-resonant points, or whose omega0 ends at a grid bound, lose their highest-frequency
+        # point as long as they stay determined without it
+        drop = np.where(used, highest, -1.0).argmax(axis=1)
+        candidate = used.copy()
+        candidate[np.arange(len(drop)), drop] = False
+        rows = (near.any(axis=1) | at_bound) & (distinct(candidate) >= 2)
+        if not rows.any():
+            break
+        used[rows] = candidate[rows]
+
+    n_points = used.sum(axis=1)
+    rms = np.sqrt(np.divide(residual, n_points, out=np.zeros_like(residual), where=n_points > 0))
+    underdetermined = distinct(used) < 2
+    omega0 = np.where(underdetermined, np.nan, omega0)
+    # A single dynamic point fits any omega0, only measured static values give beta0 directly
+    only_static = (n_points > 0) & (n_static == n_points)
+    beta0 = np.where(underdetermined, np.where(only_static, anchor, np.nan), beta0)
+    return beta0, omega0, rms, at_bound & ~underdetermined, used
+
+
+def fit_multipoint(omega1, omega2, beta, order: int = 1) -> np.ndarray:
+    """
+    Fits beta = c0 + c1 w_L^2 + ... + c_order w_L^(2 order), with w_L^2 = w_sigma^2 + w1^2 + w2^2,
+    to every row of the (n, m) arrays by batched linear least squares. Missing points are NaN.
+    Returns (n, order + 1) coefficients; c0 is the static beta. Rows with too few points are NaN.
+    """
+    omega1, omega2, beta = (np.atleast_2d(np.asarray(a, dtype=float)) for a in (omega1, omega2, beta))
+    valid = np.isfinite(beta) & np.isfinite(omega1) & np.isfinite(omega2)
+    omega_l2 = np.where(valid, (omega1 + omega2) ** 2 + omega1 ** 2 + omega2 ** 2, 0.0)
+    design = omega_l2[..., None] ** np.arange(order + 1) * valid[..., None]
+    target = np.where(valid, beta, 0.0)[..., None]
+    coefficients = (np.linalg.pinv(design) @ target)[..., 0]
+    coefficients[valid.sum(axis=1) < order + 1] = np.nan
+    return coefficients
+
+
+def beta_at(process: str, wavelength_nm, beta0=None, omega0=None, coefficients=None) -> np.ndarray:
+    """
+    Evaluates fitted models at a common wavelength for the given process ('static', 'EOPE', 'SHG' or 'OR').
+    Pass beta0/omega0 from fit_two_state or coefficients from fit_multipoint. Without omega0 only the
+    static value is known, so other processes and wavelengths give NaN.
+    """
+    omega1, omega2 = PROCESSES[process](nm_to_au(wavelength_nm))
+    if coefficients is not None:
+        omega_l2 = (omega1 + omega2) ** 2 + omega1 ** 2 + omega2 ** 2
+        return np.sum(np.asarray(coefficients) * omega_l2[..., None] ** np.arange(np.shape(coefficients)[-1]), axis=-1)
+    omega0 = np.asarray(omega0, dtype=float)
+    unknown = np.where((omega1 == 0.0) & (omega2 == 0.0), 1.0, np.nan)
+    factor = np.where(np.isnan(omega0), unknown, two_state_factor(omega1, omega2, np.nan_to_num(omega0, nan=1.0)))
+    return np.asarray(beta0) * factor
+
+
+###############################################################################
+#                    INGESTING beta(w) SERIES FROM A RESULTS TREE             #
+###############################################################################
+
+def series_key(calc_dir: str, root: str) -> str:
+    """
+    Groups calculation directories of the same molecule and method: wavelength-specific
+    directories such as 'hyper_1300' and 'hyper_1900' map to the same series 'hyper'.
+    """
+    relative = Path(os.path.relpath(calc_dir, root)).as_posix()
+    return re.sub(r'(^|/)hyper_\d+(?=/|$)', r'\1hyper', relative)
+
+
+def _collect_turbomole(root: str, dipole_file: str, hyper_file: str):
+    """
+    Yields (calc_dir, dipole, frequencies, beta) for every Turbomole hyperpols below `root`.
+    """
+    for hyper_path in sorted(Path(root).rglob(hyper_file)):
+        calc_dir = hyper_path.parent
+        dip_data = get_dipole_vector(str(calc_dir / dipole_file)) if (calc_dir / dipole_file).is_file() else None
+        if dip_data is None:
+            continue
+        yield (calc_dir, tmole_vectors_to_3d_vec(*dip_data),
+               get_pair_frequencies(str(hyper_path)), get_all_hyper_polarizabilities(str(hyper_path)))
+
+
+def _collect_gaussian(root: str):
+    """
+    Yields (calc_dir, dipole, frequencies, beta) for every Gaussian polar output below `root`.
+    """
+    for log_path in find_gaussian_logs(root):
+        try:
+            result = parse_gaussian_log(log_path)
+        except ValueError:
+            continue
+        yield log_path.parent, result['dipole'], result['frequencies'], result['beta']
+
+
+def ingest_beta_series(root: str, dipole_file: str = 'ridft.out', hyper_file: str = 'hyperpols') -> dict:
+    """
+    Collects dipole-aligned beta_zzz (10^-30 esu) for every frequency pair below `root`,
+    from Turbomole hyperpols and Gaussian polar outputs alike.
+    Returns a table {'keys': [...], 'omega1', 'omega2', 'beta_zzz'} with (n, m) arrays padded with NaN.
+    """
+    series = {}
+    sources = itertools.chain(_collect_turbomole(root, dipole_file, hyper_file), _collect_gaussian(root))
+    for calc_dir, dipole_vector, frequencies, tensors in sources:
+        points = series.setdefault(series_key(str(calc_dir), root), [])
+        for (omega1, omega2), tensor in zip(frequencies, au_to_esu(tensors)):
+            points.append((omega1, omega2, rotate_to_dipole_frame(tensor, dipole_vector)[2, 2, 2]))
+
+    keys = sorted(series)
+    width = max((len(series[k]) for k in keys), default=0)
+    table = np.full((len(keys), width, 3), np.nan)
+    for row, key in enumerate(keys):
+        table[row, :len(series[key])] = series[key]
+    return {'keys': keys, 'omega1': table[..., 0], 'omega2': table[..., 1], 'beta_zzz': table[..., 2]}
+
+
+def extrapolate_corpus(root: str, wavelength_nm: float, process: str = 'EOPE', model: str = 'two-state') -> dict:
+    """
+    Fits the chosen dispersion model to every series below `root` and converts all of them to
+    `process` at `wavelength_nm`. Returns {key: {'beta0', 'omega0', 'rms', 'omega0 at grid bound',
+    'points used', 'beta'}}; 'beta' is NaN where omega0 ended at a bound of the two-state grid,
+    since the fit there is not a minimum and the converted value would be meaningless.
+    """
+    table = ingest_beta_series(root)
+    omega1, omega2, beta = table['omega1'], table['omega2'], table['beta_zzz']
+    if model == 'two-state':
+        beta0, omega0, rms, at_bound, used = fit_two_state(omega1, omega2, beta)
+        converted = np.where(at_bound, np.nan, beta_at(process, wavelength_nm, beta0=beta0, omega0=omega0))
+    else:
+        coefficients = fit_multipoint(omega1, omega2, beta)
+        beta0, omega0 = coefficients[:, 0], np.full(len(coefficients), np.nan)
+        used = np.isfinite(beta) & np.isfinite(omega1) & np.isfinite(omega2)
+        omega_l2 = (omega1 + omega2) ** 2 + omega1 ** 2 + omega2 ** 2
+        fitted = np.sum(coefficients[:, None, :] * omega_l2[..., None] ** np.arange(coefficients.shape[1]), axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rms = np.sqrt(np.nansum(np.where(used, fitted - beta, np.nan) ** 2, axis=1) / used.sum(axis=1))
+        at_bound = np.zeros(len(coefficients), dtype=bool)
+        converted = beta_at(process, wavelength_nm, coefficients=coefficients)
+    return {
+        key: {'beta0': float(b0), 'omega0': float(w0), 'rms': float(r), 'omega0 at grid bound': bool(bound),
+              'points used': int(n), 'beta': float(b)}
+        for key, b0, w0, r, bound, n, b in zip(table['keys'], beta0, omega0, rms, at_bound, used.sum(axis=1),
+                                               converted)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert computed beta_zzz to a common wavelength.')
+    parser.add_argument('root', help='results tree containing hyperpols/ridft.out directories')
+    parser.add_argument('--wavelength', type=float, default=1300.0, help='target wavelength in nm')
+    parser.add_argument('--process', choices=sorted(PROCESSES), default='EOPE')
+    parser.add_argument('--model', choices=['two-state', 'multipoint'], default='two-state')
+    args = parser.parse_args()
+
+    results = extrapolate_corpus(args.root, args.wavelength, args.process, args.model)
+    print(f"{'series':40s} {'beta0':>12s} {'w0 (eV)':>9s} {'rms':>10s} {'points':>6s} {'bound':>5s} "
+          f"{args.process + '@' + str(args.wavelength):>14s}")
+    for key, res in results.items():
+        print(f"{key:40s} {res['beta0']:12.2f} {res['omega0'] * 27.211386:9.3f} {res['rms']:10.2f} "
+              f"{res['points used']:6d} {'yes' if res['omega0 at grid bound'] else 'no':>5s} {res['beta']:14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import copy
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+import yaml
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+###############################################################################
+#     CONCURRENT FUNCTIONAL x WAVELENGTH FAN-OUT FROM ONE OPTIMIZED COORD     #
+###############################################################################
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+
+class ResourcePool:
+    """
+    Cores and memory (MB) of one node, handed out to concurrently running jobs.
+    acquire() blocks until the requested amounts are free.
+    """
+
+    def __init__(self, cores: int, memory_mb: int):
+        self.cores = cores
+        self.memory_mb = memory_mb
+        self.free_cores = cores
+        self.free_memory_mb = memory_mb
+        self._condition = threading.Condition()
+
+    def fits(self, cores: int, memory_mb: int) -> bool:
+        """
+        Returns True if a job of this size can ever run on the node.
+        """
+        return cores <= self.cores and memory_mb <= self.memory_mb
+
+    def try_acquire(self, cores: int, memory_mb: int) -> bool:
+        """
+        Takes the resources if they are free right now; never blocks.
+        """
+        with self._condition:
+            if cores <= self.free_cores and memory_mb <= self.free_memory_mb:
+                self.free_cores -= cores
+                self.free_memory_mb -= memory_mb
+                return True
+            return False
+
+    def acquire(self, cores: int, memory_mb: int) -> None:
+        if not self.fits(cores, memory_mb):
+            raise ValueError(f'Job needs {cores} cores / {memory_mb} MB, node has {self.cores} / {self.memory_mb}.')
+        with self._condition:
+            self._condition.wait_for(lambda: cores <= self.free_cores and memory_mb <= self.free_memory_mb)
+            self.free_cores -= cores
+            self.free_memory_mb -= memory_mb
+
+    def release(self, cores: int, memory_mb: int) -> None:
+        with self._condition:
+            self.free_cores += cores
+            self.free_memory_mb += memory_mb
+            self._condition.notify_all()
+
+
+def job_environment(cores: int, path_prepend: list = None, blob_store: Path = None) -> dict:
+    """
+    Returns the environment for one Turbomole job: SMP thread counts set to its core budget, the
+    blob store shared by all jobs of a run (unless one is already set) and, for testing, directories
+    with stand-in executables (ridft, escf, ...) put in front of PATH.
+    """
+    env = dict(os.environ)
+    env['PARNODES'] = str(cores)
+    env['OMP_NUM_THREADS'] = str(cores)
+    if blob_store is not None:
+        env.setdefault('TM_BLOB_STORE', str(Path(blob_store).resolve()))
+    if path_prepend:
+        env['PATH'] = os.pathsep.join([str(Path(p).resolve()) for p in path_prepend] + [env.get('PATH', '')])
+    return env
+
+
+def functional_label(functional: str) -> str:
+    """
+    Directory name for a functional, e.g. 'b3-lyp' -> 'b3lyp', 'None' (MP2) -> 'none'.
+    """
+    return re.sub(r'[^0-9a-z]+', '', functional.lower())
+
+
+def wavelength_list(wavelength) -> list:
+    """
+    Returns the wavelengths of a job as a list of floats; a job has one wavelength or a list of them.
+    """
+    return [float(w) for w in wavelength] if isinstance(wavelength, (list, tuple)) else [float(wavelength)]
+
+
+def wavelength_label(wavelength) -> str:
+    """
+    Name part for the wavelengths of a job, e.g. 1300.0 -> '1300', [1300.0, 1900.0] -> '1300_1900'.
+    """
+    return '_'.join(f'{w:g}' for w in wavelength_list(wavelength))
+
+
+def render_job_settings(template: dict, functional: str, wavelength, memory_mb: int) -> dict:
+    """
+    Returns a copy of the rendered_wano.yml template for one functional and one wavelength or a list
+    of wavelengths (computed together in one escf run).
+    The structure is read as the shared Turbomole coord and the RI memory is capped to the job budget.
+    """
+    wano = copy.deepcopy(template)
+    wano['Title'] = f'{functional_label(functional)}_{wavelength_label(wavelength)}'
+    wano['Follow-up calculation'] = False
+    wano['Molecular structure']['Structure file type'] = 'Turbomole coord'
+    wano['Molecular structure']['Structure file'] = 'initial_structure'
+    wano['DFT options']['Functional'] = functional
+    wano['DFT options']['Memory for RI'] = int(min(wano['DFT options']['Memory for RI'], memory_mb // 2))
+    wano['Type of calculation']['Hyperpolarizability'] = True
+    wano['Type of calculation']['Structure optimisation'] = False
+    wano['Type of calculation']['First hyperpolarizability'] = [{'frequency (nm)': w} for w in wavelength_list(wavelength)]
+    return wano
+
+
+def materialize_job(workdir: Path, coord_file: str, wano: dict, functional: str, wavelength) -> Path:
+    """
+    Creates the isolated working directory hyper_<nm>/<functional>/ (hyper_<nm>_<nm>/... for several
+    wavelengths) with its own copy of the coord, the rendered settings and the workflow scripts.
+    """
+    job_dir = workdir / f'hyper_{wavelength_label(wavelength)}' / functional_label(functional)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(coord_file, job_dir / 'initial_structure')
+    with open(job_dir / 'rendered_wano.yml', 'w') as outfile:
+        yaml.dump(wano, outfile, default_flow_style=False)
+    for script in SCRIPT_DIR.glob('*.py'):
+        shutil.copy2(script, job_dir / script.name)
+    return job_dir
+
+
+def launch_run_tm(job_dir: Path, cores: int, path_prepend: list = None, blob_store: Path = None) -> tuple:
+    """
+    Runs run_tm.py in `job_dir` with the given core budget. Returns (returncode, wall time in s).
+    """
+    start = time.time()
+    with open(Path(job_dir) / 'run_tm.stdout', 'w') as log:
+        process = subprocess.run(
+            [sys.executable, 'run_tm.py'], cwd=job_dir, stdout=log, stderr=subprocess.STDOUT,
+            env=job_environment(cores, path_prepend, blob_store),
+        )
+    return process.returncode, time.time() - start
+
+
+def run_job(job: dict, pool: ResourcePool, path_prepend: list = None, blob_store: Path = None) -> dict:
+    """
+    Runs run_tm.py for one job once its core and memory budget is available.
+    """
+    pool.acquire(job['cores'], job['memory_mb'])
+    try:
+        job['returncode'], job['wall time'] = launch_run_tm(job['dir'], job['cores'], path_prepend, blob_store)
+    finally:
+        pool.release(job['cores'], job['memory_mb'])
+    results_file = job['dir'] / 'turbomole_results.yml'
+    job['results'] = str(results_file) if results_file.is_file() else None
+    return job
+
+
+def fan_out(coord_file: str, functionals: list, wavelengths: list, template_file: str = 'rendered_wano.yml',
+            workdir: str = 'fanout', cores: int = None, memory_mb: int = 64000, cores_per_job: int = 1,
+            memory_per_job: int = 4000, path_prepend: list = None, combine_wavelengths: bool = False,
+            max_workers: int = None) -> list:
+    """
+    Runs the hyperpolarizability workflow for every functional x wavelength from one optimized coord.
+    Jobs run concurrently in isolated directories as long as the node budget allows, so the wall time
+    of the whole matrix approaches that of the slowest single job. With `combine_wavelengths`, each
+    functional is one job computing all wavelengths on a single ground state. At most `max_workers`
+    jobs (default: as many as fit into the node's cores) are started at a time.
+    """
+    with open(template_file) as infile:
+        template = yaml.full_load(infile)
+    workdir = Path(workdir)
+    cores = cores or os.cpu_count()
+    pool = ResourcePool(cores, memory_mb)
+
+    jobs = []
+    for functional in functionals:
+        for wavelength in ([list(wavelengths)] if combine_wavelengths else wavelengths):
+            wano = render_job_settings(template, functional, wavelength, memory_per_job)
+            jobs.append({
+                'functional': functional,
+                'wavelength': wavelength,
+                'dir': materialize_job(workdir, coord_file, wano, functional, wavelength),
+                'cores': cores_per_job,
+                'memory_mb': memory_per_job,
+            })
+
+    # Jobs beyond what fits into the node would only hold a thread while they wait for the pool
+    max_workers = max(min(len(jobs), max_workers or cores // max(cores_per_job, 1)), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda job: run_job(job, pool, path_prepend, workdir / 'blobs'), jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run several functionals and wavelengths from one coord concurrently.')
+    parser.add_argument('coord', help='optimized Turbomole coord file')
+    parser.add_argument('--functionals', nargs='+', required=True, help="Turbomole functional names, 'None' for MP2")
+    parser.add_argument('--wavelengths', nargs='+', type=float, default=[1300.0], help='wavelengths in nm')
+    parser.add_argument('--template', default='rendered_wano.yml', help='rendered_wano.yml used as template')
+    parser.add_argument('--workdir', default='fanout')
+    parser.add_argument('--cores', type=int, default=None, help='cores of the node (default: all)')
+    parser.add_argument('--memory', type=int, default=64000, help='memory of the node in MB')
+    parser.add_argument('--cores-per-job', type=int, default=1)
+    parser.add_argument('--memory-per-job', type=int, default=4000, help='MB')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='jobs running at a time (default: as many as fit into the cores)')
+    parser.add_argument('--combine-wavelengths', action='store_true',
+                        help='compute all wavelengths of a functional in one job (one ground state)')
+    parser.add_argument('--bin-dir', action='append', default=None,
+                        help='directory with stand-in executables put in front of PATH (testing, see tests/stand_in_bin)')
+    args = parser.parse_args()
+
+    jobs = fan_out(args.coord, args.functionals, args.wavelengths, args.template, args.workdir, args.cores,
+                   args.memory, args.cores_per_job, args.memory_per_job, args.bin_dir, args.combine_wavelengths,
+                   args.max_workers)
+    for job in jobs:
+        status = 'ok' if job['returncode'] == 0 else f"failed ({job['returncode']})"
+        print(f"{job['functional']:12s} {wavelength_label(job['wavelength']):>8s} nm  {job['wall time']:8.1f} s  {status}  {job['dir']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import numpy as np
 from pathlib import Path
+from output_scanner import scan_output
 
 ###############################################################################
 #                          MINIMAL NECESSARY FUNCTIONS                        #
@@ -22,31 +23,24 @@ def get_dipole_vector(filename):
     returning them as (x, y, z). Each is a small array, from which we later
     pick the 3rd column in tmole_vectors_to_3d_vec() if needed.
     """
-    with open(filename, "r") as inf:
-        reading_dipole = False
-        x = y = z = None
-        for line in inf:
-            if "dipole moment" in line:
-                # Start reading lines for x, y, z
-                reading_dipole = True
-                continue
-
-            if reading_dipole:
-                parts = line.split()
-                # Typically something like: " x   0.000000  0.000000  0.529177 "
-                if len(parts) == 4 and parts[0] in ["x", "y", "z"]:
-                    coord = parts[0]
-                    vals = np.array(parts[1:], dtype=float)
-                    if coord == "x":
-                        x = vals
-                    elif coord == "y":
-                        y = vals
-                    elif coord == "z":
-                        z = vals
-
-                # If all three found, return
-                if x is not None and y is not None and z is not None:
-                    return x, y, z
+    x = y = z = None
+    # Jump straight to the first "dipole moment" section and read the lines after it
+    for line in scan_output(filename).lines_from("dipole moment")[1:]:
+        parts = line.split()
+        # Typically something like: " x   0.000000  0.000000  0.529177 "
+        if len(parts) == 4 and parts[0] in ["x", "y", "z"]:
+            coord = parts[0]
+            vals = np.array(parts[1:], dtype=float)
+            if coord == "x":
+                x = vals
+            elif coord == "y":
+                y = vals
+            elif coord == "z":
+                z = vals
+
+        # If all three found, return
+        if x is not None and y is not None and z is not None:
+            return x, y, z
 
     return None
 
@@ -109,10 +103,56 @@ def calculate_angles_to_rotate_dipole_vector_on_z_axis(dipole_vector):
     return alpha, beta, gamma
 
 
+def rotate_to_dipole_frame(tensor, dipole_vector):
+    """
+    Rotates a 3x3x3 tensor into the frame whose z-axis lies along dipole_vector:
+    T'_{i j k} = sum_{p, q, r} R_{i p} R_{j q} R_{k r} T_{p q r}
+    """
+    alpha, beta, gamma = calculate_angles_to_rotate_dipole_vector_on_z_axis(dipole_vector)
+    R = Rzyx(-alpha, -beta, -gamma)
+    return np.einsum('ip,jq,kr,pqr->ijk', R, R, R, tensor)
+
+
 ###############################################################################
 #                 NEW FUNCTION: EXTRACT SPECIFIC PAIR FROM "hyperpols"        #
 ###############################################################################
 
+def ordinal(n):
+    """Convert an integer into its ordinal string: 1->'1st', 2->'2nd', 3->'3rd', etc."""
+    return (
+        f"{n}st" if (n % 10 == 1 and n % 100 != 11) else
+        f"{n}nd" if (n % 10 == 2 and n % 100 != 12) else
+        f"{n}rd" if (n % 10 == 3 and n % 100 != 13) else
+        f"{n}th"
+    )
+
+
+def get_pair_frequencies(filename: str = "hyperpols") -> np.ndarray:
+    """
+    Returns an (npairs, 2) array with the two frequencies (in a.u.) of every pair
+    listed in 'hyperpols' (or escf.out), in file order. Turbomole writes static
+    fields as a tiny finite frequency (45560000000 nm), which is kept as is.
+    """
+    index = scan_output(filename)
+    frequencies = []
+    for offset, _ in index.occurrences("pair of frequencies"):
+        for line in index.lines_at(offset, 8)[1:]:
+            if line.split()[:1] == ["Frequencies:"]:
+                frequencies.append([float(v) for v in line.split()[1:3]])
+                break
+    return np.array(frequencies).reshape(-1, 2)
+
+
+def get_all_hyper_polarizabilities(filename: str = "hyperpols") -> np.ndarray:
+    """
+    Returns an (npairs, 3, 3, 3) array (in a.u.) with the tensors of every pair in 'hyperpols',
+    in the same order as get_pair_frequencies().
+    """
+    npairs = scan_output(filename).count("pair of frequencies")
+    tensors = [get_hyper_polarizability_for_pair(n, filename) for n in range(1, npairs + 1)]
+    return np.array(tensors).reshape(-1, 3, 3, 3)
+
+
 def get_hyper_polarizability_for_pair(pair_number: int, filename: str = "hyperpols") -> np.ndarray:
     """
     Reads the file 'hyperpols' and returns a 3x3x3 NumPy array of hyperpolarizability
@@ -125,35 +165,22 @@ def get_hyper_polarizability_for_pair(pair_number: int, filename: str = "hyperpo
     Note: This function returns values in a.u.; do NOT multiply by any factor here
     if you will convert them later in your main code.
     """
-    def ordinal(n):
-        """Convert an integer into its ordinal string: 1->'1st', 2->'2nd', 3->'3rd', etc."""
-        return (
-            f"{n}st" if (n % 10 == 1 and n % 100 != 11) else
-            f"{n}nd" if (n % 10 == 2 and n % 100 != 12) else
-            f"{n}rd" if (n % 10 == 3 and n % 100 != 13) else
-            f"{n}th"
-        )
-
-    with open(filename, "r") as infile:
-        lines = infile.readlines()
+    index = scan_output(filename)
 
     target_string = f"{ordinal(pair_number)} pair of frequencies"
-    pair_line_index = None
+    pair_offset = None
 
     # Find the line containing "1st pair of frequencies", etc.
-    for i, line in enumerate(lines):
+    for offset, line in index.occurrences("pair of frequencies"):
         if target_string in line:
-            pair_line_index = i
+            pair_offset = offset
             break
 
-    if pair_line_index is None:
+    if pair_offset is None:
         raise ValueError(f"Could not find '{target_string}' in file '{filename}'.")
 
-    # Skip this line + 4 lines of frequency info
-    start_index = pair_line_index + 5
-    end_index = start_index + 9  # The next 9 lines contain hyperpolarizability data
-
-    hyperpol_lines = lines[start_index:end_index]
+    # Skip this line + 4 lines of frequency info; the next 9 lines contain hyperpolarizability data
+    hyperpol_lines = index.lines_at(pair_offset, 14)[5:]
     if len(hyperpol_lines) < 9:
         raise ValueError(
             f"Could not extract the 9 lines of hyperpolarizability data after '{target_string}'."
@@ -183,10 +210,55 @@ def get_hyper_polarizability_for_pair(pair_number: int, filename: str = "hyperpo
     return beta
 
 
+###############################################################################
+#          SPLITTING A MULTI-WAVELENGTH RUN INTO PER-WAVELENGTH PAIRS         #
+###############################################################################
+
+# Wavelength Turbomole uses for a static field in '$scfinstab hyperpol nm'
+STATIC_NM = 45560000000.0
+
+
+def pair_numbers_by_wavelength(wavelengths_nm, filename: str = "hyperpols") -> dict:
+    """
+    For an escf run with several wavelengths (plus the static field) in one '$scfinstab hyperpol nm'
+    block, returns {wavelength: {'static': n, 'eope': n, 'shg': n}} with the numbers (1st = 1) of the
+    pairs belonging to each wavelength: static (0; 0, 0), electro-optic Pockels (-w; w, 0) and second
+    harmonic generation (-2w; w, w). The static pair is shared; a pair that is missing is None.
+    """
+    frequencies = np.sort(get_pair_frequencies(filename), axis=1)
+
+    def find(omega_1, omega_2):
+        for n, pair in enumerate(frequencies, start=1):
+            if np.allclose(pair, sorted([omega_1, omega_2]), rtol=1e-6, atol=0.0):
+                return n
+        return None
+
+    static = float(nm_to_au(STATIC_NM))
+    pairs = {}
+    for wavelength in wavelengths_nm:
+        omega = float(nm_to_au(wavelength))
+        pairs[wavelength] = {'static': find(static, static), 'eope': find(static, omega), 'shg': find(omega, omega)}
+    return pairs
+
+
 ###############################################################################
 #                  HELPER FOR CONVERTING FROM a.u. TO 10^-30 ESU              #
 ###############################################################################
 
+# Photon energy in Hartree times wavelength in nm
+HARTREE_NM = 45.56335252767
+
+
+def nm_to_au(wavelength_nm):
+    """
+    Converts wavelengths in nm to photon energies in Hartree. Infinite or zero wavelengths give 0 (static).
+    """
+    wavelength_nm = np.asarray(wavelength_nm, dtype=float)
+    with np.errstate(divide='ignore'):
+        omega = HARTREE_NM / wavelength_nm
+    return np.where(np.isfinite(omega), omega, 0.0)
+
+
 def au_to_esu(value_au):
     """
     Converts hyperpolarizability from a.u. to 10^-30 esu in decimal form (no 'e-3').
@@ -227,21 +299,14 @@ def hyper_main(pair_number=2):
     x, y, z = dip_data
     dipole_vector = tmole_vectors_to_3d_vec(x, y, z)
 
-    # Calculate angles to align dipole_vector onto z-axis
-    alpha, beta, gamma = calculate_angles_to_rotate_dipole_vector_on_z_axis(dipole_vector)
-
     # Extract the chosen hyperpolarizability (in a.u.) from 'hyperpols'
     hyper_tensor_au = get_hyper_polarizability_for_pair(pair_number, hyper_file)
 
     # Convert from a.u. to 10^-30 esu
     hyper_tensor_esu = np.vectorize(au_to_esu)(hyper_tensor_au)
 
-    # Build rotation matrix for -alpha, -beta, -gamma
-    R = Rzyx(-alpha, -beta, -gamma)
-
-    # Rotate hyperpolarizability tensor:
-    # T'_{i j k} = \sum_{p, q, r} R_{i p} R_{j q} R_{k r} T_{p q r}
-    hyper_tensor_esu_rot = np.einsum('ip,jq,kr,pqr->ijk', R, R, R, hyper_tensor_esu)
+    # Rotate the tensor by the angles that align dipole_vector onto the z-axis
+    hyper_tensor_esu_rot = rotate_to_dipole_frame(hyper_tensor_esu, dipole_vector)
 
     # Finally, extract beta_zzz in the rotated coordinate system
     beta_zzz = hyper_tensor_esu_rot[2, 2, 2]
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import signal
+import threading
+from contextlib import contextmanager
+
+###############################################################################
+#      LIVE MONITORING OF ridft/dscf/escf OUTPUTS WITH EARLY ABORT RULES      #
+###############################################################################
+
+# Defaults for the early abort rules; override single entries via 'Early abort rules'
+# under 'DFT options' in rendered_wano.yml.
+DEFAULT_RULES = {
+    'min iterations': 10,          # no rule is applied before this iteration
+    'max energy rise': 1.0,        # Eh above the lowest SCF energy seen so far
+    'max norm growth': 1.0e4,      # factor above the lowest density change / residual norm seen so far
+    'stagnation window': 150,      # iterations ...
+    'stagnation factor': 0.5,      # ... within which the lowest norm has to drop by at least this factor
+    'poll interval': 2.0,          # seconds between reads of the output file
+}
+
+_FLOAT = r'[-+]?\d*\.\d+(?:[DdEe][-+]?\d+)?'
+_SCF_ITERATION = re.compile(rf'^\s*(\d+)\s+({_FLOAT})\s+{_FLOAT}\s+{_FLOAT}\s+({_FLOAT})')
+_ESCF_ITERATION = re.compile(rf'^\s*(\d+)\s+\w+\s+(\d+)\s+({_FLOAT})\s*$')
+
+MONITORED_PROGRAMS = ('ridft', 'dscf', 'escf')
+
+
+def _fortran_float(token: str) -> float:
+    return float(token.replace('D', 'E').replace('d', 'e'))
+
+
+class OutputMonitor:
+    """
+    Follows a growing Turbomole output file. Every completed line is parsed for SCF iterations
+    (energy and NORM[dD(SAO)]) or escf iterations (max. residual norm); each iteration is appended
+    to a JSON-lines metrics file and checked against the abort rules. `abort_reason` is set on the
+    first rule that fires. escf solves one response equation after the other (and repeats them on
+    the fine grid), so the rules only look at the iterations since the last table header.
+    """
+
+    def __init__(self, program: str, filename: str, metrics_file: str = None, rules: dict = None):
+        self.program = program
+        self.filename = filename
+        self.metrics_file = metrics_file or f'{os.path.splitext(filename)[0]}.metrics.jsonl'
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.iterations = []
+        self.segment = []
+        self.abort_reason = None
+        self._position = 0
+        self._partial = ''
+        self._in_scf_table = False
+        self._start = time.time()
+        # A fresh metrics stream for every run
+        open(self.metrics_file, 'w').close()
+
+    def poll(self) -> list:
+        """
+        Reads what was appended to the output since the last call. Returns the new iteration records.
+        """
+        if not os.path.isfile(self.filename):
+            return []
+        with open(self.filename, 'r', errors='replace') as infile:
+            infile.seek(self._position)
+            chunk = infile.read()
+            self._position = infile.tell()
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+
+        records = []
+        for line in lines:
+            record = self._parse_line(line)
+            if record is not None:
+                records.append(record)
+                self.iterations.append(record)
+                self.segment.append(record)
+        if records:
+            with open(self.metrics_file, 'a') as outfile:
+                for record in records:
+                    outfile.write(json.dumps(record) + '\n')
+            if self.abort_reason is None:
+                self.abort_reason = self.check_rules()
+        return records
+
+    def _parse_line(self, line: str) -> dict:
+        record = None
+        if self.program == 'escf':
+            if line.lstrip().startswith('Iteration IRREP'):
+                self.segment = []
+            match = _ESCF_ITERATION.match(line)
+            if match:
+                record = {'iteration': int(match.group(1)), 'converged roots': int(match.group(2)),
+                          'norm': _fortran_float(match.group(3))}
+        elif line.lstrip().startswith('ITERATION'):
+            self._in_scf_table = True
+        elif self._in_scf_table:
+            self._in_scf_table = False
+            match = _SCF_ITERATION.match(line)
+            if match:
+                record = {'iteration': int(match.group(1)), 'energy': float(match.group(2)),
+                          'norm': _fortran_float(match.group(3))}
+        if record is not None:
+            record.update({'program': self.program, 'elapsed': round(time.time() - self._start, 2)})
+        return record
+
+    def check_rules(self) -> str:
+        """
+        Returns a description of the first violated abort rule, or None.
+        """
+        rules = self.rules
+        if len(self.segment) < rules['min iterations']:
+            return None
+        last = self.segment[-1]
+
+        energies = [it['energy'] for it in self.segment if 'energy' in it]
+        if energies and energies[-1] > min(energies) + rules['max energy rise']:
+            return (f"diverging: energy {energies[-1]:.6f} is more than {rules['max energy rise']} Eh "
+                    f"above the lowest energy {min(energies):.6f}")
+
+        # The first SCF iteration has no density change yet
+        norms = [it['norm'] for it in self.segment if it['norm'] > 0]
+        if norms and last['norm'] > min(norms) * rules['max norm growth']:
+            return f"diverging: norm {last['norm']:.3e} grew more than {rules['max norm growth']:g}x above {min(norms):.3e}"
+
+        window = rules['stagnation window']
+        if len(norms) > window:
+            before, recent = min(norms[:-window]), min(norms[-window:])
+            if recent > before * rules['stagnation factor']:
+                return f"stagnating: lowest norm {recent:.3e} in the last {window} iterations vs. {before:.3e} before"
+        return None
+
+
+def _kill_group(process, signum: int) -> None:
+    try:
+        os.killpg(process.pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+@contextmanager
+def forwarded_signals(process, signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    Forwards SIGINT/SIGTERM sent to this script to the process group of `process`, which runs in its
+    own session and so is no longer reached by Ctrl-C or the batch system, then handles the signal as
+    before. If the block is left while the process still runs, its group is terminated.
+    """
+    handlers = {}
+
+    def forward(signum, frame):
+        previous = handlers[signum]
+        if previous == signal.SIG_IGN:
+            return
+        _kill_group(process, signum)
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    # Signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        handlers = {signum: signal.signal(signum, forward) for signum in signals}
+    try:
+        yield
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if process.poll() is None:
+            _kill_group(process, signal.SIGTERM)
+            process.wait()
+
+
+def watch_process(process, monitor: OutputMonitor) -> str:
+    """
+    Polls `monitor` while `process` runs and kills the process group as soon as an abort rule fires.
+    Returns the abort reason, or None if the process ended on its own.
+    """
+    while process.poll() is None:
+        monitor.poll()
+        if monitor.abort_reason:
+            _kill_group(process, signal.SIGTERM)
+            process.wait()
+            return monitor.abort_reason
+        time.sleep(monitor.rules['poll interval'])
+    monitor.poll()
+    return None
@@ -0,0 +1,236 @@
+import os
+import shutil
+import numpy as np
+from pathlib import Path
+from checkpoints import file_digest
+from control_file import edit_control
+from turbomole_matrices import load_matrix, matrix_file
+from warm_start import read_coord_block
+
+###############################################################################
+#     GEOMETRY OPTIMIZATION: HESSIAN SEEDING AND RESUMING INTERRUPTED RUNS     #
+###############################################################################
+
+PROGRESS_DIR = '.opt_progress'
+SEED_DIR = '.hessian_seed'
+
+# Files that carry an optimization from one step to the next: the current structure, the
+# energy/gradient history used by the update and the approximate Hessian
+PROGRESS_FILES = ('coord', 'energy', 'gradient', 'hessapprox', 'forceapprox')
+
+# Preference order of Hessian sources; within one kind the closest geometry wins
+HESSIAN_KINDS = ('exact', 'approximate', 'transferred')
+SAME_GEOMETRY_RMSD = 1e-3  # bohr
+MAX_TRANSFER_RMSD = 0.3  # bohr
+# Eigenvalues of a seed Hessian are kept at least this large, so that the projected-out
+# translations/rotations and any negative curvature do not produce huge first steps
+MIN_EIGENVALUE = 0.005  # Hartree/bohr^2
+
+
+def read_hessapprox(filename) -> np.ndarray:
+    """
+    Returns the full symmetric matrix of a '$hessapprox' file (lower triangle packed row by row).
+    """
+    values = []
+    with open(filename, 'r') as infile:
+        for line in infile:
+            if line.startswith('$'):
+                continue
+            values.extend(float(v.replace('D', 'E')) for v in line.split())
+    n = int(round((np.sqrt(8 * len(values) + 1) - 1) / 2))
+    hessian = np.zeros((n, n))
+    hessian[np.tril_indices(n)] = values
+    return hessian + np.tril(hessian, -1).T
+
+
+def _fortran_d(value: float) -> str:
+    """
+    Formats a number the way Turbomole writes $hessapprox, e.g. 0.498772738321D+00.
+    """
+    if value == 0.0:
+        return '0.000000000000D+00'
+    mantissa, exponent = f'{value:.11E}'.split('E')
+    sign = '-' if mantissa.startswith('-') else ''
+    return f"{sign}0.{mantissa.lstrip('-').replace('.', '')}D{int(exponent) + 1:+03d}"
+
+
+def write_hessapprox(hessian: np.ndarray, filename: str = 'hessapprox') -> None:
+    """
+    Writes a symmetric matrix as a '$hessapprox' file, four values per line.
+    """
+    values = [_fortran_d(v) for v in hessian[np.tril_indices(len(hessian))]]
+    with open(filename, 'w') as outfile:
+        outfile.write('$hessapprox\n')
+        for i in range(0, len(values), 4):
+            outfile.write(''.join(f'{v:>20s}' for v in values[i:i + 4]) + '\n')
+        outfile.write('$end\n')
+
+
+def align(target: np.ndarray, source: np.ndarray) -> tuple:
+    """
+    Returns (rotation, RMSD in bohr) of the best superposition of `source` onto `target` (Kabsch),
+    both (N, 3) and centered on their centroids.
+    """
+    target, source = target - target.mean(axis=0), source - source.mean(axis=0)
+    u, _, vt = np.linalg.svd(source.T @ target)
+    d = np.sign(np.linalg.det(vt.T @ u.T))
+    rotation = vt.T @ np.diag([1.0, 1.0, d]) @ u.T
+    rmsd = np.sqrt(np.mean(np.sum((source @ rotation.T - target) ** 2, axis=1)))
+    return rotation, float(rmsd)
+
+
+def rotate_hessian(hessian: np.ndarray, rotation: np.ndarray) -> np.ndarray:
+    """
+    Returns the Cartesian Hessian of a rotated molecule: every 3x3 atom block becomes R H R^T.
+    """
+    natoms = len(hessian) // 3
+    blocks = hessian.reshape(natoms, 3, natoms, 3)
+    return np.einsum('ij,ajbk,lk->aibl', rotation, blocks, rotation).reshape(hessian.shape)
+
+
+def regularize(hessian: np.ndarray, min_eigenvalue: float = MIN_EIGENVALUE) -> np.ndarray:
+    """
+    Returns the positive definite matrix with the eigenvectors of `hessian` and its eigenvalues
+    replaced by max(|eigenvalue|, min_eigenvalue).
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh((hessian + hessian.T) / 2)
+    eigenvalues = np.maximum(np.abs(eigenvalues), min_eigenvalue)
+    return (eigenvectors * eigenvalues) @ eigenvectors.T
+
+
+def _hessian_files(directory: Path) -> dict:
+    """
+    Returns the exact and approximate Hessian files of a calculation directory, by kind.
+    """
+    files = {}
+    exact = matrix_file('hessian', directory)
+    if exact is not None:
+        files['exact'] = exact
+    if (directory / 'hessapprox').is_file():
+        files['approximate'] = directory / 'hessapprox'
+    return files
+
+
+def find_hessian(coord_file: str = 'coord', sources=('.',), max_rmsd: float = MAX_TRANSFER_RMSD) -> dict:
+    """
+    Searches the calculation directories `sources` for a Hessian of the same molecule and returns the
+    best one: an exact (aoforce) Hessian at this geometry, then a previous approximate Hessian, then an
+    exact Hessian of a similar geometry (RMSD after superposition up to `max_rmsd`). Returns None if
+    there is none; otherwise a record with its kind, file, RMSD and the rotation onto this geometry.
+    """
+    elements, positions = read_coord_block(coord_file)
+    candidates = []
+    for directory in map(Path, sources):
+        if not (directory / 'coord').is_file():
+            continue
+        source_elements, source_positions = read_coord_block(directory / 'coord')
+        if source_elements != elements:
+            continue
+        rotation, rmsd = align(positions, source_positions)
+        if rmsd > max_rmsd:
+            continue
+        for kind, path in _hessian_files(directory).items():
+            if kind == 'exact' and rmsd > SAME_GEOMETRY_RMSD:
+                kind = 'transferred'
+            candidates.append((HESSIAN_KINDS.index(kind), rmsd, str(path), kind, rotation))
+    if not candidates:
+        return None
+    _, rmsd, path, kind, rotation = min(candidates, key=lambda c: c[:3])
+    return {'kind': kind, 'source': path, 'rmsd': rmsd, 'rotation': rotation}
+
+
+def seed_hessian(coord_file: str = 'coord', sources=('.',), max_rmsd: float = MAX_TRANSFER_RMSD) -> dict:
+    """
+    Writes the best available Hessian (see find_hessian) as 'hessapprox' and points $hessapprox at it,
+    so that statpt starts from it instead of its default guess. Returns the record of the seed
+    (kind, source, RMSD), or None if no Hessian was found.
+    """
+    found = find_hessian(coord_file, sources, max_rmsd)
+    if found is None:
+        return None
+    if found['kind'] == 'approximate':
+        hessian = read_hessapprox(found['source'])
+    else:
+        hessian = load_matrix(found['source'])
+    if len(hessian) != 3 * len(read_coord_block(coord_file)[0]):
+        # e.g. a $hessapprox in internal coordinates
+        print(f"Hessian in {found['source']} is not Cartesian, not used.")
+        return None
+    write_hessapprox(regularize(rotate_hessian(hessian, found['rotation'])))
+    with edit_control() as control:
+        control.set('hessapprox', 'file=hessapprox')
+    print(f"Seeding the optimization with the {found['kind']} Hessian from {found['source']}.")
+    return {'kind': found['kind'], 'source': found['source'], 'rmsd': found['rmsd']}
+
+
+def stash_hessian_sources(directory: str) -> None:
+    """
+    Keeps the structure and Hessians of a previous calculation (unpacked in `directory`) in SEED_DIR,
+    as Hessian source for the optimization of a follow-up calculation.
+    """
+    if not os.path.isfile(os.path.join(directory, 'coord')):
+        return
+    os.makedirs(SEED_DIR, exist_ok=True)
+    for filename in ('coord', 'hessian', 'hessapprox'):
+        if os.path.isfile(os.path.join(directory, filename)):
+            shutil.copyfile(os.path.join(directory, filename), os.path.join(SEED_DIR, filename))
+
+
+def save_progress() -> None:
+    """
+    Called before anything else touches the files: if an optimization was interrupted (it started,
+    see resume_progress, and never finished), copies its current structure, energy/gradient history
+    and approximate Hessian to PROGRESS_DIR before restored stage snapshots overwrite them.
+    """
+    if not os.path.isfile(os.path.join(PROGRESS_DIR, 'start')):
+        return
+    if not os.path.isfile('GEO_OPT_RUNNING') and not os.path.isfile('GEO_OPT_FAILED'):
+        return
+    for filename in PROGRESS_FILES:
+        if os.path.isfile(filename):
+            shutil.copyfile(filename, os.path.join(PROGRESS_DIR, filename))
+
+
+def resume_progress(coord_file: str = 'coord') -> bool:
+    """
+    Continues an interrupted optimization that started from the same structure: puts back its last
+    structure, energy/gradient history and approximate Hessian. Otherwise records the starting
+    structure for a later restart. Returns True if the optimization is resumed.
+    """
+    start = file_digest(coord_file)
+    start_file = os.path.join(PROGRESS_DIR, 'start')
+    resumed = False
+    if os.path.isfile(start_file):
+        with open(start_file, 'r') as infile:
+            resumed = infile.read().strip() == start and os.path.isfile(os.path.join(PROGRESS_DIR, coord_file))
+    if resumed:
+        for filename in PROGRESS_FILES:
+            if os.path.isfile(os.path.join(PROGRESS_DIR, filename)):
+                shutil.copyfile(os.path.join(PROGRESS_DIR, filename), filename)
+        for filename in ('GEO_OPT_RUNNING', 'GEO_OPT_FAILED'):
+            if os.path.isfile(filename):
+                os.remove(filename)
+        print('Resuming the interrupted structure optimisation.')
+        return True
+    shutil.rmtree(PROGRESS_DIR, ignore_errors=True)
+    os.makedirs(PROGRESS_DIR)
+    with open(start_file, 'w') as outfile:
+        outfile.write(start + '\n')
+    return False
+
+
+def finish_progress() -> None:
+    """
+    Removes the progress record of a finished optimization.
+    """
+    shutil.rmtree(PROGRESS_DIR, ignore_errors=True)
+
+
+def optimization_cycles(energy_file: str = 'energy') -> int:
+    """
+    Returns the number of geometry steps in the energy history (one line per step).
+    """
+    if not os.path.isfile(energy_file):
+        return 0
+    with open(energy_file, 'r') as infile:
+        return sum(1 for line in infile if line.strip() and not line.startswith('$'))
@@ -0,0 +1,135 @@
+import os
+import re
+import mmap
+
+
+###############################################################################
+#                 OFFSET INDEX FOR TURBOMOLE OUTPUT FILES                     #
+###############################################################################
+
+# Section markers recorded on every scan. Extractors jump to the byte offset of
+# the line holding the marker instead of walking the file from the top.
+DEFAULT_MARKERS = (
+    'dipole moment',
+    'convergence criteria',
+    'pair of frequencies',
+    'Electronic dipole hyperpolarizability',
+    'HOMO-LUMO Separation',
+    'zero point',
+    'frequency  ',
+    '$dipole',
+    'all done',
+)
+
+_INDEX_CACHE = {}
+
+
+class OutputIndex:
+    """
+    Byte offsets of the known section markers in one output file.
+    The file is mapped once and scanned in a single pass; the offsets stored
+    for a marker are the starts of the lines that contain it, in file order.
+    """
+
+    def __init__(self, filename: str, markers: tuple = DEFAULT_MARKERS):
+        self.filename = filename
+        self.markers = tuple(markers)
+        self.offsets = {marker: [] for marker in self.markers}
+        self._scan()
+
+    def _scan(self) -> None:
+        """
+        Maps the file and records the line offsets of all markers with one regex pass.
+        """
+        if os.path.getsize(self.filename) == 0:
+            return
+        by_bytes = {marker.encode(): marker for marker in self.markers}
+        pattern = re.compile(b'|'.join(re.escape(m) for m in sorted(by_bytes, key=len, reverse=True)))
+        with open(self.filename, 'rb') as infile:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                last_line = {}
+                for match in pattern.finditer(data):
+                    line_start = data.rfind(b'\n', 0, match.start()) + 1
+                    marker = by_bytes[match.group()]
+                    # A marker repeated on the same line is recorded once
+                    if last_line.get(marker) != line_start:
+                        self.offsets[marker].append(line_start)
+                        last_line[marker] = line_start
+
+    def has(self, marker: str) -> bool:
+        """
+        Returns True if the marker occurs at least once in the file.
+        """
+        return bool(self.offsets.get(marker))
+
+    def count(self, marker: str) -> int:
+        """
+        Returns the number of lines containing the marker.
+        """
+        return len(self.offsets.get(marker, []))
+
+    def find(self, marker: str, occurrence: int = 0) -> int:
+        """
+        Returns the byte offset of the line holding the given occurrence of the marker,
+        or None if there is no such occurrence.
+        """
+        positions = self.offsets.get(marker, [])
+        if -len(positions) <= occurrence < len(positions):
+            return positions[occurrence]
+        return None
+
+    def lines_at(self, offset: int, count: int = None) -> list:
+        """
+        Returns up to `count` decoded lines starting at the byte offset
+        (all remaining lines if `count` is None).
+        """
+        lines = []
+        with open(self.filename, 'rb') as infile:
+            infile.seek(offset)
+            for raw_line in infile:
+                lines.append(raw_line.decode('utf-8', errors='replace'))
+                if count is not None and len(lines) >= count:
+                    break
+        return lines
+
+    def lines_from(self, marker: str, occurrence: int = 0, count: int = None) -> list:
+        """
+        Returns up to `count` decoded lines starting with the line that holds the marker.
+        Returns an empty list if the marker is missing.
+        """
+        offset = self.find(marker, occurrence)
+        if offset is None:
+            return []
+        return self.lines_at(offset, count)
+
+    def occurrences(self, marker: str) -> list:
+        """
+        Returns (offset, line) for every line containing the marker, in file order.
+        """
+        entries = []
+        with open(self.filename, 'rb') as infile:
+            for offset in self.offsets.get(marker, []):
+                infile.seek(offset)
+                entries.append((offset, infile.readline().decode('utf-8', errors='replace')))
+        return entries
+
+    def marker_lines(self, marker: str) -> list:
+        """
+        Returns every line containing the marker, in file order.
+        """
+        return [line for _, line in self.occurrences(marker)]
+
+
+def scan_output(filename: str, markers: tuple = DEFAULT_MARKERS) -> OutputIndex:
+    """
+    Returns the OutputIndex for `filename`, scanning it only if it changed since the last call.
+    Repeated extractors on the same unchanged file therefore share a single pass.
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), tuple(markers))
+    cached = _INDEX_CACHE.get(key)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    index = OutputIndex(filename, markers)
+    _INDEX_CACHE[key] = ((stat.st_mtime_ns, stat.st_size), index)
+    return index
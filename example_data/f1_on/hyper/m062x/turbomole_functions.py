@@ -1,9 +1,15 @@
 import os
 import glob
 import sys
+import json
+import shutil
 import yaml
 import subprocess
 import numpy as np
+from output_scanner import scan_output, DEFAULT_MARKERS
+from monitor import OutputMonitor, MONITORED_PROGRAMS, forwarded_signals, watch_process
+from control_file import edit_control
+from telemetry import measured_call
 
 
 def utf8_enc(var: str) -> bytes:
@@ -32,19 +38,13 @@ def homo_lumo_numbers_from_orbitals(file_name: str, search_string: str) -> tuple
     """
     Searches for the given string in the specified file and returns the HOMO and LUMO orbital numbers.
     """
-    line_number = 0
-    list_of_results = []
-    with open(file_name, 'r') as read_obj:
-        for line in read_obj:
-            if search_string in line:
-                list_of_results.append((line_number, line.rstrip()))
-            line_number += 1
+    markers = DEFAULT_MARKERS if search_string in DEFAULT_MARKERS else DEFAULT_MARKERS + (search_string,)
+    content = scan_output(file_name, markers).lines_from(search_string, count=3)
+    if len(content) < 3:
+        raise ValueError(f"'{search_string}' section not found in {file_name}.")
 
-    with open(file_name, 'r') as file:
-        content = file.readlines()
-
-    homo_line = int(content[list_of_results[0][0] + 1].split()[2])
-    lumo_line = int(content[list_of_results[0][0] + 2].split()[2])
+    homo_line = int(content[1].split()[2])
+    lumo_line = int(content[2].split()[2])
 
     return homo_line, lumo_line
 
@@ -105,8 +105,8 @@ def make_define_string(settings: dict, coord: str) -> str:
         output_files = ['alpha', 'auxbasis', 'basis', 'beta', 'control', 'hessapprox', 'mos']
         for filename in output_files:
             if os.path.isfile('old_results/%s' % (filename)):
-                os.system('cp old_results/%s .' % (filename))
-        os.system('cp coord_0 coord')
+                shutil.copyfile('old_results/%s' % (filename), filename)
+        shutil.copyfile('coord_0', 'coord')
         define_string = '\n\n\n\n\n'
         if settings['use ri']:
             define_string += 'ri\non\nm %i\n\n' % (settings['ricore'])
@@ -122,9 +122,10 @@ def make_define_string(settings: dict, coord: str) -> str:
 
         if not settings['tddft']:
             if old_settings['Type of calculation']['Excited states calculation']:
-                os.system("sed -i 's/#$max/$max/g' control")
-                for dg in ['soes', 'scfinstab', 'rpacor', 'denconv']:
-                    os.system('kdg %s' % (dg))
+                with edit_control() as control:
+                    control.reactivate('max')
+                    for dg in ['soes', 'scfinstab', 'rpacor', 'denconv']:
+                        control.delete(dg)
 
         elif not old_settings['Type of calculation']['Excited states calculation']:
             define_string += 'ex\n'
@@ -157,13 +158,15 @@ def input_preparation(program: str, input_string: str) -> None:
     Captures output into an .out file and prints errors if they occur.
     """
     outfilename = '%s.out' % program
-    process = subprocess.Popen(
-        [program], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    out, err = process.communicate(input=utf8_enc(input_string))
+    with measured_call(program, outfilename) as record:
+        process = subprocess.Popen(
+            [program], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        out, err = process.communicate(input=utf8_enc(input_string))
 
-    with open(outfilename, 'w') as outfile:
-        outfile.write(utf8_dec(out))
+        with open(outfilename, 'w') as outfile:
+            outfile.write(utf8_dec(out))
+        record['exit code'] = process.returncode
 
     if 'normally' not in utf8_dec(err).split():
         print(f'An error occurred when running {program}:')
@@ -173,42 +176,138 @@ def input_preparation(program: str, input_string: str) -> None:
             print(line)
 
 
-def single_point_calculation(settings: dict, tmp: bool = False) -> None:
+# Escalation ladder for SCF runs that do not converge (or are stopped early by the monitor):
+# one step per failed attempt, each applied on top of the previous ones. A value of None removes
+# the datagroup. The last step restarts from the MOs of the attempt that got closest to convergence.
+SCF_ESCALATION = (
+    ('damping', {'scfdamp': 'start=0.700  step=0.050  min=0.300'}),
+    ('orbital shift', {'scforbitalshift': 'closedshell=0.4'}),
+    ('small diis space', {'scfdiis': 'maxiter=3'}),
+    ('fermi smearing', {'fermi': 'tmstrt=500.00 tmend=50.00 tmfac=0.950 hlcrt=1.0E-01 stop=1.0E-03'}),
+    ('best density restart', {'fermi': None}),
+)
+MO_FILES = ('mos', 'alpha', 'beta')
+
+
+def _attempt_metrics(output_file: str) -> tuple:
+    """
+    Returns (iterations, last density change) of the SCF run whose metrics were streamed next to `output_file`.
+    """
+    metrics_file = os.path.splitext(output_file)[0] + '.metrics.jsonl'
+    if not os.path.isfile(metrics_file):
+        return None, None
+    with open(metrics_file, 'r') as infile:
+        records = [json.loads(line) for line in infile if line.strip()]
+    if not records:
+        return 0, None
+    return len(records), records[-1]['norm']
+
+
+def _escalate(step: int, original: dict) -> str:
+    """
+    Applies escalation step `step` to control, remembering the original datagroups in `original`.
+    Returns the name of the step.
+    """
+    name, edits = SCF_ESCALATION[step]
+    with edit_control() as control:
+        for datagroup, value in edits.items():
+            if datagroup not in original:
+                header = control.header(datagroup)
+                original[datagroup] = None if header is None else (header[len(datagroup):].strip(), control.get(datagroup))
+            if value is None:
+                control.delete(datagroup)
+            else:
+                control.set(datagroup, value)
+    if name == 'best density restart':
+        for mo_file in MO_FILES:
+            if os.path.isfile(mo_file + '.best'):
+                shutil.copyfile(mo_file + '.best', mo_file)
+    return name
+
+
+def _restore_control(original: dict) -> None:
+    """
+    Puts back the datagroups changed by the escalation ladder.
+    """
+    if not original:
+        return
+    with edit_control() as control:
+        for datagroup, saved in original.items():
+            if saved is None:
+                control.delete(datagroup)
+            else:
+                control.set(datagroup, saved[0], body=saved[1])
+
+
+def single_point_calculation(settings: dict, tmp: bool = False, attempts_log: list = None) -> int:
     """
     Performs a single-point SCF calculation using either 'ridft' or 'dscf' based on the settings.
     If TDDFT is requested, performs an excited states calculation using 'escf'.
+    Unconverged attempts climb the SCF_ESCALATION ladder; every attempt (step, iterations,
+    last density change) is appended to `attempts_log`. Once converged, control is restored.
+    Returns the total number of SCF iterations over all restarts.
     """
     scf_program = 'ridft' if settings['use ri'] else 'dscf'
     suffix = '_tmp' if tmp else ('_0' if settings['opt'] else '')
 
     output = scf_program + suffix + '.out'
+    attempts_log = [] if attempts_log is None else attempts_log
 
     num_iter = 0
     done = False
+    step_name, next_step = 'default', 0
+    best_norm = None
+    original = {}
     while not done:
-        run_turbomole(scf_program, output)
+        abort_reason = run_turbomole(scf_program, output, settings.get('monitor rules'))
         os.system('eiger > eiger.out')
         done, err = check_scf(output)
+        iterations, last_norm = _attempt_metrics(output)
+        if done:
+            iterations = scf_iterations(output)
+        attempts_log.append({'step': step_name, 'iterations': iterations, 'last norm': last_norm,
+                             'converged': done, 'stopped early': abort_reason})
+        print(f'SCF attempt ({step_name}): {iterations} iterations, converged: {done}')
         if not done:
-            if err == 'not converged':
-                num_iter += settings['scf iter']
+            if err == 'not converged' or abort_reason:
+                num_iter += iterations if iterations is not None else settings['scf iter']
                 if num_iter > settings['max scf iter']:
                     print(
                         f'SCF not converged in maximum number of iterations ({settings["max scf iter"]})'
                     )
                     sys.exit(0)
+                if last_norm is not None and (best_norm is None or last_norm < best_norm):
+                    best_norm = last_norm
+                    for mo_file in MO_FILES:
+                        if os.path.isfile(mo_file):
+                            shutil.copyfile(mo_file, mo_file + '.best')
+                if next_step < len(SCF_ESCALATION):
+                    step_name = _escalate(next_step, original)
+                    next_step += 1
+                elif abort_reason:
+                    print(f'SCF stopped early ({abort_reason}) - please check manually')
+                    sys.exit(0)
             elif err == 'negative HLG':
                 print('Attention: negative HOMO-LUMO gap found - please check manually')
                 sys.exit(0)
+    _restore_control(original)
+    for mo_file in MO_FILES:
+        if os.path.isfile(mo_file + '.best'):
+            os.remove(mo_file + '.best')
 
     if settings['tddft']:
         escf_output = 'escf' + suffix + '.out'
-        run_turbomole('escf', escf_output)
+        abort_reason = run_turbomole('escf', escf_output, settings.get('monitor rules'))
+        if abort_reason:
+            print(f'escf stopped early ({abort_reason}) - please check manually')
+            sys.exit(0)
         done, err = check_escf(output)
         if not done:
             print('Problem with escf calculation found - please check manually')
             sys.exit(0)
 
+    return num_iter + scf_iterations(output)
+
 
 def run_aoforce() -> None:
     """
@@ -225,11 +324,14 @@ def plot_homo_lumo_orbitals() -> None:
     run_turbomole('riper -proper', 'riper.out')
 
 
-def hyper_polarizability_calculation() -> None:
+def hyper_polarizability_calculation(monitor_rules: dict = None) -> None:
     """
     Runs an excited state calculation using 'escf' for hyperpolarizability calculations.
     """
-    run_turbomole('escf', 'escf.out')
+    abort_reason = run_turbomole('escf', 'escf.out', monitor_rules)
+    if abort_reason:
+        print(f'escf stopped early ({abort_reason}) - please check manually')
+        sys.exit(0)
 
 
 def jobex(settings: dict) -> None:
@@ -297,10 +399,14 @@ def jobex(settings: dict) -> None:
 #         sys.exit(0)
 
 
-def run_turbomole(command: str, outfile: str = None) -> None:
+def run_turbomole(command: str, outfile: str = None, monitor_rules: dict = None) -> str:
     """
     Runs a TURBOMOLE command with shell=True so we can use nohup and redirection.
     E.g., command='nohup riper -proper > riper.out 2>&1 &'.
+    The outputs of ridft, dscf and escf are followed while the program runs: every iteration goes
+    to '<outfile>.metrics.jsonl' and the run is killed as soon as one of the early abort rules
+    (see monitor.DEFAULT_RULES, overridden by `monitor_rules`) fires.
+    Returns the reason for an early abort, or None.
     """
     if outfile is None:
         outfile = command.split()[0] + '.out'
@@ -316,17 +422,30 @@ def run_turbomole(command: str, outfile: str = None) -> None:
     shell_cmd = f"nohup {command} > {outfile} 2>&1"
 
     print(f"Running in shell: {shell_cmd}")
-    process = subprocess.Popen(shell_cmd, shell=True, stderr=subprocess.PIPE)
-    _, err = process.communicate()
-
-    if process.returncode != 0:
-        # parse error message if needed
-        err_decoded = err.decode(errors='replace')
-        print(f"Error while running {command}, retcode={process.returncode}:")
-        print(err_decoded)
-        sys.exit(process.returncode)
+    with measured_call(command, outfile) as record:
+        # Own process group, so that an early abort also stops the program behind nohup;
+        # signals sent to this script are passed on to that group
+        process = subprocess.Popen(shell_cmd, shell=True, stderr=subprocess.PIPE, start_new_session=True)
+        with forwarded_signals(process):
+            program = command.split()[0]
+            if program in MONITORED_PROGRAMS:
+                abort_reason = watch_process(process, OutputMonitor(program, outfile, rules=monitor_rules))
+                if abort_reason:
+                    print(f"{command} stopped early: {abort_reason}")
+                    record['stopped early'] = abort_reason
+                    return abort_reason
+            _, err = process.communicate()
+        record['exit code'] = process.returncode
+
+        if process.returncode != 0:
+            # parse error message if needed
+            err_decoded = err.decode(errors='replace')
+            print(f"Error while running {command}, retcode={process.returncode}:")
+            print(err_decoded)
+            sys.exit(process.returncode)
 
     print(f"{command} ended normally, see {outfile}")
+    return None
 
 
 
@@ -336,41 +455,40 @@ def check_scf(output_file: str) -> tuple:
     Returns a tuple (converged, error_message).
     """
     converged = False
-    with open(output_file, 'r') as infile:
-        for line in infile:
-            if 'convergence criteria cannot be satisfied' in line:
-                converged = False
-                break
-            if 'convergence criteria satisfied' in line:
-                converged = True
-                break
+    criteria_lines = scan_output(output_file).marker_lines('convergence criteria')
+    if criteria_lines:
+        converged = 'convergence criteria satisfied' in criteria_lines[0]
 
     if not converged:
         return False, 'not converged'
     else:
         hlg = None
-        with open('eiger.out', 'r') as infile:
-            for line in infile:
-                if 'Gap' in line:
-                    hlg = float(line.split()[-2])
-                    break
+        for line in scan_output('eiger.out').lines_from('HOMO-LUMO Separation', count=4):
+            if 'Gap' in line:
+                hlg = float(line.split()[-2])
+                break
         if hlg is not None and hlg < 0:
             return False, 'negative HLG'
         else:
             return True, None
 
 
+def scf_iterations(output_file: str) -> int:
+    """
+    Returns the number of iterations after which the SCF in `output_file` converged, or None.
+    """
+    criteria_lines = scan_output(output_file).marker_lines('convergence criteria')
+    if criteria_lines and 'satisfied after' in criteria_lines[0]:
+        return int(criteria_lines[0].split()[-2])
+    return None
+
+
 def check_escf(output_file: str) -> tuple:
     """
     Checks if the excited state calculation using escf has successfully completed.
     Returns a tuple (done, error_message).
     """
-    done = False
-    with open(output_file, 'r') as infile:
-        for line in infile:
-            if 'all done' in line:
-                done = True
-                break
+    done = scan_output(output_file).has('all done')
     return done, None
 
 
@@ -402,21 +520,19 @@ def get_hyper_polarizability_2nd_pair() -> np.ndarray:
     """
     Extracts and returns the electronic dipole hyperpolarizability tensor for the 2nd pair of frequencies from 'escf.out'.
     """
-    with open("escf.out", "r") as infile:
-        escf_data = infile.readlines()
+    index = scan_output("escf.out")
+
+    # Offsets of the 2nd and (if present) 3rd pair delimit the section to search
+    pairs = index.occurrences("pair of frequencies")
+    begin_pair = next((offset for offset, line in pairs if "2nd pair" in line), None)
+    end_pair = next((offset for offset, _ in pairs if begin_pair is not None and offset > begin_pair), None)
 
-    # Variables to keep track of the sections
-    in_2nd_pair = False
     begin_hyper_pol = None
-    for i, line in enumerate(escf_data):
-        if "2nd pair of frequencies" in line:
-            in_2nd_pair = True
-        elif "Electronic dipole hyperpolarizability" in line and in_2nd_pair:
-            begin_hyper_pol = i + 4  # The data starts 4 lines after this line
-            break
-        elif "3rd pair of frequencies" in line:
-            # We've moved past the 2nd pair without finding the hyperpolarizability data
-            break
+    if begin_pair is not None:
+        for offset in index.offsets["Electronic dipole hyperpolarizability"]:
+            if offset > begin_pair and (end_pair is None or offset < end_pair):
+                begin_hyper_pol = offset
+                break
 
     if begin_hyper_pol is None:
         raise ValueError("Electronic dipole hyperpolarizability section for 2nd pair not found in escf.out")
@@ -424,8 +540,8 @@ def get_hyper_polarizability_2nd_pair() -> np.ndarray:
     # Initialize the hyperpolarizability tensor (3x3x3)
     beta = np.zeros((3, 3, 3))
 
-    # Extract the 9 lines containing the tensor components
-    lines = escf_data[begin_hyper_pol:begin_hyper_pol + 9]
+    # The data starts 4 lines after the section header; extract the 9 lines of components
+    lines = index.lines_at(begin_hyper_pol, 13)[4:13]
 
     # Mapping from component letters to indices
     char_to_index = {'x': 0, 'y': 1, 'z': 2}
@@ -451,18 +567,11 @@ def get_dipole_moment() -> np.ndarray:
     """
     Retrieves the dipole moment vector from the 'control' file in the current working directory.
     """
-    with open("control", "r") as infile:
-        control_data = infile.readlines()
-
-    begin_dipole = None
-    for i, line in enumerate(control_data):
-        if "$dipole" in line:
-            begin_dipole = i + 1
-            break
-    if begin_dipole is None:
+    control_data = scan_output("control").lines_from("$dipole", count=2)
+    if len(control_data) < 2:
         raise ValueError("Dipole moment section not found in control file.")
 
-    dipole_line = control_data[begin_dipole].strip()
+    dipole_line = control_data[1].strip()
     tokens = dipole_line.split()
 
     dipole_dict = {}
@@ -0,0 +1,105 @@
+import os
+import sys
+import numpy as np
+from pathlib import Path
+from control_file import ControlFile
+
+###############################################################################
+#    BULK LOADER FOR $hessian / $vibrational normal modes WITH .npy SIDECARS   #
+###############################################################################
+
+# Datagroups holding a square matrix in Turbomole's (i3, i2, 5f15.10) row format, with the file
+# name aoforce uses when the control file does not say otherwise
+MATRIX_GROUPS = {
+    'hessian': 'hessian',
+    'vibrational normal modes': 'vib_normal_modes',
+}
+SIDECAR_SUFFIX = '.npy'
+ROW_LABEL_WIDTH = 5  # i3 row number + i2 line number within the row
+
+
+def parse_matrix(filename) -> np.ndarray:
+    """
+    Parses a '$hessian' or '$vibrational normal modes' file into a (rows, columns) float array.
+    The file is read in one go and converted in bulk; lines are grouped into rows by their row label.
+    """
+    with open(filename, 'r') as infile:
+        lines = [line for line in infile.read().splitlines() if line.strip() and not line.startswith('$')]
+    rows = len({line[:3] for line in lines})
+    values = np.array(' '.join(line[ROW_LABEL_WIDTH:] for line in lines).split(), dtype=float)
+    return values.reshape(rows, -1)
+
+
+def sidecar_path(filename) -> Path:
+    return Path(str(filename) + SIDECAR_SUFFIX)
+
+
+def load_matrix(filename, cache: bool = False) -> np.ndarray:
+    """
+    Returns the matrix of a '$hessian' or '$vibrational normal modes' file. With `cache`, the parsed
+    matrix is kept as '<filename>.npy' next to it and later loads memory-map that sidecar instead of
+    parsing the text again; a sidecar older than its text file is rebuilt. Without it, an existing
+    sidecar is still used but none is written, so results directories are left as they are.
+    """
+    sidecar = sidecar_path(filename)
+    if sidecar.is_file() and sidecar.stat().st_mtime >= os.path.getmtime(filename):
+        return np.load(sidecar, mmap_mode='r')
+    matrix = parse_matrix(filename)
+    if not cache:
+        return matrix
+    tmp_file = sidecar.with_name(f'.{sidecar.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_file, 'wb') as outfile:
+            np.save(outfile, matrix)
+        os.replace(tmp_file, sidecar)
+    except OSError:
+        # e.g. a read-only source directory; the parsed matrix is still good
+        if tmp_file.exists():
+            tmp_file.unlink()
+        return matrix
+    return np.load(sidecar, mmap_mode='r')
+
+
+def matrix_file(group: str, directory='.') -> Path:
+    """
+    Returns the file holding datagroup `group` of the calculation in `directory` (as referenced in its
+    control file, else aoforce's default name), or None if there is none.
+    """
+    directory = Path(directory)
+    path = directory / MATRIX_GROUPS[group]
+    if (directory / 'control').is_file():
+        path = ControlFile(directory / 'control').external_file(group) or path
+    return path if path.is_file() else None
+
+
+def load_hessian(directory='.', cache: bool = False) -> np.ndarray:
+    """
+    Returns the (3N, 3N) Cartesian Hessian written by aoforce in `directory`, or None.
+    """
+    path = matrix_file('hessian', directory)
+    return None if path is None else load_matrix(path, cache)
+
+
+def load_normal_modes(directory='.', cache: bool = False) -> np.ndarray:
+    """
+    Returns the (3N, 3N) normal modes written by aoforce in `directory` (one column per mode), or None.
+    """
+    path = matrix_file('vibrational normal modes', directory)
+    return None if path is None else load_matrix(path, cache)
+
+
+def main():
+    """
+    Builds the .npy sidecars of the Hessian and normal-mode files of the calculation directories
+    given on the command line (default: the current directory).
+    """
+    for directory in sys.argv[1:] or ['.']:
+        for group in MATRIX_GROUPS:
+            path = matrix_file(group, directory)
+            if path is not None:
+                matrix = load_matrix(path, cache=True)
+                print(f'{sidecar_path(path)}: {matrix.shape[0]} x {matrix.shape[1]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+import os
+import math
+import copy
+import argparse
+import yaml
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from fanout import (ResourcePool, render_job_settings, materialize_job, launch_run_tm, functional_label,
+                    wavelength_label, wavelength_list)
+
+###############################################################################
+#    RESOURCE-AWARE SCHEDULER FOR MOLECULE x FUNCTIONAL x WAVELENGTH RUNS     #
+###############################################################################
+
+STATE_FILE = 'campaign_state.yml'
+REPORT_FILE = 'screening_report.yml'
+
+# Two-tier screening: every molecule first runs in the cheap 'screen' tier, only the promoted ones
+# in the 'full' tier of the campaign
+TIERS = ('screen', 'full')
+DEFAULT_RANK_FIELD = '2nd beta zzz (10E-30 esu)'
+
+# Rough size of a basis relative to def2-SVP, used to scale the per-atom memory estimate
+BASIS_SCALE = {
+    'def2-SVP': 1.0,
+    'def2-TZVP': 2.0,
+    'def2-TZVPP': 2.5,
+    'aug-cc-pVDZ': 2.0,
+    'aug-cc-pVTZ': 4.0,
+}
+MEMORY_PER_ATOM_MB = 20
+MEMORY_PER_CORE_MB = 500
+ATOMS_PER_CORE = 10
+
+
+def count_atoms(coord_file: str) -> int:
+    """
+    Returns the number of atoms in the $coord group of a Turbomole coord file.
+    """
+    natoms = 0
+    in_coord = False
+    with open(coord_file, 'r') as infile:
+        for line in infile:
+            if line.startswith('$'):
+                if in_coord:
+                    break
+                in_coord = line.startswith('$coord')
+            elif in_coord and line.strip():
+                natoms += 1
+    return natoms
+
+
+def estimate_resources(natoms: int, wano: dict, max_cores_per_job: int) -> tuple:
+    """
+    Returns (cores, memory in MB) for one job: roughly one core per ATOMS_PER_CORE atoms, and the
+    RI memory ('Memory for RI', i.e. $ricore) plus per-core and basis-scaled per-atom overheads.
+    """
+    cores = max(1, min(max_cores_per_job, math.ceil(natoms / ATOMS_PER_CORE)))
+    scale = BASIS_SCALE.get(wano['Basis set']['Basis set type'], 1.5)
+    memory_mb = int(wano['DFT options']['Memory for RI'] + cores * MEMORY_PER_CORE_MB
+                    + natoms * scale * MEMORY_PER_ATOM_MB)
+    return cores, memory_mb
+
+
+def node_capacity() -> tuple:
+    """
+    Returns (cores, memory in MB) of the node: the SimStack/Slurm allocation if running inside one,
+    otherwise all local cores and 64000 MB.
+    """
+    cores = os.environ.get('UC_PROCESSORS_PER_NODE') or os.environ.get('SLURM_CPUS_ON_NODE') or os.cpu_count()
+    memory_mb = os.environ.get('UC_MEMORY_PER_NODE') or os.environ.get('SLURM_MEM_PER_NODE') or 64000
+    return int(cores), int(memory_mb)
+
+
+def load_state(workdir: Path) -> dict:
+    """
+    Returns the saved job table of a campaign, or an empty one for a new campaign.
+    """
+    state_file = workdir / STATE_FILE
+    if not state_file.is_file():
+        return {}
+    with open(state_file, 'r') as infile:
+        return yaml.full_load(infile) or {}
+
+
+def save_state(workdir: Path, state: dict) -> None:
+    """
+    Writes the job table atomically, so an interrupted campaign never leaves a truncated state file.
+    """
+    tmp_file = workdir / (STATE_FILE + '.tmp')
+    with open(tmp_file, 'w') as outfile:
+        yaml.dump(state, outfile, default_flow_style=False)
+    os.replace(tmp_file, workdir / STATE_FILE)
+
+
+def tier_template(template: dict, spec: dict, tier: str) -> dict:
+    """
+    Returns the rendered_wano.yml template of a tier: the campaign template itself for the full tier,
+    with the basis set of the 'screening' spec for the screen tier.
+    """
+    if tier == 'full':
+        return template
+    template = copy.deepcopy(template)
+    template['Basis set']['Basis set type'] = spec['screening'].get('basis set', 'def2-SVP')
+    return template
+
+
+def tier_jobs(spec: dict, tier: str) -> tuple:
+    """
+    Returns (functionals, wavelengths) of a tier. The screen tier runs one functional (its own, else the
+    first of the campaign) at the first wavelength of the campaign.
+    """
+    if tier == 'screen':
+        return [spec['screening'].get('functional', spec['functionals'][0])], spec['wavelengths'][:1]
+    wavelengths = [spec['wavelengths']] if spec.get('combine wavelengths') else spec['wavelengths']
+    return spec['functionals'], wavelengths
+
+
+def plan_campaign(spec: dict, state: dict, node_cores: int, node_memory_mb: int, retry_failed: bool = False,
+                  tier: str = 'full', molecules: list = None) -> dict:
+    """
+    Adds every molecule x functional x wavelength job of a tier of the spec to the job table (with
+    'combine wavelengths', one job per molecule x functional computing all wavelengths), for all
+    molecules or only those in `molecules`.
+    Finished jobs keep their record; jobs that were running when the scheduler stopped are queued again,
+    failed ones only with `retry_failed`. Jobs that can never fit on the node are marked 'too large'.
+    """
+    with open(spec.get('template', 'rendered_wano.yml')) as infile:
+        template = tier_template(yaml.full_load(infile), spec, tier)
+    max_cores_per_job = spec.get('max cores per job', node_cores)
+    functionals, wavelengths = tier_jobs(spec, tier)
+    prefix = 'screen/' if tier == 'screen' else ''
+
+    for molecule, entry in spec['molecules'].items():
+        if molecules is not None and molecule not in molecules:
+            continue
+        if not isinstance(entry, dict):
+            entry = {'coord': entry}
+        natoms = count_atoms(entry['coord'])
+        for functional in functionals:
+            for wavelength in wavelengths:
+                job_id = f'{molecule}/{prefix}hyper_{wavelength_label(wavelength)}/{functional_label(functional)}'
+                job = state.get(job_id)
+                if job is not None:
+                    if job['status'] == 'running' or (retry_failed and job['status'] == 'failed'):
+                        job['status'] = 'pending'
+                    continue
+
+                wano = render_job_settings(template, functional, wavelength, node_memory_mb)
+                cores, memory_mb = estimate_resources(natoms, wano, max_cores_per_job)
+                if tier == 'full':
+                    cores, memory_mb = entry.get('cores', cores), entry.get('memory', memory_mb)
+                too_large = cores > node_cores or memory_mb > node_memory_mb
+                state[job_id] = {
+                    'molecule': molecule,
+                    'tier': tier,
+                    'coord': str(entry['coord']),
+                    'natoms': natoms,
+                    'functional': functional,
+                    'wavelength': wavelength_list(wavelength) if isinstance(wavelength, list) else float(wavelength),
+                    'cores': int(cores),
+                    'memory_mb': int(memory_mb),
+                    'status': 'too large' if too_large else 'pending',
+                    'attempts': 0,
+                }
+    return state
+
+
+def packing_order(state: dict) -> list:
+    """
+    Returns the pending job ids largest first (memory, then cores), so that first-fit placement
+    puts the big jobs on the node early and fills the remaining space with small ones.
+    """
+    pending = [job_id for job_id, job in state.items() if job['status'] == 'pending']
+    return sorted(pending, key=lambda job_id: (state[job_id]['memory_mb'], state[job_id]['cores']), reverse=True)
+
+
+def run_pending(state: dict, workdir: Path, templates: dict, pool: ResourcePool, max_workers: int,
+                path_prepend: list = None) -> None:
+    """
+    Runs the pending jobs of the job table through run_tm.py until none is left. Whenever a job
+    finishes, the pending jobs are placed first-fit decreasing into the free cores and memory, with at
+    most `max_workers` jobs at a time. A job whose directory cannot be prepared is marked failed with the
+    error. The job table is saved after every change.
+    """
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            for job_id in packing_order(state):
+                if len(running) >= max_workers:
+                    break
+                job = state[job_id]
+                if not pool.try_acquire(job['cores'], job['memory_mb']):
+                    continue
+                tier = job.get('tier', 'full')
+                try:
+                    wano = render_job_settings(templates[tier], job['functional'], job['wavelength'], job['memory_mb'])
+                    molecule_dir = workdir / job['molecule'] / ('screen' if tier == 'screen' else '')
+                    job_dir = materialize_job(molecule_dir, job['coord'], wano, job['functional'], job['wavelength'])
+                except Exception as err:
+                    # A job that cannot be set up must neither keep its cores nor stay pending forever
+                    pool.release(job['cores'], job['memory_mb'])
+                    job.update({'status': 'failed', 'error': f'{type(err).__name__}: {err}',
+                                'attempts': job['attempts'] + 1})
+                    continue
+                job.update({'status': 'running', 'dir': str(job_dir), 'attempts': job['attempts'] + 1})
+                running[executor.submit(launch_run_tm, job_dir, job['cores'], path_prepend, workdir / 'blobs')] = job_id
+            save_state(workdir, state)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = state[running.pop(future)]
+                pool.release(job['cores'], job['memory_mb'])
+                try:
+                    job['returncode'], job['wall time'] = future.result()
+                except OSError as err:
+                    job['returncode'], job['error'] = None, str(err)
+                results_file = Path(job['dir']) / 'turbomole_results.yml'
+                job['status'] = 'done' if job['returncode'] == 0 and results_file.is_file() else 'failed'
+
+
+def rank_value(job: dict, field: str = DEFAULT_RANK_FIELD) -> float:
+    """
+    Returns the ranking value (|beta zzz| from hyper_main, by default that of the Pockels pair) of a
+    finished job, or None.
+    """
+    if job['status'] != 'done':
+        return None
+    with open(Path(job['dir']) / 'turbomole_results.yml', 'r') as infile:
+        value = (yaml.full_load(infile) or {}).get(field)
+    return None if value is None else abs(float(value))
+
+
+def screening_values(state: dict, tier: str, field: str = DEFAULT_RANK_FIELD) -> dict:
+    """
+    Returns {molecule: ranking value} of the first finished job of every molecule in a tier.
+    """
+    values = {}
+    for job_id, job in sorted(state.items()):
+        if job.get('tier', 'full') == tier and job['molecule'] not in values:
+            value = rank_value(job, field)
+            if value is not None:
+                values[job['molecule']] = value
+    return values
+
+
+def promoted_molecules(spec: dict, state: dict) -> list:
+    """
+    Returns the molecules promoted from the screen tier to the full tier: the 'top k' by ranking value
+    and every one at or above 'threshold' (10^-30 esu). Without either, all screened molecules are
+    promoted. Molecules whose screening failed are promoted too, rather than dropped silently.
+    """
+    screening = spec['screening']
+    values = screening_values(state, 'screen', screening.get('rank by', DEFAULT_RANK_FIELD))
+    ranked = sorted(values, key=lambda molecule: values[molecule], reverse=True)
+    top_k, threshold = screening.get('top k'), screening.get('threshold')
+    if top_k is None and threshold is None:
+        promoted = set(ranked)
+    else:
+        promoted = set(ranked[:top_k or 0])
+        if threshold is not None:
+            promoted.update(molecule for molecule in ranked if values[molecule] >= threshold)
+    promoted.update(molecule for molecule in spec['molecules'] if molecule not in values)
+    return sorted(promoted)
+
+
+def _ranks(values: np.ndarray) -> np.ndarray:
+    """
+    Returns the ranks of `values` (0-based), tied values sharing their mean rank.
+    """
+    order = np.argsort(values, kind='stable')
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(len(values))
+    for value in np.unique(values):
+        tied = values == value
+        ranks[tied] = ranks[tied].mean()
+    return ranks
+
+
+def rank_correlation(a, b) -> float:
+    """
+    Returns Spearman's rank correlation of two equally long sequences, or None for fewer than 3 values.
+    """
+    if len(a) < 3:
+        return None
+    ranks_a, ranks_b = _ranks(np.asarray(a, dtype=float)), _ranks(np.asarray(b, dtype=float))
+    if ranks_a.std() == 0 or ranks_b.std() == 0:
+        return None
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def screening_report(spec: dict, state: dict) -> dict:
+    """
+    Compares the tiers of a screened campaign. The speedup is the estimated wall time of running every
+    molecule in the full tier (molecules not promoted are scaled by the full/screen wall time ratio of
+    the promoted ones) over the wall time actually spent in both tiers. The rank correlation is
+    Spearman's between the screen and full tier ranking values of the promoted molecules (full tier:
+    the job with the screening functional and the first wavelength, else the first finished one).
+    """
+    field = spec['screening'].get('rank by', DEFAULT_RANK_FIELD)
+    wall_time = {tier: {} for tier in TIERS}
+    for job in state.values():
+        times = wall_time[job.get('tier', 'full')]
+        times[job['molecule']] = times.get(job['molecule'], 0.0) + job.get('wall time', 0.0)
+    screen_time, full_time = wall_time['screen'], wall_time['full']
+    promoted = [molecule for molecule in full_time if molecule in screen_time]
+    spent = sum(screen_time.values()) + sum(full_time.values())
+
+    speedup = None
+    promoted_screen_time = sum(screen_time[molecule] for molecule in promoted)
+    if promoted_screen_time > 0 and spent > 0:
+        ratio = sum(full_time[molecule] for molecule in promoted) / promoted_screen_time
+        skipped = sum(t for molecule, t in screen_time.items() if molecule not in full_time)
+        speedup = (sum(full_time.values()) + ratio * skipped) / spent
+
+    screen_functional = functional_label(spec['screening'].get('functional', spec['functionals'][0]))
+    first_wavelength = float(spec['wavelengths'][0])
+
+    def preference(item):
+        job_id, job = item
+        return (functional_label(job['functional']) != screen_functional,
+                wavelength_list(job['wavelength'])[0] != first_wavelength, job_id)
+
+    full_values = {}
+    for _, job in sorted(state.items(), key=preference):
+        if job.get('tier', 'full') == 'full' and job['molecule'] not in full_values:
+            value = rank_value(job, field)
+            if value is not None:
+                full_values[job['molecule']] = value
+    screen_values = screening_values(state, 'screen', field)
+    compared = sorted(molecule for molecule in full_values if molecule in screen_values)
+
+    return {
+        'rank by': field,
+        'screened': len(screen_time),
+        'promoted': sorted(promoted),
+        'wall time screen tier (s)': float(sum(screen_time.values())),
+        'wall time full tier (s)': float(sum(full_time.values())),
+        'speedup': speedup,
+        'rank correlation': rank_correlation([screen_values[m] for m in compared], [full_values[m] for m in compared]),
+        'values': {molecule: {'screen': screen_values.get(molecule), 'full': full_values.get(molecule)}
+                   for molecule in sorted(screen_time)},
+    }
+
+
+def run_campaign(spec: dict, cores: int = None, memory_mb: int = None, max_workers: int = None,
+                 retry_failed: bool = False, path_prepend: list = None) -> dict:
+    """
+    Runs all jobs of a campaign spec through run_tm.py on one node (see run_pending). The job table is
+    saved after every change, so a restarted campaign continues where it stopped.
+    With a 'screening' spec, every molecule first runs in the cheap screen tier (its basis set and
+    functional, first wavelength); only the molecules promoted by their beta zzz (see promoted_molecules)
+    then run in the full tier, and the comparison of both tiers is written to REPORT_FILE.
+    """
+    node_cores, node_memory_mb = node_capacity()
+    node_cores = cores or spec.get('node', {}).get('cores', node_cores)
+    node_memory_mb = memory_mb or spec.get('node', {}).get('memory', node_memory_mb)
+    max_workers = max_workers or spec.get('max workers', node_cores)
+
+    workdir = Path(spec.get('workdir', 'campaign'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    with open(spec.get('template', 'rendered_wano.yml')) as infile:
+        template = yaml.full_load(infile)
+    pool = ResourcePool(node_cores, node_memory_mb)
+    state = load_state(workdir)
+
+    promoted = None
+    if spec.get('screening'):
+        state = plan_campaign(spec, state, node_cores, node_memory_mb, retry_failed, tier='screen')
+        save_state(workdir, state)
+        run_pending(state, workdir, {'screen': tier_template(template, spec, 'screen')}, pool, max_workers,
+                    path_prepend)
+        promoted = promoted_molecules(spec, state)
+        print(f"Promoted to the full tier: {', '.join(promoted) or 'none'}")
+
+    state = plan_campaign(spec, state, node_cores, node_memory_mb, retry_failed, molecules=promoted)
+    save_state(workdir, state)
+    run_pending(state, workdir, {'full': template}, pool, max_workers, path_prepend)
+
+    if spec.get('screening'):
+        with open(workdir / REPORT_FILE, 'w') as outfile:
+            yaml.dump(screening_report(spec, state), outfile, default_flow_style=False)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Schedule a molecule x functional x wavelength campaign on one node.')
+    parser.add_argument('spec', help='campaign spec (YAML)')
+    parser.add_argument('--cores', type=int, default=None, help='cores of the node (default: allocation or all)')
+    parser.add_argument('--memory', type=int, default=None, help='memory of the node in MB (default: allocation)')
+    parser.add_argument('--max-workers', type=int, default=None, help='maximum number of concurrent jobs')
+    parser.add_argument('--retry-failed', action='store_true', help='queue failed jobs again')
+    parser.add_argument('--bin-dir', action='append', default=None,
+                        help='directory with stand-in executables put in front of PATH (testing)')
+    args = parser.parse_args()
+
+    with open(args.spec) as infile:
+        spec = yaml.full_load(infile)
+    state = run_campaign(spec, args.cores, args.memory, args.max_workers, args.retry_failed, args.bin_dir)
+    for job_id, job in sorted(state.items()):
+        wall_time = f"{job['wall time']:8.1f} s" if 'wall time' in job else ' ' * 10
+        print(f"{job_id:40s} {job['cores']:3d} cores {job['memory_mb']:7d} MB {wall_time}  {job['status']}")
+    if spec.get('screening'):
+        report = screening_report(spec, state)
+        speedup = 'n/a' if report['speedup'] is None else f"{report['speedup']:.2f}x"
+        correlation = 'n/a' if report['rank correlation'] is None else f"{report['rank correlation']:.3f}"
+        print(f"Screening: {len(report['promoted'])} of {report['screened']} molecules promoted, "
+              f"speedup {speedup}, rank correlation (Spearman) {correlation}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import re
+import itertools
+import numpy as np
+from pathlib import Path
+from hyperpol_tensors import nm_to_au
+
+###############################################################################
+#          GAUSSIAN POLAR OUTPUT -> SAME ARRAYS AS THE TURBOMOLE PATH         #
+###############################################################################
+
+# Gaussian reports beta with the opposite sign to Turbomole's response functions
+# (cross-checked on p1/b3: same geometry, same dipole direction, beta_zzz flips sign).
+GAUSSIAN_BETA_SIGN = -1.0
+
+_BETA_HEADER = re.compile(r'^\s*Beta\(([^;]*);([^,]*),([^)]*)\)(.*):')
+_FREQUENCY = re.compile(r'w=\s*([-+\d.EeDd]+)\s*(nm)?')
+_COMPONENT = re.compile(r'^[xyz]{3}$')
+
+
+def is_gaussian_log(filename) -> bool:
+    """
+    Returns True if the file starts like a Gaussian output.
+    """
+    with open(filename, 'r', errors='replace') as infile:
+        return 'Entering Gaussian System' in infile.readline()
+
+
+def _fortran_float(token: str) -> float:
+    return float(token.replace('D', 'E').replace('d', 'e'))
+
+
+def _field_frequency(token: str, omega: float) -> float:
+    """
+    Converts a field label of a Beta(...) header ('0', 'w', '-w', '2w', ...) into a frequency in a.u.
+    """
+    token = token.strip()
+    if token in ('0', '0.0'):
+        return 0.0
+    sign = -1.0 if token.startswith('-') else 1.0
+    factor = token.lstrip('+-').rstrip('w') or '1'
+    return sign * float(factor) * omega
+
+
+def _pair_from_header(match) -> tuple:
+    """
+    Returns (w1, w2) in a.u. for a Beta(-ws;w1,w2) header. Turbomole lists the static field
+    first for the Pockels pair, so beta(-w;w,0) is returned as (0, w) like hyperpols.
+    """
+    frequency = _FREQUENCY.search(match.group(4))
+    omega = 0.0
+    if frequency:
+        value = _fortran_float(frequency.group(1))
+        omega = float(nm_to_au(value)) if frequency.group(2) else value
+    omega1 = _field_frequency(match.group(2), omega)
+    omega2 = _field_frequency(match.group(3), omega)
+    return (omega2, omega1) if omega2 == 0.0 else (omega1, omega2)
+
+
+def _components_to_tensor(components: dict) -> np.ndarray:
+    """
+    Builds a 3x3x3 tensor from Gaussian's printed components. Gaussian prints only the unique
+    components (e.g. xxy, yxy, ... for Kleinman-symmetric beta), so each value is first spread
+    over all index permutations and explicitly printed components then take precedence.
+    """
+    tensor = np.zeros((3, 3, 3))
+    explicit = {tuple('xyz'.index(c) for c in label): value for label, value in components.items()}
+    for idx, value in explicit.items():
+        for perm in set(itertools.permutations(idx)):
+            if perm not in explicit:
+                tensor[perm] = value
+        tensor[idx] = value
+    return tensor
+
+
+def parse_gaussian_log(filename) -> dict:
+    """
+    Streams a Gaussian polar/hyperpolar output and returns, in input orientation and atomic units:
+      'dipole':      (3,) dipole moment
+      'frequencies': (npairs, 2) field frequencies of each beta, ordered like 'hyperpols'
+      'beta':        (npairs, 3, 3, 3) first hyperpolarizabilities in the Turbomole sign convention
+    Only the input-orientation blocks are read; the dipole-orientation repeats are skipped.
+    """
+    dipole = None
+    frequencies = []
+    tensors = []
+    section = None
+    components = None
+
+    with open(filename, 'r', errors='replace') as infile:
+        for line in infile:
+            stripped = line.strip()
+            if 'Electric dipole moment (input orientation)' in line:
+                section, dipole = 'dipole', {}
+                continue
+            if 'Beta (input orientation)' in line:
+                section = 'beta'
+                continue
+            if 'orientation' in line and '(input orientation)' not in line:
+                # Dipole-orientation blocks repeat the same data in another frame
+                section = None
+                continue
+
+            if section == 'dipole':
+                parts = stripped.split()
+                if len(parts) >= 2 and parts[0] in ('x', 'y', 'z'):
+                    dipole[parts[0]] = _fortran_float(parts[1])
+                    if len(dipole) == 3:
+                        section = None
+            elif section == 'beta':
+                header = _BETA_HEADER.match(line)
+                if header:
+                    if components:
+                        tensors.append(_components_to_tensor(components))
+                    frequencies.append(_pair_from_header(header))
+                    components = {}
+                    continue
+                parts = stripped.split()
+                if components is not None and len(parts) >= 2 and _COMPONENT.match(parts[0]):
+                    components[parts[0]] = _fortran_float(parts[1])
+                elif components and not stripped:
+                    tensors.append(_components_to_tensor(components))
+                    components = None
+
+    if components:
+        tensors.append(_components_to_tensor(components))
+    if dipole is None or len(dipole) != 3:
+        raise ValueError(f"Electric dipole moment (input orientation) not found in {filename}.")
+    if not tensors:
+        raise ValueError(f"First hyperpolarizability (input orientation) not found in {filename}.")
+
+    return {
+        'dipole': np.array([dipole['x'], dipole['y'], dipole['z']]),
+        'frequencies': np.array(frequencies[:len(tensors)]).reshape(-1, 2),
+        'beta': GAUSSIAN_BETA_SIGN * np.array(tensors),
+    }
+
+
+def find_gaussian_logs(root: str) -> list:
+    """
+    Returns all Gaussian outputs (*.log) below `root`.
+    """
+    return [path for path in sorted(Path(root).rglob('*.log')) if is_gaussian_log(path)]
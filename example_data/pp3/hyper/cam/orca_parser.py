@@ -0,0 +1,235 @@
+import os
+import sys
+import numpy as np
+from pathlib import Path
+from results_record import write_results
+
+###############################################################################
+#        ORCA property.txt / .engrad / .hess -> TURBOMOLE-STYLE RECORDS       #
+###############################################################################
+
+ORCA_RESULTS_BASENAME = 'orca_results'
+# Lines at the top of an ORCA output searched for the name of its input file
+OUTPUT_HEADER_LINES = 400
+
+
+def _read_column_blocks(infile, nrows: int, ncols: int) -> np.ndarray:
+    """
+    Reads an ORCA matrix printed in column blocks (a header line of column indices followed by
+    `nrows` lines 'row v v v ...') from the open file straight into an (nrows, ncols) array.
+    """
+    matrix = np.empty((nrows, ncols))
+    filled = 0
+    while filled < ncols:
+        header = infile.readline()
+        if not header:
+            raise ValueError('Unexpected end of file inside an ORCA matrix block.')
+        columns = [int(c) for c in header.split()]
+        if not columns:
+            continue
+        for _ in range(nrows):
+            parts = infile.readline().split()
+            matrix[int(parts[0]), columns[0]:columns[-1] + 1] = np.array(parts[1:], dtype=float)
+        filled = columns[-1] + 1
+    return matrix
+
+
+def _read_indexed_vector(infile, length: int) -> np.ndarray:
+    """
+    Reads `length` lines of the form 'index value' into a 1D array.
+    """
+    vector = np.empty(length)
+    for _ in range(length):
+        parts = infile.readline().split()
+        vector[int(parts[0])] = float(parts[1])
+    return vector
+
+
+def parse_orca_hess(filename) -> dict:
+    """
+    Streams an ORCA .hess file. Returns a dict with (whichever blocks are present):
+      'hessian':         (3N, 3N) Cartesian Hessian in Eh/bohr^2
+      'frequencies':     (3N,) vibrational frequencies in cm^-1 (imaginary ones negative)
+      'normal_modes':    (3N, 3N) normal modes, one mode per column
+      'ir_intensities':  (3N,) IR intensities in km/mol (ORCA 5 '$ir_spectrum' layout: wavenumber eps Int TX TY TZ)
+      'elements', 'masses', 'coordinates': atom data, coordinates in bohr
+    """
+    result = {}
+    with open(filename, 'r') as infile:
+        for line in iter(infile.readline, ''):
+            keyword = line.strip()
+            if keyword == '$hessian':
+                n = int(infile.readline().split()[0])
+                result['hessian'] = _read_column_blocks(infile, n, n)
+            elif keyword == '$normal_modes':
+                nrows, ncols = (int(v) for v in infile.readline().split()[:2])
+                result['normal_modes'] = _read_column_blocks(infile, nrows, ncols)
+            elif keyword == '$ir_spectrum':
+                n = int(infile.readline().split()[0])
+                rows = [infile.readline().split() for _ in range(n)]
+                if all(len(row) == 6 for row in rows):
+                    result['ir_intensities'] = np.array([row[2] for row in rows], dtype=float)
+            elif keyword == '$vibrational_frequencies':
+                n = int(infile.readline().split()[0])
+                result['frequencies'] = _read_indexed_vector(infile, n)
+            elif keyword == '$atoms':
+                natoms = int(infile.readline().split()[0])
+                rows = [infile.readline().split() for _ in range(natoms)]
+                result['elements'] = [row[0] for row in rows]
+                result['masses'] = np.array([row[1] for row in rows], dtype=float)
+                result['coordinates'] = np.array([row[2:5] for row in rows], dtype=float)
+    return result
+
+
+def parse_orca_engrad(filename) -> dict:
+    """
+    Reads an ORCA .engrad file. Returns 'energy' (Eh), 'gradient' (N, 3) in Eh/bohr,
+    'atomic_numbers' and 'coordinates' (N, 3) in bohr.
+    """
+    with open(filename, 'r') as infile:
+        values = [line.split() for line in infile if line.strip() and not line.startswith('#')]
+    natoms = int(values[0][0])
+    energy = float(values[1][0])
+    gradient = np.array([v[0] for v in values[2:2 + 3 * natoms]], dtype=float).reshape(natoms, 3)
+    atoms = np.array(values[2 + 3 * natoms:2 + 4 * natoms], dtype=float).reshape(natoms, 4)
+    return {
+        'energy': energy,
+        'gradient': gradient,
+        'atomic_numbers': atoms[:, 0].astype(int),
+        'coordinates': atoms[:, 1:],
+    }
+
+
+def parse_orca_property(filename) -> dict:
+    """
+    Streams an ORCA *_property.txt file and keeps the last value of every property:
+    'energy' (SCF energy, Eh), 'dipole' (total dipole, a.u.), 'frequencies' (cm^-1) and
+    the thermochemistry energies 'ZPE', 'enthalpy' and 'gibbs' (Eh).
+    """
+    result = {}
+    thermo_keys = {
+        'Zero Point Energy (Hartree)': 'ZPE',
+        'Enthalpy (Hartree)': 'enthalpy',
+        'Gibbs Energy (Hartree)': 'gibbs',
+    }
+    with open(filename, 'r') as infile:
+        for line in iter(infile.readline, ''):
+            stripped = line.strip()
+            if stripped.startswith('SCF Energy:'):
+                result['energy'] = float(stripped.split()[-1])
+            elif stripped.startswith('Total Dipole moment:'):
+                infile.readline()
+                result['dipole'] = [float(infile.readline().split()[1]) for _ in range(3)]
+            elif stripped.startswith('Number of frequencies'):
+                nfreq = int(stripped.split(':')[1])
+            elif stripped.startswith('Vibrational frequencies'):
+                infile.readline()
+                result['frequencies'] = _read_indexed_vector(infile, nfreq)
+            elif ':' in stripped and stripped.split(':')[0].strip() in thermo_keys:
+                key, value = stripped.split(':')
+                result[thermo_keys[key.strip()]] = float(value)
+    return result
+
+
+def parse_orca_orbitals(filename) -> dict:
+    """
+    Streams an ORCA output and reads its last 'ORBITAL ENERGIES' block (both spins for open shells).
+    Returns 'homo', 'lumo' and 'homo-lumo gap' in Eh, as run_tm reads them from eiger.out, or {} if
+    the output has no orbital energies.
+    """
+    occupied, virtual = None, None
+    with open(filename, 'r') as infile:
+        for line in iter(infile.readline, ''):
+            if line.strip() != 'ORBITAL ENERGIES':
+                continue
+            occupied, virtual = [], []
+            for row in iter(infile.readline, ''):
+                tokens = row.split()
+                if len(tokens) == 4 and tokens[0].isdigit():
+                    (occupied if float(tokens[1]) > 0.0 else virtual).append(float(tokens[2]))
+                elif tokens and not tokens[0].startswith('-') and tokens[0] not in ('NO', 'SPIN'):
+                    break
+    if not occupied or not virtual:
+        return {}
+    homo, lumo = max(occupied), min(virtual)
+    return {'homo': homo, 'lumo': lumo, 'homo-lumo gap': lumo - homo}
+
+
+def find_orca_output(directory, basename: str):
+    """
+    Returns the ORCA output of job `basename` in `directory`: '<basename>.out' if it exists, otherwise
+    the '*.out' file (e.g. a batch system log) whose header names '<basename>.inp', or None.
+    """
+    directory = Path(directory)
+    if (directory / f'{basename}.out').is_file():
+        return directory / f'{basename}.out'
+    for candidate in sorted(directory.glob('*.out')):
+        with open(candidate, 'r', errors='replace') as infile:
+            for _, line in zip(range(OUTPUT_HEADER_LINES), infile):
+                if line.split() == ['NAME', '=', f'{basename}.inp']:
+                    return candidate
+    return None
+
+
+def find_orca_jobs(directory: str) -> list:
+    """
+    Returns the ORCA job basenames in `directory` (every '<base>_property.txt').
+    """
+    return sorted(p.name[:-len('_property.txt')] for p in Path(directory).glob('*_property.txt'))
+
+
+def gather_orca_results(directory: str = '.', basename: str = None) -> dict:
+    """
+    Builds the same result record as run_tm.gather_results/handle_frequency for an ORCA job, with the
+    same keys: energy, frontier orbitals (from the ORCA output, see find_orca_output), dipole and, for
+    a frequency job, ZPE, wave numbers, IR intensities, IR selection (non-zero intensity; ORCA applies
+    no symmetry rules) and normal modes from the .hess file. ORCA has no Raman selection, so
+    'Raman active' is None.
+    Without `basename` the job with a Hessian is preferred, then the most recently written one.
+    """
+    directory = Path(directory)
+    if basename is None:
+        jobs = find_orca_jobs(directory)
+        if not jobs:
+            raise ValueError(f"No ORCA '*_property.txt' found in {directory}.")
+        basename = max(jobs, key=lambda job: ((directory / f'{job}.hess').is_file(),
+                                              os.path.getmtime(directory / f'{job}_property.txt'), job))
+
+    properties = parse_orca_property(directory / f'{basename}_property.txt')
+    results_dict = {'title': basename, 'energy_unit': 'Hartree', 'program': 'orca'}
+    if (directory / f'{basename}.engrad').is_file():
+        results_dict['energy'] = parse_orca_engrad(directory / f'{basename}.engrad')['energy']
+    elif 'energy' in properties:
+        results_dict['energy'] = properties['energy']
+    output_file = find_orca_output(directory, basename)
+    if output_file is not None:
+        results_dict.update(parse_orca_orbitals(output_file))
+    if 'dipole' in properties:
+        results_dict['dipole'] = properties['dipole']
+
+    hess = parse_orca_hess(directory / f'{basename}.hess') if (directory / f'{basename}.hess').is_file() else {}
+    frequencies = hess.get('frequencies', properties.get('frequencies'))
+    if 'ZPE' in properties:
+        results_dict['ZPE'] = properties['ZPE']
+    if frequencies is not None:
+        results_dict['vibrational frequencies'] = frequencies
+    if 'ir_intensities' in hess:
+        results_dict['IR intensities'] = hess['ir_intensities']
+        results_dict['IR active'] = hess['ir_intensities'] > 0.0
+        results_dict['Raman active'] = None
+    if 'normal_modes' in hess:
+        results_dict['normal modes'] = hess['normal_modes']
+    return results_dict
+
+
+def write_orca_results(directory: str = '.', basename: str = None) -> None:
+    """
+    Writes the ORCA result record next to the ORCA outputs as the typed record 'orca_results.npz'
+    and its YAML view 'orca_results.yml' (see results_record.write_results).
+    """
+    results_dict = gather_orca_results(directory, basename)
+    write_results(results_dict, str(Path(directory) / ORCA_RESULTS_BASENAME))
+
+
+if __name__ == '__main__':
+    write_orca_results(*sys.argv[1:3])
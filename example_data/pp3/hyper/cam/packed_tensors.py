@@ -0,0 +1,248 @@
+import argparse
+import itertools
+import numpy as np
+from pathlib import Path
+from hyperpol_tensors import au_to_esu, get_all_hyper_polarizabilities
+
+###############################################################################
+#          COMPACT STORAGE FOR FIRST HYPERPOLARIZABILITY TENSORS              #
+###############################################################################
+
+# Unique components of a fully (Kleinman) symmetric rank-3 tensor, i <= j <= k:
+# xxx, xxy, xxz, xyy, xyz, xzz, yyy, yyz, yzz, zzz
+UNIQUE_COMPONENTS = tuple(itertools.combinations_with_replacement(range(3), 3))
+COMPONENT_LABELS = tuple(''.join('xyz'[i] for i in idx) for idx in UNIQUE_COMPONENTS)
+
+# Relative deviation from Kleinman symmetry above which a tensor is kept in full
+KLEINMAN_TOLERANCE = 0.05
+
+# For every (i, j, k) the position of its sorted index triple in UNIQUE_COMPONENTS
+_EXPAND_INDEX = np.empty((3, 3, 3), dtype=np.intp)
+for _idx in itertools.product(range(3), repeat=3):
+    _EXPAND_INDEX[_idx] = UNIQUE_COMPONENTS.index(tuple(sorted(_idx)))
+
+_PERMUTATIONS = tuple(itertools.permutations(range(3)))
+
+
+def kleinman_symmetrize(tensors: np.ndarray) -> np.ndarray:
+    """
+    Averages (..., 3, 3, 3) tensors over all six index permutations.
+    """
+    tensors = np.asarray(tensors, dtype=float)
+    lead = tensors.ndim - 3
+    axes = [tuple(range(lead)) + tuple(lead + p for p in perm) for perm in _PERMUTATIONS]
+    return sum(np.transpose(tensors, ax) for ax in axes) / len(axes)
+
+
+def kleinman_deviation(tensors: np.ndarray) -> np.ndarray:
+    """
+    Returns ||beta - beta_K|| / ||beta|| for (..., 3, 3, 3) tensors, where beta_K is the
+    Kleinman-symmetrized tensor. Zero tensors have a deviation of 0.
+    """
+    tensors = np.asarray(tensors, dtype=float)
+    norm = np.linalg.norm(tensors.reshape(tensors.shape[:-3] + (27,)), axis=-1)
+    diff = np.linalg.norm((tensors - kleinman_symmetrize(tensors)).reshape(norm.shape + (27,)), axis=-1)
+    return np.divide(diff, norm, out=np.zeros_like(norm), where=norm > 0)
+
+
+def pack_tensors(tensors: np.ndarray) -> tuple:
+    """
+    Packs (n, 3, 3, 3) tensors into their (n, 10) unique Kleinman components.
+    Returns (packed, deviation) with one deviation per tensor.
+    """
+    tensors = np.asarray(tensors, dtype=float)
+    symmetric = kleinman_symmetrize(tensors)
+    rows, cols, depth = zip(*UNIQUE_COMPONENTS)
+    packed = symmetric[..., rows, cols, depth]
+    return packed, kleinman_deviation(tensors)
+
+
+def expand_tensors(packed: np.ndarray) -> np.ndarray:
+    """
+    Expands (..., 10) packed components back into (..., 3, 3, 3) symmetric tensors.
+    """
+    return np.asarray(packed, dtype=float)[..., _EXPAND_INDEX]
+
+
+class PackedBeta:
+    """
+    A first hyperpolarizability tensor stored as its 10 unique Kleinman components
+    plus the measured deviation from Kleinman symmetry. Tensors whose deviation
+    exceeds the tolerance keep all 27 components, so no information is lost.
+    The 3x3x3 form is only built when requested.
+    """
+
+    __slots__ = ('packed', 'deviation', '_full', '_expanded')
+
+    def __init__(self, packed: np.ndarray, deviation: float = 0.0, full: np.ndarray = None):
+        self.packed = np.asarray(packed, dtype=float).reshape(10)
+        self.deviation = float(deviation)
+        self._full = None if full is None else np.asarray(full, dtype=float).reshape(3, 3, 3)
+        self._expanded = None
+
+    @classmethod
+    def from_tensor(cls, tensor: np.ndarray, tolerance: float = KLEINMAN_TOLERANCE) -> 'PackedBeta':
+        """
+        Packs a 3x3x3 tensor. The full tensor is retained only if its Kleinman deviation exceeds `tolerance`.
+        """
+        tensor = np.asarray(tensor, dtype=float).reshape(3, 3, 3)
+        packed, deviation = pack_tensors(tensor)
+        return cls(packed, deviation, full=tensor if deviation > tolerance else None)
+
+    @property
+    def keep_full(self) -> bool:
+        """
+        True if the tensor is too far from Kleinman symmetry to be represented by its packed components.
+        """
+        return self._full is not None
+
+    @property
+    def tensor(self) -> np.ndarray:
+        """
+        The 3x3x3 tensor, expanded from the packed components on first access and kept from then on.
+        """
+        if self._full is not None:
+            return self._full
+        if self._expanded is None:
+            self._expanded = expand_tensors(self.packed)
+        return self._expanded
+
+    def component(self, label: str) -> float:
+        """
+        Returns a single component such as 'zzz' without expanding the tensor.
+        """
+        idx = tuple('xyz'.index(c) for c in label)
+        if self._full is not None:
+            return float(self._full[idx])
+        return float(self.packed[_EXPAND_INDEX[idx]])
+
+    def to_record(self) -> dict:
+        """
+        Returns a plain dictionary suitable for YAML output: the packed components, or all 27 components
+        for tensors kept in full (the packed ones follow from them).
+        """
+        if self._full is not None:
+            return {'full': self._full.tolist(), 'kleinman deviation': self.deviation}
+        return {'packed': self.packed.tolist(), 'kleinman deviation': self.deviation}
+
+    @classmethod
+    def from_record(cls, record) -> 'PackedBeta':
+        """
+        Rebuilds a PackedBeta from `to_record` output, or from a legacy nested 3x3x3 list.
+        """
+        if isinstance(record, dict):
+            if record.get('full') is not None:
+                packed, deviation = pack_tensors(record['full'])
+                return cls(packed, record.get('kleinman deviation', deviation), record['full'])
+            return cls(record['packed'], record.get('kleinman deviation', 0.0))
+        return cls.from_tensor(record)
+
+    def __repr__(self) -> str:
+        return f'PackedBeta(deviation={self.deviation:.3g}, keep_full={self.keep_full})'
+
+
+class PackedBetaArray:
+    """
+    A corpus of first hyperpolarizability tensors in flat arrays: the (n,) Kleinman deviations and
+    `keep_full` flags of all tensors, (n - m, 10) packed components of the symmetric ones and (m, 27)
+    components of the m tensors kept in full, each in corpus order. Stored as .npz, a nearly
+    Kleinman-symmetric corpus takes 11 instead of 27 floats per tensor.
+    """
+
+    __slots__ = ('keep_full', 'deviation', 'packed', 'full', '_position')
+    STORED = ('keep_full', 'deviation', 'packed', 'full')
+
+    def __init__(self, keep_full: np.ndarray, deviation: np.ndarray, packed: np.ndarray, full: np.ndarray):
+        self.keep_full = np.asarray(keep_full, dtype=bool).reshape(-1)
+        self.deviation = np.asarray(deviation, dtype=float).reshape(-1)
+        self.packed = np.asarray(packed, dtype=float).reshape(-1, 10)
+        self.full = np.asarray(full, dtype=float).reshape(-1, 27)
+        # Row of every tensor in `packed` or `full`
+        self._position = np.where(self.keep_full, np.cumsum(self.keep_full), np.cumsum(~self.keep_full)) - 1
+
+    @classmethod
+    def from_tensors(cls, tensors: np.ndarray, tolerance: float = KLEINMAN_TOLERANCE) -> 'PackedBetaArray':
+        """
+        Packs (n, 3, 3, 3) tensors; those with a Kleinman deviation above `tolerance` are kept in full instead.
+        """
+        tensors = np.asarray(tensors, dtype=float).reshape(-1, 3, 3, 3)
+        packed, deviation = pack_tensors(tensors)
+        keep_full = deviation > tolerance
+        return cls(keep_full, deviation, packed[~keep_full], tensors[keep_full])
+
+    def __len__(self) -> int:
+        return len(self.keep_full)
+
+    def __getitem__(self, i: int) -> PackedBeta:
+        row = self._position[i]
+        if self.keep_full[i]:
+            full = self.full[row]
+            return PackedBeta(pack_tensors(full.reshape(3, 3, 3))[0], self.deviation[i], full)
+        return PackedBeta(self.packed[row], self.deviation[i])
+
+    def tensors(self) -> np.ndarray:
+        """
+        Returns all (n, 3, 3, 3) tensors: expanded from the packed components, the full ones as stored.
+        """
+        tensors = np.empty((len(self), 3, 3, 3))
+        tensors[~self.keep_full] = expand_tensors(self.packed)
+        tensors[self.keep_full] = self.full.reshape(-1, 3, 3, 3)
+        return tensors
+
+    def component(self, label: str) -> np.ndarray:
+        """
+        Returns one component such as 'zzz' of every tensor without expanding them.
+        """
+        idx = tuple('xyz'.index(c) for c in label)
+        values = np.empty(len(self))
+        values[~self.keep_full] = self.packed[:, _EXPAND_INDEX[idx]]
+        values[self.keep_full] = self.full[:, np.ravel_multi_index(idx, (3, 3, 3))]
+        return values
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes taken by the stored arrays (as written by `save`, without the .npz overhead).
+        """
+        return sum(getattr(self, name).nbytes for name in self.STORED)
+
+    def save(self, filename) -> None:
+        """
+        Writes the STORED arrays to the .npz file `filename`.
+        """
+        np.savez(filename, **{name: getattr(self, name) for name in self.STORED})
+
+    @classmethod
+    def load(cls, filename) -> 'PackedBetaArray':
+        """
+        Reads a corpus written by `save`.
+        """
+        with np.load(filename) as data:
+            return cls(*(data[name] for name in cls.STORED))
+
+
+def collect_tensors(root: str, hyper_file: str = 'hyperpols') -> np.ndarray:
+    """
+    Returns the (n, 3, 3, 3) tensors (10^-30 esu) of every frequency pair in every hyperpols below `root`.
+    """
+    tensors = [au_to_esu(get_all_hyper_polarizabilities(str(path))) for path in sorted(Path(root).rglob(hyper_file))]
+    return np.concatenate(tensors) if tensors else np.empty((0, 3, 3, 3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack all beta tensors below a results tree into one .npz file.')
+    parser.add_argument('root', help='results tree containing hyperpols files')
+    parser.add_argument('output', help='.npz file to write')
+    parser.add_argument('--tolerance', type=float, default=KLEINMAN_TOLERANCE,
+                        help='Kleinman deviation above which a tensor is kept in full')
+    args = parser.parse_args()
+
+    tensors = collect_tensors(args.root)
+    corpus = PackedBetaArray.from_tensors(tensors, args.tolerance)
+    corpus.save(args.output)
+    print(f'{len(corpus)} tensors, {int(corpus.keep_full.sum())} kept in full: '
+          f'{corpus.nbytes / 1024:.1f} kB instead of {tensors.nbytes / 1024:.1f} kB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import io
+import os
+import lzma
+import shutil
+import tarfile
+import hashlib
+import argparse
+import subprocess
+import yaml
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+###############################################################################
+#     COMPRESSED RESULT ARCHIVES AND A CONTENT-ADDRESSED STORE FOR ARTIFACTS  #
+###############################################################################
+
+ARCHIVE_SUFFIX = {'xz': '.tar.xz', 'zstd': '.tar.zst', 'none': '.tar'}
+MANIFEST_NAME = 'results_manifest.yml'
+
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class _XzProcess:
+    """
+    Writable stream that compresses through the multi-threaded xz command line tool into `outfile`
+    (a real file, xz writes to its descriptor).
+    """
+
+    def __init__(self, outfile, level: int, threads: int):
+        outfile.flush()
+        self.process = subprocess.Popen(['xz', '-c', f'-{level}', f'-T{max(threads, 0)}'],
+                                        stdin=subprocess.PIPE, stdout=outfile)
+
+    def write(self, data) -> int:
+        return self.process.stdin.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.stdin.close()
+        if self.process.wait() != 0 and exc_type is None:
+            raise OSError(f'xz failed with exit code {self.process.returncode}.')
+
+
+class _ByteCounter(io.RawIOBase):
+    """
+    Write-only sink that only counts the bytes written to it.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.count += len(data)
+        return len(data)
+
+
+def _compressor(codec: str, outfile, level: int = None, threads: int = 0):
+    """
+    Returns a writable stream that compresses into `outfile`. `threads` (0: single-threaded,
+    -1: all cores) is passed to zstd; for xz, Python's lzma module compresses on one thread, so
+    with threads the xz tool is used instead if it is installed.
+    """
+    if codec == 'xz':
+        level = 6 if level is None else level
+        if threads:
+            if shutil.which('xz') and hasattr(outfile, 'fileno'):
+                return _XzProcess(outfile, level, threads)
+            print("The xz tool is not available, 'archive threads' is ignored and xz compresses on one thread.")
+        return lzma.LZMAFile(outfile, 'wb', preset=level)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("Compression with zstd requires the 'zstandard' package.")
+        compressor = zstandard.ZstdCompressor(level=10 if level is None else level, threads=threads)
+        return compressor.stream_writer(outfile, closefd=False)
+    if codec == 'none':
+        return outfile
+    raise ValueError(f"Unknown codec '{codec}', use one of {sorted(ARCHIVE_SUFFIX)}.")
+
+
+def _decompressor(infile):
+    """
+    Returns a readable stream for a plain, xz- or zstd-compressed file, recognized by its magic bytes.
+    """
+    magic = infile.read(6)
+    infile.seek(0)
+    if magic.startswith(_XZ_MAGIC):
+        return lzma.LZMAFile(infile, 'rb')
+    if magic.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImportError("Reading zstd-compressed files requires the 'zstandard' package.")
+        return zstandard.ZstdDecompressor().stream_reader(infile)
+    return infile
+
+
+def file_digest(filename) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed store shared by sibling calculations: every artifact is kept once, compressed,
+    under <root>/<first two hex digits>/<sha256>. Jobs refer to their artifacts through manifests.
+    """
+
+    def __init__(self, root, codec: str = 'xz', level: int = None, threads: int = 0):
+        self.root = Path(root)
+        self.codec, self.level, self.threads = codec, level, threads
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def put(self, filename) -> str:
+        """
+        Stores a file unless identical content is already present. Returns its SHA-256.
+        """
+        digest = file_digest(filename)
+        target = self.path(digest)
+        if not target.is_file():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = target.with_name(f'.{digest}.{os.getpid()}.tmp')
+            with open(filename, 'rb') as infile, open(tmp_file, 'wb') as raw:
+                with _compressor(self.codec, raw, self.level, self.threads) as outfile:
+                    for chunk in iter(lambda: infile.read(1 << 20), b''):
+                        outfile.write(chunk)
+            # Concurrent writers of the same blob produce identical files, the last rename wins
+            os.replace(tmp_file, target)
+        return digest
+
+    def get(self, digest: str, filename) -> None:
+        """
+        Writes the blob with the given SHA-256 to `filename`.
+        """
+        with open(self.path(digest), 'rb') as raw, open(filename, 'wb') as outfile:
+            infile = _decompressor(raw)
+            for chunk in iter(lambda: infile.read(1 << 20), b''):
+                outfile.write(chunk)
+
+
+def package_results(files: list, archive: str = 'results.tar.xz', codec: str = 'xz', level: int = None,
+                    threads: int = 0, store: BlobStore = None, min_blob_size: int = 4096) -> dict:
+    """
+    Streams `files` into a compressed tar archive. With a blob store, files of at least
+    `min_blob_size` bytes go into the store instead and the archive carries a manifest
+    ({name: {'sha256', 'size'}}, and the store relative to the archive) in their place. Returns the manifest.
+    """
+    manifest = {}
+    with open(archive, 'wb') as raw:
+        with _compressor(codec, raw, level, threads) as stream:
+            with tarfile.open(fileobj=stream, mode='w|') as tar:
+                for filename in files:
+                    size = os.path.getsize(filename)
+                    if store is not None and size >= min_blob_size:
+                        manifest[filename] = {'sha256': store.put(filename), 'size': size}
+                    else:
+                        tar.add(filename)
+                if manifest:
+                    # Relative, so that the job and its store can move together to another node or path
+                    store_path = os.path.relpath(store.root.resolve(), Path(archive).resolve().parent)
+                    data = yaml.dump({'store': store_path, 'files': manifest}, default_flow_style=False).encode()
+                    info = tarfile.TarInfo(MANIFEST_NAME)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+    return manifest
+
+
+def extract_results(archive: str, directory: str = '.', store: BlobStore = None) -> None:
+    """
+    Unpacks a result archive (plain tar, xz or zstd) into `directory` and fetches the files listed
+    in its manifest from the blob store: `store` (the one configured for the current job) or else
+    the one recorded in the manifest, relative to the archive.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(archive, 'rb') as raw:
+        with tarfile.open(fileobj=_decompressor(raw), mode='r|') as tar:
+            tar.extractall(directory, filter='data')
+
+    manifest_file = directory / MANIFEST_NAME
+    if manifest_file.is_file():
+        with open(manifest_file, 'r') as infile:
+            manifest = yaml.full_load(infile)
+        store = store or BlobStore(Path(archive).resolve().parent / manifest['store'])
+        for filename, entry in manifest['files'].items():
+            if not store.path(entry['sha256']).is_file():
+                raise FileNotFoundError(f"{filename} of {archive} is not in the blob store {store.root}, "
+                                        "set $TM_BLOB_STORE or 'Blob store' to the store the job used.")
+            store.get(entry['sha256'], directory / filename)
+
+
+def survey(root: str, codec: str = 'xz', level: int = None) -> dict:
+    """
+    Returns the total size of all files below `root`, the size after content deduplication and the
+    size of the deduplicated content once compressed.
+    """
+    total, unique, compressed = 0, 0, 0
+    seen = set()
+    for path in sorted(Path(root).rglob('*')):
+        if not path.is_file() or path.is_symlink():
+            continue
+        size = path.stat().st_size
+        total += size
+        digest = file_digest(path)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        unique += size
+        if codec == 'none':
+            compressed += size
+            continue
+        counter = _ByteCounter()
+        with open(path, 'rb') as infile, _compressor(codec, counter, level) as outfile:
+            for chunk in iter(lambda: infile.read(1 << 20), b''):
+                outfile.write(chunk)
+        compressed += counter.count
+    return {'files': len(seen), 'total': total, 'deduplicated': unique, 'compressed': compressed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate deduplication and compression savings for a results tree.')
+    parser.add_argument('root')
+    parser.add_argument('--codec', choices=sorted(ARCHIVE_SUFFIX), default='xz')
+    parser.add_argument('--level', type=int, default=None)
+    args = parser.parse_args()
+
+    report = survey(args.root, args.codec, args.level)
+    mb = 1024 ** 2
+    print(f"{report['files']} distinct files")
+    print(f"total        {report['total'] / mb:9.1f} MB")
+    print(f"deduplicated {report['deduplicated'] / mb:9.1f} MB")
+    print(f"compressed   {report['compressed'] / mb:9.1f} MB ({args.codec})")
+
+
+if __name__ == '__main__':
+    main()
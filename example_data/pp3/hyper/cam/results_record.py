@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import yaml
+import numpy as np
+
+###############################################################################
+#      TYPED RESULTS RECORD: NPZ FAST PATH, SMALL YAML VIEW, ARTIFACT REFS    #
+###############################################################################
+
+RESULTS_BASENAME = 'turbomole_results'
+
+# Known fields and their types. 'artifact' fields hold a reference to a file instead of its contents;
+# fields not listed here are written as they are.
+RESULTS_SCHEMA = {
+    'title': str,
+    'energy_unit': str,
+    'energy': float,
+    'homo': float,
+    'lumo': float,
+    'homo-lumo gap': float,
+    'dipole': 'vector',
+    '1st beta zzz (10E-30 esu)': float,
+    '2nd beta zzz (10E-30 esu)': float,
+    '3rd beta zzz (10E-30 esu)': float,
+    'beta(10E-30 esu)': dict,
+    'ZPE': float,
+    'vibrational frequencies': 'vector',
+    'IR intensities': 'vector',
+    'IR active': 'flags',
+    'Raman active': 'flags',
+    'normal modes': 'matrix',
+    'exc_type': str,
+    'exc_energies': 'vector',
+    'scf iterations': int,
+    'homo-orb': 'artifact',
+    'lumo-orb': 'artifact',
+}
+
+# Arrays with more elements than this are kept out of the YAML view (they stay in the npz record)
+YAML_ARRAY_LIMIT = 4096
+
+try:
+    _YamlLoader, _YamlDumper = yaml.CSafeLoader, yaml.CSafeDumper
+except AttributeError:
+    _YamlLoader, _YamlDumper = yaml.SafeLoader, yaml.SafeDumper
+
+
+def artifact_reference(file_path: str) -> dict:
+    """
+    Returns a reference to a result file: its path, size and SHA-256.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return {'path': file_path, 'size': os.path.getsize(file_path), 'sha256': digest.hexdigest()}
+
+
+def typed_record(results_dict: dict) -> dict:
+    """
+    Returns a copy of `results_dict` with the known fields converted to their schema types:
+    floats and ints as Python scalars, vectors and matrices as float arrays, flags as bool arrays.
+    """
+    record = {}
+    for key, value in results_dict.items():
+        kind = RESULTS_SCHEMA.get(key)
+        if value is None or kind is None or kind in ('artifact', dict):
+            record[key] = value
+        elif kind in ('vector', 'matrix'):
+            record[key] = np.asarray(value, dtype=float)
+        elif kind == 'flags':
+            record[key] = np.asarray(value, dtype=bool)
+        else:
+            record[key] = kind(value)
+    return record
+
+
+def _flatten(record: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in record.items():
+        if '/' in key:
+            raise ValueError(f"Result keys must not contain '/': {key!r}")
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}/'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def _unflatten(flat: dict) -> dict:
+    record = {}
+    for path, value in flat.items():
+        *parents, key = path.split('/')
+        node = record
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return record
+
+
+def _plain(value):
+    """
+    Converts arrays and NumPy scalars to plain Python for the YAML view.
+    """
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+def write_results(results_dict: dict, basename: str = RESULTS_BASENAME) -> None:
+    """
+    Writes the results twice: '<basename>.npz' as the binary typed record (nested keys joined by '/',
+    None values listed in '__none__', values that are no plain array, such as lists of records, stored
+    as JSON text and listed in '__json__') and '<basename>.yml' as a small human-readable view, in which
+    arrays longer than YAML_ARRAY_LIMIT are replaced by their shape and a pointer to the npz file.
+    """
+    record = typed_record(results_dict)
+    flat = _flatten(record)
+    arrays, as_json = {}, []
+    for key, value in flat.items():
+        if value is None:
+            continue
+        try:
+            array = np.asarray(value)
+        except ValueError:  # ragged nested lists
+            array = None
+        if array is None or array.dtype == object:
+            array = np.array(json.dumps(_plain(value)))
+            as_json.append(key)
+        arrays[key] = array
+    arrays['__none__'] = np.array([key for key, value in flat.items() if value is None], dtype=str)
+    arrays['__json__'] = np.array(as_json, dtype=str)
+    np.savez(basename + '.npz', **arrays)
+
+    view = {}
+    for key, value in flat.items():
+        if isinstance(value, np.ndarray) and value.size > YAML_ARRAY_LIMIT:
+            value = {'npz': f'{basename}.npz', 'shape': list(value.shape)}
+        view[key] = _plain(value)
+    with open(basename + '.yml', 'w') as outfile:
+        yaml.dump(_unflatten(view), outfile, Dumper=_YamlDumper, default_flow_style=False)
+
+
+def read_results(basename: str = RESULTS_BASENAME) -> dict:
+    """
+    Reads a results record, from the npz file if present (arrays stay NumPy arrays),
+    otherwise from the YAML view with the C loader.
+    """
+    if os.path.isfile(basename + '.npz'):
+        with np.load(basename + '.npz', allow_pickle=False) as data:
+            flat = {key: data[key].item() if data[key].ndim == 0 else data[key]
+                    for key in data.files if key not in ('__none__', '__json__')}
+            flat.update({key: None for key in data['__none__'].tolist()})
+            if '__json__' in data.files:
+                flat.update({key: json.loads(flat[key]) for key in data['__json__'].tolist()})
+        return _unflatten(flat)
+    with open(basename + '.yml', 'r') as infile:
+        return yaml.load(infile, Loader=_YamlLoader)
@@ -1,12 +1,25 @@
 import os
 import re
+import shutil
+import argparse
 import yaml
-import ase.io
 import numpy as np
-from pymatgen.io import xyz
-from pymatgen.io.gaussian import GaussianInput
 import turbomole_functions as tm
-from hyperpol_tensors import hyper_main
+from output_scanner import scan_output
+from hyperpol_tensors import (STATIC_NM, au_to_esu, get_hyper_polarizability_for_pair, hyper_main,
+                              pair_numbers_by_wavelength)
+from packed_tensors import PackedBeta
+from checkpoints import StageRunner
+from control_file import edit_control
+from results_archive import ARCHIVE_SUFFIX, BlobStore, package_results, extract_results
+from results_record import RESULTS_BASENAME, artifact_reference, read_results, write_results
+from calc_cache import CalculationCache, calculation_key
+from telemetry import summarize_metrics
+from structure_io import coord_to_xyz, electron_count, read_structure, write_coord, xyz_to_coord
+from vibrations import read_vibrations
+from warm_start import read_coord_block, seed_orbitals
+from opt_restart import (SEED_DIR, finish_progress, optimization_cycles, resume_progress, save_progress,
+                         seed_hessian, stash_hessian_sources)
 
 
 
@@ -24,6 +37,30 @@ DISP_DICT = {
     'D4': 'd4'
 }
 
+STAGES = ('define', 'cosmoprep', 'tddft', 'warmstart', 'ridft', 'escf', 'sweep', 'riper', 'jobex', 'aoforce')
+
+# The settings each stage reads, and so the only ones whose change makes it (and the stages after it) run again.
+# The title, packaging, cache and telemetry settings are read by none of them.
+_SCF_SETTINGS = ('use ri', 'opt', 'tddft', 'scf iter', 'max scf iter', 'monitor rules')
+STAGE_SETTINGS = {
+    'define': ('follow-up', 'structure file type', 'int coord', 'basis set', 'use old mos', 'charge from file',
+               'charge', 'multiplicity', 'scf iter', 'use ri', 'ricore', 'functional', 'grid size', 'disp',
+               'tddft', 'exc state type', 'num exc states'),
+    'cosmoprep': ('cosmo', 'epsilon', 'follow-up'),
+    'tddft': ('tddft', 'opt', 'opt exc state', 'cosmo'),
+    'warmstart': ('warm start', 'warm start root', 'use old mos', 'basis set', 'charge', 'multiplicity', 'functional'),
+    'ridft': _SCF_SETTINGS,
+    'escf': ('hyperpol', 'freq_hyper', 'monitor rules'),
+    'sweep': _SCF_SETTINGS + ('cosmo', 'epsilon', 'epsilon sweep', 'hyperpol', 'freq_hyper'),
+    'riper': ('plt_orbts', 'plot orbitals', 'orbital grid points'),
+    'jobex': _SCF_SETTINGS + ('opt exc state', 'opt cyc', 'max opt cyc', 'seed hessian', 'hessian sources'),
+    'aoforce': ('freq', 'tddft'),
+}
+
+# The permittivity sweep runs on a copy of the converged calculation, so the main results stay untouched
+SWEEP_DIR = 'permittivity_sweep'
+SWEEP_FILES = ('control', 'coord', 'basis', 'auxbasis', 'mos', 'alpha', 'beta', 'out.ccf')
+
 
 def extract_number(filename: str) -> int:
     """
@@ -34,55 +71,63 @@ def extract_number(filename: str) -> int:
     return int(match.group(1)) if match else None
 
 
-def update_dict_incrementally(file_path: str, results_dict: dict, key: str) -> None:
+def find_cub_files() -> dict:
     """
-    Updates the given dictionary (`results_dict`) by reading the contents of the file at `file_path`
-    and storing them as a string under `results_dict[key]`.
-    """
-    results_dict[key] = ""
-    with open(file_path, 'r') as file:
-        for line in file:
-            results_dict[key] += line
+    Finds all files in the current directory that match the '_real.cub' suffix.
+    Returns {orbital number: filename}.
+    Raises a ValueError if a filename does not contain its orbital number.
+    """
+    cub_files = {}
+    for filename in os.listdir('.'):
+        if filename.endswith('_real.cub'):
+            number = extract_number(filename)
+            if number is None:
+                raise ValueError(f"Couldn't extract the orbital number from {filename}.")
+            cub_files[number] = filename
+    return cub_files
 
 
-def find_cub_files() -> list:
+def process_cub_files(results_dict: dict, orbitals: dict) -> None:
     """
-    Finds all files in the current directory that match the '_real.cub' suffix.
-    Expects exactly two such files to be present and returns a list of their filenames.
-    Raises a ValueError if a different number of matching files is found.
+    Processes the cube files of the plotted orbitals ({label: orbital number}, see orbital_numbers)
+    found in the current directory and stores references to them (path, size, hash) in `results_dict`
+    as '<label>-orb', e.g. 'homo-orb', 'lumo+1-orb'; the cube files themselves go into the results archive.
     """
-    cub_files = [f for f in os.listdir('.') if f.endswith('_real.cub')]
-    if len(cub_files) != 2:
-        raise ValueError("There should be exactly two '.cub' files in the current directory.")
-    return cub_files
+    cub_files = find_cub_files()
+    for label, number in orbitals.items():
+        if number not in cub_files:
+            raise ValueError(f"No '.cub' file for orbital {number} ({label}) in the current directory.")
+        results_dict[f'{label.lower()}-orb'] = artifact_reference(cub_files[number])
 
 
-def process_cub_files(results_dict: dict) -> None:
+def orbital_numbers(labels: list, homo: int, lumo: int) -> dict:
     """
-    Processes HOMO and LUMO cube files found in the current directory. Identifies the correct
-    files as HOMO or LUMO based on their filenames and updates the `results_dict` with their contents.
+    Returns {label: orbital number} for orbital labels relative to the frontier orbitals
+    ('HOMO', 'HOMO-2', 'LUMO+1', ...); plain numbers are taken as they are.
     """
-    # Find the .cub files
-    file1_path, file2_path = find_cub_files()
-
-    # Extract numbers from filenames
-    file1_number = extract_number(file1_path)
-    file2_number = extract_number(file2_path)
+    orbitals = {}
+    for label in labels:
+        match = re.fullmatch(r'(HOMO|LUMO)\s*(?:([+-])\s*(\d+))?', str(label).strip().upper())
+        if match is None:
+            orbitals[str(label)] = int(label)
+            continue
+        offset = int(match.group(3) or 0) * (-1 if match.group(2) == '-' else 1)
+        name = match.group(1) + (f'{match.group(2)}{match.group(3)}' if offset else '')
+        orbitals[name] = (homo if match.group(1) == 'HOMO' else lumo) + offset
+    return orbitals
 
-    # Determine which file is HOMO and which is LUMO based on the extracted numbers
-    if file1_number is not None and file2_number is not None:
-        if file1_number < file2_number:
-            homo_file_path = file1_path
-            lumo_file_path = file2_path
-        else:
-            homo_file_path = file2_path
-            lumo_file_path = file1_path
-    else:
-        raise ValueError("Couldn't extract numbers from the HOMO/LUMO filenames.")
 
-    # Update the dictionary incrementally with HOMO and LUMO file contents
-    update_dict_incrementally(homo_file_path, results_dict, "homo-orb")
-    update_dict_incrementally(lumo_file_path, results_dict, "lumo-orb")
+def orbital_grid(coord_file: str, points: int, margin: float = 5.0) -> list:
+    """
+    Returns the grid lines for $pointvalper: `points` points along each axis, covering the
+    molecule plus `margin` bohr on every side around its center.
+    """
+    _, positions = read_coord_block(coord_file)
+    center = (positions.max(axis=0) + positions.min(axis=0)) / 2
+    half = (positions.max(axis=0) - positions.min(axis=0)) / 2 + margin
+    lines = [f'grid{i + 1} vector {" ".join("1" if j == i else "0" for j in range(3))} '
+             f'range {-half[i]:.3f},{half[i]:.3f} points {points}' for i in range(3)]
+    return lines + ['origin {:.6f} {:.6f} {:.6f}'.format(*center)]
 
 
 def get_settings_from_rendered_wano(filename: str = 'rendered_wano.yml') -> dict:
@@ -100,6 +145,8 @@ def get_settings_from_rendered_wano(filename: str = 'rendered_wano.yml') -> dict
         'int coord': wano_file['Molecular structure']['Internal coordinates'],
         'basis set': wano_file['Basis set']['Basis set type'],
         'use old mos': wano_file['Initial guess']['Use old orbitals'],
+        'warm start': wano_file['Initial guess'].get('Warm start from siblings', True),
+        'warm start root': wano_file['Initial guess'].get('Sibling calculations', '../..'),
         'charge from file': wano_file['Initial guess']['G1']['Use charge and multiplicity from input file'],
         'charge': wano_file['Initial guess']['G1']['Charge'],
         'multiplicity': wano_file['Initial guess']['G1']['Multiplicity'],
@@ -112,17 +159,29 @@ def get_settings_from_rendered_wano(filename: str = 'rendered_wano.yml') -> dict
         'disp': DISP_DICT[wano_file['DFT options']['vdW correction']],
         'cosmo': wano_file['DFT options']['COSMO calculation'],
         'epsilon': wano_file['DFT options']['Rel permittivity'],
+        'epsilon sweep': wano_file['DFT options'].get('Permittivity sweep', []),
+        'monitor rules': wano_file['DFT options'].get('Early abort rules', {}),
         'opt': wano_file['Type of calculation']['Structure optimisation'],
         'opt cyc': 300,
         'max opt cyc': wano_file['Type of calculation']['Max optimization cycles'],
+        'seed hessian': wano_file['Type of calculation'].get('Seed Hessian', True),
+        'hessian sources': wano_file['Type of calculation'].get('Hessian sources', []),
         'hyperpol': wano_file['Type of calculation']['Hyperpolarizability'],
         'plt_orbts': wano_file['Type of calculation']['Plot Homo-Lumo Orbt'],
+        'plot orbitals': wano_file['Type of calculation'].get('Plotted orbitals', ['HOMO', 'LUMO']),
+        'orbital grid points': wano_file['Type of calculation'].get('Orbital grid points', None),
         'freq_hyper': [a_dict["frequency (nm)"] for a_dict in wano_file['Type of calculation']["First hyperpolarizability"]],
         'freq': wano_file['Type of calculation']['Frequency calculation'],
         'tddft': wano_file['Type of calculation']['Excited states calculation'],
         'exc state type': wano_file['Type of calculation']['TDDFT options']['Type of excited states'],
         'num exc states': wano_file['Type of calculation']['TDDFT options']['Number of excited states'],
-        'opt exc state': wano_file['Type of calculation']['TDDFT options']['Optimised state']
+        'opt exc state': wano_file['Type of calculation']['TDDFT options']['Optimised state'],
+        'archive codec': wano_file.get('Results packaging', {}).get('Codec', 'xz'),
+        'archive level': wano_file.get('Results packaging', {}).get('Level', None),
+        'archive threads': wano_file.get('Results packaging', {}).get('Threads', 0),
+        'blob store': os.environ.get('TM_BLOB_STORE') or wano_file.get('Results packaging', {}).get('Blob store', None),
+        'calc cache': os.environ.get('TM_CALC_CACHE') or wano_file.get('Calculation cache', {}).get('Directory', None),
+        'calc cache size': wano_file.get('Calculation cache', {}).get('Max size (MB)', None),
     }
     return settings
 
@@ -156,21 +215,87 @@ def sanitize_multiplicity(multiplicity: int, n_el: int) -> int:
     return corrected_multiplicity
 
 
-def main() -> None:
+def main(force: tuple = ()) -> None:
     """
     Main workflow function for the script.
     Reads settings from 'rendered_wano.yml', prepares files, runs TURBOMOLE calculations,
     and gathers results into 'turbomole_results.yml'.
+    Every stage leaves a completion marker, so a restarted job resumes at the first stage
+    that has not completed with the same inputs; stages named in `force` are always re-run.
+    With a calculation cache, a calculation that was already done with the same structure and
+    settings is copied from the cache instead (unless stages are forced).
+    Wall time, CPU time and memory of every stage and Turbomole call go to 'turbomole_metrics.jsonl'
+    and their totals into the results under 'telemetry'.
     """
     coord_file = 'coord_0'
     settings = get_settings_from_rendered_wano()
 
+    cache = None if force else CalculationCache.from_settings(settings)
+    if cache is not None:
+        cache_key = calculation_key(settings)
+        if cache.materialize(cache_key):
+            print(f'Calculation found in the calculation cache ({cache_key[:12]}), results copied.')
+            cached_results = read_results()
+            cached_results.update({'title': settings['title'], 'calculation cache': cache_key})
+            write_results(cached_results)
+            return
+
     # Properties are stored in results_dict
     results_dict = {'title': settings['title'], 'energy_unit': 'Hartree'}
+    stages = StageRunner(force, stage_settings=STAGE_SETTINGS)
+    # Before any skipped stage restores its files over those of an interrupted optimization
+    save_progress()
+
+    old_settings = stages.run('define', lambda: prepare_input(settings, coord_file), settings, results_dict,
+                              inputs=('initial_structure', 'old_calc.tar.xz'))
+    stages.run('cosmoprep', lambda: prepare_cosmo(settings, old_settings), settings, results_dict)
+    stages.run('tddft', lambda: handle_tddft(settings), settings, results_dict)
+
+    warm_start = None
+    if settings['warm start'] and not settings['use old mos']:
+        warm_start = stages.run('warmstart', lambda: seed_orbitals(settings, 'coord', settings['warm start root']),
+                                settings, results_dict)
+
+    scf_iterations = stages.run('ridft', lambda: tm.single_point_calculation(
+        settings, attempts_log=results_dict.setdefault('scf attempts', [])), settings, results_dict)
+    results_dict['scf iterations'] = scf_iterations
+    if warm_start:
+        # The reference is a cold start with another functional, so the difference is only an estimate
+        reference = warm_start['reference iterations']
+        warm_start['iterations'] = scf_iterations
+        warm_start['iterations saved (estimate)'] = reference - scf_iterations if reference and scf_iterations else None
+        results_dict['warm start'] = warm_start
+
+    stages.run('escf', lambda: handle_hyperpol(settings, results_dict), settings, results_dict)
+    if settings['epsilon sweep']:
+        stages.run('sweep', lambda: handle_permittivity_sweep(settings, results_dict), settings, results_dict)
+    stages.run('riper', lambda: handle_orbitals(settings, results_dict), settings, results_dict)
+
+    if settings['opt']:
+        stages.run('jobex', lambda: handle_optimization(settings, results_dict), settings, results_dict)
+
+    if settings['freq']:
+        stages.run('aoforce', lambda: handle_frequency(settings, results_dict), settings, results_dict)
+
+    gather_results(results_dict, settings)
+    results_dict['telemetry'] = summarize_metrics()
+    write_output_files(results_dict)
+    artifacts = [value['path'] for value in results_dict.values() if isinstance(value, dict) and 'sha256' in value]
+    prepare_output_files(settings, artifacts)
+
+    if cache is not None:
+        cache.store(cache_key, [RESULTS_BASENAME + '.yml', RESULTS_BASENAME + '.npz', 'final_structure.xyz',
+                                'results' + ARCHIVE_SUFFIX[settings['archive codec']]] + artifacts)
 
+
+def prepare_input(settings: dict, coord_file: str) -> dict:
+    """
+    Prepares the coordinate file (or unpacks the previous calculation for follow-ups), sets charge
+    and multiplicity and runs define. Returns the settings of the previous calculation, if any.
+    """
     if settings['follow-up']:
-        os.system('mkdir old_results; tar -xf old_calc.tar.xz -C old_results')
-        os.system(f'cp old_results/coord {coord_file}')
+        extract_results('old_calc.tar.xz', 'old_results', get_blob_store(settings))
+        shutil.copyfile('old_results/coord', coord_file)
         old_settings = get_settings_from_rendered_wano(filename='old_results/rendered_wano.yml')
         settings['title'] = old_settings['title']
         if settings['use old mos']:
@@ -181,33 +306,17 @@ def main() -> None:
 
     if not settings['use old mos']:
         if settings['charge from file'] and settings['structure file type'] == 'Gaussian input':
-            ginp = GaussianInput.from_file('initial_structure')
-            settings['charge'], settings['multiplicity'] = ginp.charge, ginp.spin_multiplicity
+            structure = read_structure('initial_structure', 'Gaussian input')
+            settings['charge'], settings['multiplicity'] = structure['charge'], structure['multiplicity']
         else:
-            n_el = sum(ase.io.read(coord_file).numbers) - settings['charge']
-            settings['multiplicity'] = sanitize_multiplicity(settings['multiplicity'], n_el)
+            n_el = electron_count(read_structure(coord_file, 'Turbomole coord')['symbols'], settings['charge'])
+            settings['multiplicity'] = int(sanitize_multiplicity(settings['multiplicity'], n_el))
 
     tm.input_preparation('define', tm.make_define_string(settings, coord_file))
     if settings['follow-up']:
-        os.system('rm -rf old_results')
-
-    prepare_cosmo(settings, old_settings)
-    handle_tddft(settings)
-
-    tm.single_point_calculation(settings)
-
-    handle_hyperpol(settings, results_dict)
-    handle_orbitals(settings, results_dict)
-
-    if settings['opt']:
-        tm.jobex(settings)
-
-    if settings['freq']:
-        handle_frequency(settings, results_dict)
-
-    gather_results(results_dict, settings)
-    write_output_files(results_dict)
-    prepare_output_files()
+        stash_hessian_sources('old_results')
+        shutil.rmtree('old_results', ignore_errors=True)
+    return old_settings
 
 
 def handle_structure_file(settings: dict, coord_file: str) -> None:
@@ -215,12 +324,14 @@ def handle_structure_file(settings: dict, coord_file: str) -> None:
     Handles the preparation of the coordinate file from the initial structure, depending on the input structure file type.
     """
     if settings['structure file type'] == 'Turbomole coord':
-        os.rename('initial_structure', coord_file)
+        # Copied rather than renamed so that a restarted job still finds its input structure
+        shutil.copyfile('initial_structure', coord_file)
+    elif settings['structure file type'] == 'Gaussian input':
+        # The Gaussian input is kept unchanged, it is still read for charge and multiplicity
+        structure = read_structure('initial_structure', 'Gaussian input')
+        write_coord(coord_file, structure['symbols'], structure['positions'])
     else:
-        if settings['structure file type'] == 'Gaussian input':
-            ginp = GaussianInput.from_file('initial_structure')
-            xyz.XYZ(ginp.molecule).write_file('initial_structure')
-        os.system(f'x2t initial_structure > {coord_file}')
+        xyz_to_coord('initial_structure', coord_file)
 
 
 def prepare_cosmo(settings: dict, old_settings: dict = None) -> None:
@@ -229,16 +340,36 @@ def prepare_cosmo(settings: dict, old_settings: dict = None) -> None:
     and old COSMO settings are found, updates them accordingly.
     """
     if settings['cosmo']:
-        if settings['follow-up'] and old_settings:
-            if old_settings['cosmo']:
-                tm.input_preparation('cosmoprep', f'u\n{settings["epsilon"]}\n\n\n\n\n\n\n\n\n\n\n*\n\n\n')
-            else:
-                tm.input_preparation('cosmoprep', f'{settings["epsilon"]}\n\n\n\n\n\n\n\n\n\n\nr all b\n*\n\n\n')
-        else:
-            tm.input_preparation('cosmoprep', f'{settings["epsilon"]}\n\n\n\n\n\n\n\n\n\n\nr all b\n*\n\n\n')
+        run_cosmoprep(settings['epsilon'], update=bool(settings['follow-up'] and old_settings and old_settings['cosmo']))
     elif settings['follow-up'] and old_settings and old_settings['cosmo']:
-        for datagroup in ['cosmo', 'cosmo_atoms', 'cosmo_out']:
-            os.system(f'kdg {datagroup}')
+        with edit_control() as control:
+            for datagroup in ['cosmo', 'cosmo_atoms', 'cosmo_out']:
+                control.delete(datagroup)
+
+
+def run_cosmoprep(epsilon: float, update: bool = False) -> None:
+    """
+    Runs cosmoprep with the relative permittivity `epsilon` and default parameters. With `update`,
+    the existing COSMO settings are updated, otherwise they are set up from scratch (default radii).
+    """
+    if update:
+        tm.input_preparation('cosmoprep', f'u\n{epsilon}\n\n\n\n\n\n\n\n\n\n\n*\n\n\n')
+    else:
+        tm.input_preparation('cosmoprep', f'{epsilon}\n\n\n\n\n\n\n\n\n\n\nr all b\n*\n\n\n')
+
+
+def set_permittivity(epsilon: float) -> None:
+    """
+    Sets the relative permittivity of the COSMO settings in control to `epsilon`, keeping all other
+    COSMO parameters; without COSMO settings, they are set up by cosmoprep.
+    """
+    with edit_control() as control:
+        body = control.get('cosmo')
+        if body is not None:
+            control.set('cosmo', control.header('cosmo')[len('cosmo'):].strip(),
+                        body=[re.sub(r'epsilon=\s*\S+', f'epsilon= {epsilon:8.3f}', line) for line in body])
+    if body is None:
+        run_cosmoprep(epsilon)
 
 
 def handle_tddft(settings: dict) -> None:
@@ -248,7 +379,8 @@ def handle_tddft(settings: dict) -> None:
     """
     if settings['tddft'] and settings['opt']:
         if not settings['cosmo']:
-            os.system(f'adg exopt {settings["opt exc state"]}')
+            with edit_control() as control:
+                control.set('exopt', settings['opt exc state'])
         else:
             print("Excited state optimisations with COSMO not yet implemented in TURBOMOLE's egrad. \
                   A single-point calculation is performed instead.")
@@ -259,71 +391,168 @@ def handle_hyperpol(settings: dict, results_dict: dict) -> None:
     """
     Handles hyperpolarizability calculations if requested.
     Updates the control file with required settings and retrieves the results.
+    All wavelengths go into one escf run; its pairs are split back into one record per wavelength,
+    and the first wavelength also fills the single-wavelength result fields.
     """
     if settings['hyperpol'] and os.path.exists('control'):
-        with open("control", "r") as in_file:
-            buf = in_file.readlines()
+        # If the first frequency is not zero, we insert a placeholder value (like 45560000000.0)
+        # This placeholder is likely specific to the domain logic for calculations.
+        if settings['freq_hyper'][0] != 0:
+            settings['freq_hyper'].insert(0, STATIC_NM)
 
-        with open("control", "w") as out_file:
-            for line in buf:
-                if line.strip("\n") != "$end":
-                    out_file.write(line)
-            out_file.write("$scfinstab hyperpol nm\n")
+        with edit_control() as control:
+            control.set('scfinstab', 'hyperpol nm', body=[freq_h for freq_h in settings['freq_hyper'] if freq_h != 0])
 
-            # If the first frequency is not zero, we insert a placeholder value (like 45560000000.0)
-            # This placeholder is likely specific to the domain logic for calculations.
-            if settings['freq_hyper'][0] != 0:
-                settings['freq_hyper'].insert(0, 45560000000.0)
+        tm.hyper_polarizability_calculation(settings['monitor rules'])
 
-            for freq_h in settings['freq_hyper']:
-                if freq_h != 0:
-                    out_file.write(f'{freq_h}\n')
-            out_file.write("$end")
+        dipole = tm.get_dipole_moment().tolist()
+        results_dict['dipole'] = dipole
 
-        tm.hyper_polarizability_calculation()
+        results_dict.update(hyperpol_results(settings))
 
-        #beta = tm.get_hyper_polarizability_2nd_pair().tolist()
-        dipole = tm.get_dipole_moment().tolist()
 
-        results_dict['dipole'] = dipole
-        #results_dict['beta(10E-30 esu)'] = beta
-        
-        results_dict['1st beta zzz (10E-30 esu)'] = float(hyper_main(pair_number=1))
-        results_dict['2nd beta zzz (10E-30 esu)'] = float(hyper_main(pair_number=2))
-        results_dict['3rd beta zzz (10E-30 esu)'] = float(hyper_main(pair_number=3))
+def hyperpol_results(settings: dict) -> dict:
+    """
+    Returns the hyperpolarizability results of the escf run in the current directory: the record of
+    the first wavelength (see hyperpol_record) and, for several wavelengths, the records of all of
+    them under 'hyperpolarizability by wavelength'.
+    """
+    wavelengths = [freq_h for freq_h in settings['freq_hyper'] if freq_h not in (0, STATIC_NM)]
+    by_wavelength = {
+        f'{wavelength:g} nm': hyperpol_record(pairs)
+        for wavelength, pairs in pair_numbers_by_wavelength(wavelengths).items()
+    }
+    results = dict(next(iter(by_wavelength.values()))) if by_wavelength else {}
+    if len(by_wavelength) > 1:
+        results['hyperpolarizability by wavelength'] = by_wavelength
+    return results
+
+
+def hyperpol_record(pairs: dict) -> dict:
+    """
+    Returns the results of one wavelength from its pair numbers in 'hyperpols' (see
+    pair_numbers_by_wavelength): beta zzz in the dipole frame of the static (1st), Pockels (2nd) and
+    second harmonic (3rd) pair, and the Pockels tensor.
+    """
+    record = {}
+    for ordinal_name, kind in (('1st', 'static'), ('2nd', 'eope'), ('3rd', 'shg')):
+        beta_zzz = hyper_main(pair_number=pairs[kind]) if pairs[kind] else None
+        record[f'{ordinal_name} beta zzz (10E-30 esu)'] = None if beta_zzz is None else float(beta_zzz)
+    if pairs['eope']:
+        # beta is stored as its unique Kleinman components; the full tensor is kept only if it deviates too much
+        tensor = au_to_esu(get_hyper_polarizability_for_pair(pairs['eope']))
+        record['beta(10E-30 esu)'] = PackedBeta.from_tensor(tensor).to_record()
+    return record
+
+
+def sweep_point(settings: dict, scf_iterations: int) -> dict:
+    """
+    Returns the results of the converged calculation in the current directory that a permittivity
+    sweep compares: energy, SCF iterations, dipole and, if requested, the hyperpolarizabilities.
+    """
+    point = {'energy': read_energy(), 'scf iterations': scf_iterations, 'dipole': tm.get_dipole_moment().tolist()}
+    if settings['hyperpol']:
+        point.update(hyperpol_results(settings))
+    return point
+
+
+def handle_permittivity_sweep(settings: dict, results_dict: dict) -> None:
+    """
+    Repeats the SCF and hyperpolarizability steps for every relative permittivity in 'epsilon sweep'
+    (ascending), on a copy of the converged calculation in SWEEP_DIR. Each COSMO SCF starts from the
+    orbitals of the previous permittivity, the first one from those of the gas-phase (or first
+    permittivity) calculation, and escf reuses its $scfinstab settings. The results of every
+    permittivity, the converged calculation included, are stored under 'permittivity sweep'.
+    A permittivity that fails (SCF not converged, escf stopped) is recorded with its SCF attempts
+    instead of ending the job; the next one starts from the last converged orbitals.
+    """
+    main_epsilon = settings['epsilon'] if settings['cosmo'] else 1.0
+    sweep = {
+        (f'epsilon {main_epsilon:g}' if settings['cosmo'] else 'gas phase'):
+            sweep_point(settings, results_dict.get('scf iterations'))
+    }
+    shutil.rmtree(SWEEP_DIR, ignore_errors=True)
+    os.makedirs(SWEEP_DIR)
+    for filename in SWEEP_FILES:
+        if os.path.isfile(filename):
+            shutil.copyfile(filename, os.path.join(SWEEP_DIR, filename))
+
+    # Neither the optimisation nor excited states are repeated for every permittivity
+    point_settings = dict(settings, opt=False, tddft=False)
+    os.chdir(SWEEP_DIR)
+    try:
+        for epsilon in sorted(float(e) for e in settings['epsilon sweep']):
+            if epsilon == main_epsilon:
+                continue
+            print(f'Permittivity sweep: epsilon = {epsilon:g}')
+            converged = {filename: filename + '.converged' for filename in ('control',) + tm.MO_FILES
+                         if os.path.isfile(filename)}
+            for filename, backup in converged.items():
+                shutil.copyfile(filename, backup)
+            attempts = []
+            set_permittivity(epsilon)
+            try:
+                scf_iterations = tm.single_point_calculation(point_settings, attempts_log=attempts)
+                if settings['hyperpol']:
+                    tm.hyper_polarizability_calculation(settings['monitor rules'])
+            except SystemExit:
+                # The Turbomole helpers exit the job on failure; one permittivity must not end the main calculation
+                print(f'Permittivity sweep: epsilon = {epsilon:g} failed, continuing with the next one.')
+                sweep[f'epsilon {epsilon:g}'] = {'failed': True, 'scf attempts': attempts}
+                for filename, backup in converged.items():
+                    shutil.copyfile(backup, filename)
+                continue
+            sweep[f'epsilon {epsilon:g}'] = sweep_point(settings, scf_iterations)
+    finally:
+        os.chdir('..')
+    results_dict['permittivity sweep'] = sweep
 
 
 def handle_orbitals(settings: dict, results_dict: dict) -> None:
     """
     Handles orbital plot generation if requested.
-    Updates 'control' to request HOMO and LUMO orbitals. Then it reads the .cub files
-    to store HOMO and LUMO data in `results_dict`.
+    Updates 'control' to request the orbitals in 'plot orbitals' (HOMO and LUMO by default), numbered
+    from the HOMO/LUMO in eiger.out, runs the property code once and stores references to the
+    .cub files in `results_dict`.
     """
     if settings['plt_orbts'] and os.path.exists('control'):
-        tm.plot_homo_lumo_orbitals()
+        # eiger.out is written after every SCF, so the orbital numbers are known before the property run
+        if not os.path.isfile('eiger.out'):
+            os.system('eiger > eiger.out')
         homo_l, lumo_l = tm.homo_lumo_numbers_from_orbitals('eiger.out', 'HOMO-LUMO Separation')
+        orbitals = orbital_numbers(settings['plot orbitals'], homo_l, lumo_l)
 
-        with open("control", "r") as f:
-            lines = f.readlines()
-        with open("control", "w") as f:
-            for line in lines:
-                if line.strip("\n") != "$rij":
-                    f.write(line)
-                else:
-                    f.write('$rij\n')
-                    f.write('$pointvalper fmt=cub\n')
-                    f.write('orbs 2\n')
-                    f.write(f'k 1 1 1 a {homo_l}\n')
-                    f.write(f'k 1 1 1 a {lumo_l}\n')
+        numbers = sorted(set(orbitals.values()))
+        body = [f'orbs {len(numbers)}'] + [f'k 1 1 1 a {number}' for number in numbers]
+        if settings['orbital grid points']:
+            body += orbital_grid('coord', settings['orbital grid points'])
+        with edit_control() as control:
+            control.set('pointvalper', 'fmt=cub', after='rij', body=body)
 
         tm.plot_homo_lumo_orbitals()
-        process_cub_files(results_dict)
+        process_cub_files(results_dict, orbitals)
+
+
+def handle_optimization(settings: dict, results_dict: dict) -> None:
+    """
+    Runs the structure optimisation with jobex. An interrupted optimization from the same starting
+    structure is continued from its last structure and gradient history; otherwise the optimizer is
+    seeded with the best Hessian found here, in a previous calculation (follow-ups) or in the
+    'Hessian sources' directories.
+    """
+    seed = None
+    resumed = resume_progress()
+    if settings['seed hessian'] and not resumed:
+        seed = seed_hessian('coord', ['.', SEED_DIR] + list(settings['hessian sources']))
+    tm.jobex(settings)
+    finish_progress()
+    results_dict['optimization'] = {'resumed': resumed, 'hessian seed': seed, 'cycles': optimization_cycles()}
 
 
 def handle_frequency(settings: dict, results_dict: dict) -> None:
     """
     Handles vibrational frequency calculations if requested and feasible.
-    For ground-state calculations, runs 'aoforce' and retrieves the frequencies and zero-point energy (ZPE).
+    For ground-state calculations, runs 'aoforce'; its results are read in gather_results.
     For excited states, prints a message stating it's not implemented.
     """
     if settings['tddft']:
@@ -332,28 +561,13 @@ def handle_frequency(settings: dict, results_dict: dict) -> None:
     else:
         tm.run_aoforce()
 
-    vib_freq = []
-    with open('aoforce.out') as infile:
-        ao_lines = infile.readlines()
-    for ao_line in ao_lines:
-        if 'frequency  ' in ao_line:
-            for freq in ao_line.split()[1:]:
-                if 'i' in freq:
-                    vib_freq.append(-float(freq.replace('i', '')))
-                else:
-                    vib_freq.append(float(freq))
-        if 'zero point' in ao_line:
-            results_dict['ZPE'] = float(ao_line.split()[6])
-    results_dict['vibrational frequencies'] = vib_freq
-
 
-def gather_results(results_dict: dict, settings: dict) -> None:
+def read_energy(filename: str = 'energy') -> float:
     """
-    Gathers the results of the calculations, including energy, HOMO/LUMO levels, and (if available) excited-state energies.
-    Stores these results into `results_dict`.
+    Returns the total energy of the last step in Turbomole's 'energy' file.
+    Raises a ValueError if the file does not contain it.
     """
-    # Process 'energy' file
-    with open('energy') as infile:
+    with open(filename) as infile:
         energy_lines = infile.readlines()
         energy_value = None
 
@@ -375,11 +589,18 @@ def gather_results(results_dict: dict, settings: dict) -> None:
         if energy_value is None:
             raise ValueError("The 'energy' file is missing expected data.")
 
-        results_dict['energy'] = energy_value
+    return energy_value
+
 
-    # Process 'eiger.out' file
-    with open('eiger.out') as infile:
-        content = infile.readlines()
+def gather_results(results_dict: dict, settings: dict) -> None:
+    """
+    Gathers the results of the calculations, including energy, HOMO/LUMO levels, and (if available) excited-state energies.
+    Stores these results into `results_dict`.
+    """
+    results_dict['energy'] = read_energy()
+
+    # Process the 'HOMO-LUMO Separation' section of 'eiger.out'
+    content = scan_output('eiger.out').lines_from('HOMO-LUMO Separation', count=4)
 
     # Initialize variables
     homo_energy = None
@@ -430,36 +651,64 @@ def gather_results(results_dict: dict, settings: dict) -> None:
                 raise ValueError("Invalid excitation energy value in 'exspectrum' file.")
         results_dict['exc_energies'] = exc_energies
 
+    # Process the aoforce results (vibspectrum/vib_normal_modes, else aoforce.out) if frequencies were computed
+    if settings.get('freq') and os.path.isfile('aoforce.out'):
+        vibrations = read_vibrations()
+        results_dict['ZPE'] = vibrations['zpe']
+        results_dict['vibrational frequencies'] = vibrations['wavenumbers']
+        results_dict['IR intensities'] = vibrations['ir intensities']
+        results_dict['IR active'] = vibrations['ir active']
+        results_dict['Raman active'] = vibrations['raman active']
+        results_dict['normal modes'] = vibrations['normal modes']
+
 
 def write_output_files(results_dict: dict) -> None:
     """
-    Writes the results dictionary to a YAML file named 'turbomole_results.yml'.
+    Writes the results dictionary as the typed record 'turbomole_results.npz' and its YAML view
+    'turbomole_results.yml'.
+    """
+    write_results(results_dict)
+
+
+def get_blob_store(settings: dict) -> BlobStore:
+    """
+    Returns the blob store configured by $TM_BLOB_STORE or 'Blob store', or None.
     """
-    with open('turbomole_results.yml', 'w') as outfile:
-        yaml.dump(results_dict, outfile, default_flow_style=False)
+    if not settings['blob store']:
+        return None
+    return BlobStore(settings['blob store'], settings['archive codec'], settings['archive level'],
+                     settings['archive threads'])
 
 
-def prepare_output_files() -> None:
+def prepare_output_files(settings: dict, artifacts: list = ()) -> None:
     """
     Prepares and packages the output files generated by the TURBOMOLE calculation.
-    Creates a 'results.tar.xz' archive containing relevant files and produces a 'final_structure.xyz' from the coordinate file.
+    Creates a compressed 'results.tar.xz' (or '.tar.zst') archive containing relevant files and the
+    `artifacts` the results refer to (orbital cubes), and produces a 'final_structure.xyz' from the
+    coordinate file. With a blob store ($TM_BLOB_STORE or 'Blob store'), larger files are stored there
+    once for all sibling calculations and the archive holds their manifest.
     """
     output_files = [
         'alpha', 'auxbasis', 'basis', 'beta', 'control', 'coord', 'energy',
-        'forceapprox', 'gradient', 'hessapprox', 'mos', 'optinfo', 'rendered_wano.yml',
+        'forceapprox', 'gradient', 'hessapprox', 'hessian', 'mos', 'optinfo', 'rendered_wano.yml',
         'sing_a', 'trip_a', 'unrs_a'
     ]
-    existing_files = [filename for filename in output_files if os.path.isfile(filename)]
+    existing_files = [filename for filename in output_files + list(artifacts) if os.path.isfile(filename)]
     if existing_files:
-        os.system(f'tar -cf results.tar.xz {" ".join(existing_files)}')
+        codec = settings['archive codec']
+        package_results(existing_files, 'results' + ARCHIVE_SUFFIX[codec], codec, settings['archive level'],
+                        settings['archive threads'], get_blob_store(settings))
     else:
         print("No additional output files found to package.")
 
     if os.path.isfile('coord'):
-        os.system('t2x coord > final_structure.xyz')
+        coord_to_xyz('coord', 'final_structure.xyz')
     else:
         print("Coordinate file 'coord' not found. Cannot create 'final_structure.xyz'.")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Run the TURBOMOLE workflow described by rendered_wano.yml.')
+    parser.add_argument('--force', nargs='+', default=(), choices=STAGES + ('all',),
+                        help='stages to re-run even if they completed with the same inputs')
+    main(tuple(parser.parse_args().force))
\ No newline at end of file
@@ -0,0 +1,255 @@
+import re
+import argparse
+import numpy as np
+from pathlib import Path
+from warm_start import read_coord_block
+
+###############################################################################
+#     NATIVE READERS FOR xyz, TURBOMOLE coord AND GAUSSIAN INPUT STRUCTURES   #
+###############################################################################
+
+# CODATA 2018, the value x2t/t2x use (ase's CODATA 2014 value differs by 6e-10 relative)
+BOHR_TO_ANGSTROM = 0.529177210903
+
+ELEMENTS = (
+    'X',
+    'H', 'He',
+    'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar',
+    'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr',
+    'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Sb', 'Te', 'I', 'Xe',
+    'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu',
+    'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md', 'No', 'Lr',
+    'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
+)
+ATOMIC_NUMBERS = {symbol: number for number, symbol in enumerate(ELEMENTS)}
+
+# Names of the structure files in a calculation (and results) directory
+COORD_FILE = 'coord'
+FINAL_XYZ_FILE = 'final_structure.xyz'
+
+# Element part of a Gaussian atom specification, e.g. 'C', 'C-CA--0.1', 'C(Fragment=1)', '6'
+_GAUSSIAN_ELEMENT = re.compile(r'^([A-Za-z]{1,2}|\d+)(?=$|[-(])')
+
+
+def element_symbol(token: str) -> str:
+    """
+    Returns the element symbol for an element token ('c', 'CL', '17'). Raises a ValueError for
+    anything else.
+    """
+    symbol = ELEMENTS[int(token)] if token.isdigit() else token.capitalize()
+    if symbol not in ATOMIC_NUMBERS or symbol == 'X':
+        raise ValueError(f'Unknown element {token!r}.')
+    return symbol
+
+
+def _structure(symbols: list, positions, charge: int = None, multiplicity: int = None) -> dict:
+    return {
+        'symbols': symbols,
+        'positions': np.asarray(positions, dtype=float).reshape(-1, 3),
+        'charge': charge,
+        'multiplicity': multiplicity,
+    }
+
+
+def read_xyz(filename) -> dict:
+    """
+    Reads the last structure of an xyz file (the final step of a trajectory, as ase.io.read does);
+    extra columns of extended xyz are ignored. Returns the structure record: element symbols,
+    positions in Angstrom, no charge/multiplicity.
+    """
+    with open(filename, 'r') as infile:
+        lines = infile.read().splitlines()
+    start = 0
+    while True:
+        natoms = int(lines[start].split()[0])
+        following = start + natoms + 2
+        if following >= len(lines) or not lines[following].strip():
+            break
+        start = following
+    symbols, positions = [], []
+    for line in lines[start + 2:start + 2 + natoms]:
+        tokens = line.split()
+        symbols.append(element_symbol(tokens[0]))
+        positions.append([float(v) for v in tokens[1:4]])
+    if len(symbols) != natoms:
+        raise ValueError(f'{filename} ends after {len(symbols)} of {natoms} atoms.')
+    return _structure(symbols, positions)
+
+
+def read_coord(filename) -> dict:
+    """
+    Reads the $coord group of a Turbomole coord file. Returns the structure record: element symbols,
+    positions in Angstrom, no charge/multiplicity.
+    """
+    elements, positions = read_coord_block(filename)
+    if not elements:
+        raise ValueError(f'No $coord group in {filename}.')
+    return _structure([element_symbol(element) for element in elements], positions * BOHR_TO_ANGSTROM)
+
+
+def read_gaussian_input(filename) -> dict:
+    """
+    Reads a Gaussian input with Cartesian coordinates: Link 0 and route section, title, charge and
+    multiplicity (of the whole molecule for fragment inputs) and the atoms up to the next blank line.
+    Freeze flags and atom type/fragment suffixes are skipped. Returns the structure record (Angstrom).
+    Raises a ValueError for inputs it does not cover, e.g. Z-matrices.
+    """
+    with open(filename, 'r') as infile:
+        lines = [line.strip() for line in infile.read().splitlines()]
+    lines = [line for line in lines if not line.startswith('%')]
+    # Route section, title and molecule specification are separated by blank lines
+    sections, current = [], []
+    for line in lines:
+        if line:
+            current.append(line)
+        elif current:
+            sections.append(current)
+            current = []
+    if current:
+        sections.append(current)
+    if len(sections) < 3 or not sections[0][0].startswith('#'):
+        raise ValueError(f'{filename} is not a Gaussian input with route, title and molecule sections.')
+
+    charge_line, *atom_lines = sections[2]
+    charge, multiplicity = (int(v) for v in charge_line.replace(',', ' ').split()[:2])
+    symbols, positions = [], []
+    for line in atom_lines:
+        tokens = line.replace(',', ' ').split()
+        match = _GAUSSIAN_ELEMENT.match(tokens[0])
+        # Cartesian lines are 'El x y z' or 'El freeze-flag x y z'
+        if match is None or len(tokens) not in (4, 5):
+            raise ValueError(f'Unsupported atom specification in {filename}: {line!r}')
+        symbols.append(element_symbol(match.group(1)))
+        positions.append([float(v) for v in tokens[-3:]])
+    return _structure(symbols, positions, charge, multiplicity)
+
+
+STRUCTURE_READERS = {
+    'xyz': read_xyz,
+    'Turbomole coord': read_coord,
+    'Gaussian input': read_gaussian_input,
+}
+
+
+def _read_with_libraries(filename, file_type: str) -> dict:
+    """
+    Reads a structure with pymatgen (Gaussian input) or ase (otherwise), imported only here.
+    """
+    if file_type == 'Gaussian input':
+        from pymatgen.io.gaussian import GaussianInput
+        ginp = GaussianInput.from_file(filename)
+        return _structure([str(site.specie) for site in ginp.molecule], ginp.molecule.cart_coords,
+                          ginp.charge, ginp.spin_multiplicity)
+    import ase.io
+    atoms = ase.io.read(filename, format='turbomole' if file_type == 'Turbomole coord' else 'xyz')
+    return _structure(atoms.get_chemical_symbols(), atoms.positions)
+
+
+def read_structure(filename, file_type: str = 'xyz') -> dict:
+    """
+    Returns the structure in `filename` ('xyz', 'Turbomole coord' or 'Gaussian input', as in the
+    'Structure file type' setting) as a record of element symbols, positions in Angstrom and, for
+    Gaussian inputs, charge and multiplicity. Files the native readers do not cover are read with
+    ase/pymatgen instead.
+    """
+    try:
+        return STRUCTURE_READERS[file_type](filename)
+    except (ValueError, IndexError) as err:
+        print(f'{filename}: {err} Reading it with ase/pymatgen instead.')
+        return _read_with_libraries(filename, file_type)
+
+
+def electron_count(symbols: list, charge: int = 0) -> int:
+    """
+    Returns the number of electrons of a molecule with the given elements and total charge.
+    """
+    return sum(ATOMIC_NUMBERS[symbol] for symbol in symbols) - charge
+
+
+def write_xyz(filename, symbols: list, positions, comment: str = '') -> None:
+    """
+    Writes a structure (positions in Angstrom) as an xyz file, laid out like t2x output.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    lines = [str(len(symbols)), comment]
+    lines += [f'{symbol:2s}{x:13.7f}{y:13.7f}{z:13.7f} ' for symbol, (x, y, z) in zip(symbols, positions)]
+    with open(filename, 'w') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+
+
+def write_coord(filename, symbols: list, positions) -> None:
+    """
+    Writes a structure (positions in Angstrom) as a Turbomole coord file in bohr, laid out like x2t output.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3) / BOHR_TO_ANGSTROM
+    lines = ['$coord']
+    lines += [f'{x:20.14f}{y:22.14f}{z:22.14f}       {symbol.lower()}' for symbol, (x, y, z) in zip(symbols, positions)]
+    with open(filename, 'w') as outfile:
+        outfile.write('\n'.join(lines + ['$end']) + '\n')
+
+
+def coord_to_xyz(coord_file=COORD_FILE, xyz_file=FINAL_XYZ_FILE) -> None:
+    """
+    Converts a Turbomole coord file to xyz (what t2x does, without a subprocess).
+    """
+    structure = read_structure(coord_file, 'Turbomole coord')
+    write_xyz(xyz_file, structure['symbols'], structure['positions'])
+
+
+def xyz_to_coord(xyz_file, coord_file=COORD_FILE) -> None:
+    """
+    Converts the (last) structure of an xyz file to a Turbomole coord file (what x2t does, without a
+    subprocess).
+    """
+    structure = read_structure(xyz_file, 'xyz')
+    write_coord(coord_file, structure['symbols'], structure['positions'])
+
+
+def convert_tree(root, to_xyz: bool = True, overwrite: bool = False) -> list:
+    """
+    Converts the structures of every calculation below `root` in one pass: each coord to a
+    final_structure.xyz next to it or, with `to_xyz` False, each final_structure.xyz to a coord.
+    Existing targets are kept unless `overwrite`; hidden directories (stage snapshots, optimization
+    progress) are skipped. Returns the written files.
+    """
+    source_name, target_name = (COORD_FILE, FINAL_XYZ_FILE) if to_xyz else (FINAL_XYZ_FILE, COORD_FILE)
+    written = []
+    for source in sorted(Path(root).rglob(source_name)):
+        if any(part.startswith('.') for part in source.relative_to(root).parts):
+            continue
+        target = source.with_name(target_name)
+        if target.exists() and not overwrite:
+            continue
+        if to_xyz:
+            coord_to_xyz(source, target)
+        else:
+            xyz_to_coord(source, target)
+        written.append(target)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert between Turbomole coord and xyz files without x2t/t2x.')
+    parser.add_argument('source', help='coord or xyz file, or with --tree the root of a results tree')
+    parser.add_argument('target', nargs='?', default=None,
+                        help=f'output file (default: {FINAL_XYZ_FILE} for a coord, {COORD_FILE} for an xyz file)')
+    parser.add_argument('--tree', action='store_true',
+                        help=f'convert every {COORD_FILE} below SOURCE to {FINAL_XYZ_FILE} in one call')
+    parser.add_argument('--to-coord', action='store_true',
+                        help=f'with --tree: convert every {FINAL_XYZ_FILE} to {COORD_FILE} instead')
+    parser.add_argument('--overwrite', action='store_true', help='with --tree: replace existing targets')
+    args = parser.parse_args()
+
+    if args.tree:
+        written = convert_tree(args.source, not args.to_coord, args.overwrite)
+        print(f'{len(written)} files written below {args.source}.')
+    elif args.source.endswith('.xyz'):
+        xyz_to_coord(args.source, args.target or COORD_FILE)
+    else:
+        coord_to_xyz(args.source, args.target or FINAL_XYZ_FILE)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+###############################################################################
+#        WALL TIME, CPU TIME AND MEMORY OF EVERY TURBOMOLE CALL AND STAGE     #
+###############################################################################
+
+METRICS_FILE = 'turbomole_metrics.jsonl'
+
+# Turbomole's own timing summary at the end of every module output
+_TM_TIMING = re.compile(r'total\s+(cpu|wall)-time\s*:\s*(.*)')
+_TM_TIME_UNITS = {'day': 86400.0, 'hour': 3600.0, 'minute': 60.0, 'second': 1.0}
+_TM_TIME_PART = re.compile(r'([\d.]+)\s*(day|hour|minute|second)s?')
+# One line per Davidson iteration and irrep in escf: iteration, irrep, converged roots, residual norm
+_ESCF_ITERATION = re.compile(r'^\s*\d+\s+\S+\s+\d+\s+\d\.\d+D[+-]\d+\s*$')
+_SCF_ITERATIONS = re.compile(r'convergence criteria satisfied after\s+(\d+)\s+iterations')
+# Header printed above every SCF iteration of ridft/dscf
+_SCF_TABLE = re.compile(r'^\s*ITERATION\s+ENERGY')
+
+_current_stage = None
+# METRICS_FILE of the job directory, fixed when the outermost stage starts (calls may run in subdirectories)
+_metrics_path = None
+
+
+def _tm_seconds(text: str) -> float:
+    """
+    Converts a Turbomole duration like '3 days 14 hours 13 minutes and  6 seconds' to seconds.
+    """
+    return sum(float(value) * _TM_TIME_UNITS[unit] for value, unit in _TM_TIME_PART.findall(text))
+
+
+def turbomole_timings(output_file: str) -> dict:
+    """
+    Returns the total CPU and wall time (s) a Turbomole module reported at the end of `output_file`
+    (the last report, if there are several), or an empty dict.
+    """
+    timings = {}
+    with open(output_file, 'r', errors='replace') as infile:
+        for line in infile:
+            match = _TM_TIMING.search(line)
+            if match:
+                timings[f'tm {match.group(1)} time (s)'] = _tm_seconds(match.group(2))
+    return timings
+
+
+def iteration_count(program: str, output_file: str) -> int:
+    """
+    Returns the iterations reported in `output_file`: SCF iterations of ridft/dscf (all runs in the
+    file; the iteration tables are counted, so that unconverged and aborted runs are included, and the
+    reported count of converged runs is the fallback), Davidson iterations of escf (summed over irreps
+    and frequencies), optimization steps of jobex (energy file), else None.
+    """
+    if program in ('ridft', 'dscf'):
+        tables, counts = 0, []
+        with open(output_file, 'r', errors='replace') as infile:
+            for line in infile:
+                if _SCF_TABLE.match(line):
+                    tables += 1
+                else:
+                    match = _SCF_ITERATIONS.search(line)
+                    if match:
+                        counts.append(int(match.group(1)))
+        return tables or sum(counts) or None
+    if program == 'escf':
+        with open(output_file, 'r', errors='replace') as infile:
+            return sum(1 for line in infile if _ESCF_ITERATION.match(line))
+    if program == 'jobex' and os.path.isfile('energy'):
+        with open('energy', 'r') as infile:
+            return sum(1 for line in infile if line.strip() and not line.startswith('$'))
+    return None
+
+
+def _append(record: dict, metrics_file: str = None) -> None:
+    with open(metrics_file or _metrics_path or METRICS_FILE, 'a') as outfile:
+        outfile.write(json.dumps(record) + '\n')
+
+
+def _resources(before: resource.struct_rusage, after: resource.struct_rusage, start: float) -> dict:
+    """
+    Returns wall time, CPU time of the child processes between two RUSAGE_CHILDREN samples and the
+    peak RSS of any child so far (getrusage cannot isolate one call once a larger one ran).
+    """
+    return {
+        'wall time (s)': round(time.time() - start, 3),
+        'user cpu time (s)': round(after.ru_utime - before.ru_utime, 3),
+        'system cpu time (s)': round(after.ru_stime - before.ru_stime, 3),
+        'peak rss so far (MB)': round(after.ru_maxrss / 1024, 1),  # ru_maxrss is in kB on Linux
+    }
+
+
+@contextmanager
+def measured_call(command: str, output_file: str = None):
+    """
+    Measures one Turbomole call: wall time, child CPU time and the peak RSS so far, plus the timings and
+    iteration count Turbomole reports in `output_file`. Yields the record, so that the caller can add
+    to it (exit code, early abort); it is appended to METRICS_FILE when the call ends, also when the
+    job exits because of it.
+    """
+    program = command.split()[0]
+    record = {'kind': 'call', 'stage': _current_stage, 'program': program, 'command': command,
+              'output': output_file, 'started': time.strftime('%Y-%m-%d %H:%M:%S')}
+    start, before = time.time(), resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        yield record
+    finally:
+        record.update(_resources(before, resource.getrusage(resource.RUSAGE_CHILDREN), start))
+        if output_file and os.path.isfile(output_file):
+            record.update(turbomole_timings(output_file))
+            record['iterations'] = iteration_count(program, output_file)
+        _append(record)
+
+
+@contextmanager
+def measured_stage(name: str):
+    """
+    Measures one stage of run_tm.main (see checkpoints.StageRunner): the calls inside it are tagged
+    with its name, and its own wall and child CPU time go to METRICS_FILE when it ends. Calls made
+    from a subdirectory during the stage (permittivity sweep) are recorded in the same file.
+    """
+    global _current_stage, _metrics_path
+    outer, _current_stage = _current_stage, name
+    outer_path = _metrics_path
+    if outer is None:
+        _metrics_path = os.path.abspath(METRICS_FILE)
+    record = {'kind': 'stage', 'stage': name, 'started': time.strftime('%Y-%m-%d %H:%M:%S')}
+    start, before = time.time(), resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        yield record
+    finally:
+        _current_stage = outer
+        record.update(_resources(before, resource.getrusage(resource.RUSAGE_CHILDREN), start))
+        _append(record)
+        _metrics_path = outer_path
+
+
+def read_metrics(metrics_file: str = METRICS_FILE) -> list:
+    if not os.path.isfile(metrics_file):
+        return []
+    with open(metrics_file, 'r') as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def summarize_metrics(metrics_file: str = METRICS_FILE) -> dict:
+    """
+    Returns the totals of all records in METRICS_FILE (restarts of the job included, so they add up
+    to what the job really cost): wall and child CPU time of the stages that ran, the peak RSS of any
+    child, and per stage and per program the calls, wall/CPU time and, per program, the reported
+    iterations.
+    """
+    records = read_metrics(metrics_file)
+    if not records:
+        return None
+
+    def cpu(record):
+        return record['user cpu time (s)'] + record['system cpu time (s)']
+
+    def stage_entry(name):
+        return by_stage.setdefault(name, {'runs': 0, 'calls': 0, 'wall time (s)': 0.0, 'cpu time (s)': 0.0})
+
+    by_stage, by_program = {}, {}
+    for record in records:
+        if record['kind'] == 'stage':
+            entry = stage_entry(record['stage'])
+            entry['runs'] += 1
+            entry['wall time (s)'] += record['wall time (s)']
+            entry['cpu time (s)'] += cpu(record)
+            continue
+        if record['stage'] is not None:
+            stage_entry(record['stage'])['calls'] += 1
+        entry = by_program.setdefault(record['program'], {'calls': 0, 'wall time (s)': 0.0, 'cpu time (s)': 0.0,
+                                                          'iterations': 0})
+        entry['calls'] += 1
+        entry['wall time (s)'] += record['wall time (s)']
+        entry['cpu time (s)'] += cpu(record)
+        entry['iterations'] += record.get('iterations') or 0
+
+    for entry in list(by_stage.values()) + list(by_program.values()):
+        entry['wall time (s)'] = round(entry['wall time (s)'], 3)
+        entry['cpu time (s)'] = round(entry['cpu time (s)'], 3)
+    stages = [record for record in records if record['kind'] == 'stage']
+    timed = stages or records
+    return {
+        'wall time (s)': round(sum(record['wall time (s)'] for record in timed), 3),
+        'cpu time (s)': round(sum(cpu(record) for record in timed), 3),
+        # Records written before the field was renamed count as well
+        'peak rss so far (MB)': max(record.get('peak rss so far (MB)', record.get('peak rss (MB)', 0.0))
+                                    for record in records),
+        'by stage': by_stage,
+        'by program': by_program,
+    }
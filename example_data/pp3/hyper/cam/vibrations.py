@@ -0,0 +1,101 @@
+import os
+import numpy as np
+from turbomole_matrices import load_normal_modes
+
+###############################################################################
+#         STREAMING PARSERS FOR aoforce.out AND vibspectrum                   #
+###############################################################################
+
+CARTESIAN_LABELS = ('x', 'y', 'z')
+
+
+def _wavenumber(token: str) -> float:
+    """
+    aoforce marks imaginary wave numbers with a trailing 'i'; they are returned as negative numbers.
+    """
+    return -float(token[:-1]) if token.endswith('i') else float(token)
+
+
+def parse_aoforce(filename: str = 'aoforce.out') -> dict:
+    """
+    Reads the normal mode analysis of an aoforce output line by line. Returns the wave numbers
+    (cm^-1, imaginary ones negative), IR intensities (km/mol), IR and Raman selection flags,
+    the normal modes as a (3N, modes) matrix (one column per mode, as printed) and the ZPE (Hartree).
+    """
+    wavenumbers, intensities, ir_active, raman_active, blocks = [], [], [], [], []
+    zpe = None
+    columns = 0  # number of modes in the block being read, 0 outside of a block
+    with open(filename, 'r') as infile:
+        for line in infile:
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0] == 'mode' and all(t.isdigit() for t in tokens[1:]):
+                columns = len(tokens) - 1
+                blocks.append([])
+            elif 'zero point VIBRATIONAL energy' in line:
+                zpe = float(tokens[6])
+            elif not columns:
+                continue
+            elif tokens[0] == 'frequency':
+                wavenumbers.extend(_wavenumber(t) for t in tokens[1:])
+            elif tokens[0] == 'IR':
+                ir_active.extend(t == 'YES' for t in tokens[1:])
+            elif tokens[0] == 'RAMAN':
+                raman_active.extend(t == 'YES' for t in tokens[1:])
+            elif line.startswith('intensity (km/mol)'):
+                intensities.extend(float(t) for t in tokens[2:])
+            elif tokens[0] in CARTESIAN_LABELS or (len(tokens) > 2 and tokens[2] in CARTESIAN_LABELS):
+                blocks[-1].append([float(t) for t in tokens[-columns:]])
+            elif tokens[0] == 'reduced':
+                columns = 0
+    return {
+        'wavenumbers': np.array(wavenumbers),
+        'ir intensities': np.array(intensities),
+        'ir active': np.array(ir_active, dtype=bool),
+        'raman active': np.array(raman_active, dtype=bool),
+        'normal modes': np.hstack(blocks) if blocks else np.zeros((0, 0)),
+        'zpe': zpe,
+    }
+
+
+def parse_vibspectrum(filename: str = 'vibspectrum') -> dict:
+    """
+    Reads a $vibrational spectrum file. Returns the wave numbers (cm^-1), IR intensities (km/mol),
+    IR and Raman selection flags and symmetry labels (empty for translations and rotations).
+    """
+    wavenumbers, intensities, ir_active, raman_active, symmetries = [], [], [], [], []
+    with open(filename, 'r') as infile:
+        for line in infile:
+            if line.startswith(('$', '#')) or not line.strip():
+                continue
+            tokens = line.split()
+            # mode [symmetry] wave number intensity IR RAMAN
+            symmetries.append(tokens[1] if len(tokens) == 6 else '')
+            wavenumbers.append(float(tokens[-4]))
+            intensities.append(float(tokens[-3]))
+            ir_active.append(tokens[-2] == 'YES')
+            raman_active.append(tokens[-1] == 'YES')
+    return {
+        'wavenumbers': np.array(wavenumbers),
+        'ir intensities': np.array(intensities),
+        'ir active': np.array(ir_active, dtype=bool),
+        'raman active': np.array(raman_active, dtype=bool),
+        'symmetries': np.array(symmetries, dtype=str),
+    }
+
+
+def read_vibrations(directory: str = '.', cache: bool = False) -> dict:
+    """
+    Collects the vibrational results of an aoforce run in `directory`: wave numbers, IR intensities,
+    selection flags and normal modes from vibspectrum and vib_normal_modes (full precision; through
+    its .npy sidecar if one exists, written with `cache`) where present, otherwise from aoforce.out,
+    plus the ZPE from aoforce.out.
+    """
+    vibrations = parse_aoforce(os.path.join(directory, 'aoforce.out'))
+    if os.path.isfile(os.path.join(directory, 'vibspectrum')):
+        vibrations.update(parse_vibspectrum(os.path.join(directory, 'vibspectrum')))
+    normal_modes = load_normal_modes(directory, cache)
+    if normal_modes is not None:
+        vibrations['normal modes'] = normal_modes
+    return vibrations
@@ -0,0 +1,137 @@
+import shutil
+import yaml
+import numpy as np
+from pathlib import Path
+from checkpoints import STAGE_DIR
+
+###############################################################################
+#        MO WARM START FROM THE CLOSEST COMPLETED SIBLING CALCULATION         #
+###############################################################################
+
+MO_FILES = ('mos', 'alpha', 'beta')
+
+# Approximate fraction of exact exchange, used to rank how close two functionals are
+# (range-separated hybrids by their mid-range value; 'None' is MP2 on top of HF orbitals)
+EXACT_EXCHANGE = {
+    'b-p': 0.0, 'pbe': 0.0, 'tpss': 0.0, 'b97-d': 0.0,
+    'b3-lyp': 0.20, 'pbe0': 0.25, 'tpssh': 0.10, 'bh-lyp': 0.50, 'm06': 0.27, 'm06-2x': 0.54,
+    'cam-b3lyp': 0.46, 'wb97x': 0.58, 'wb97x-d': 0.58, 'None': 1.0,
+}
+GEOMETRY_TOLERANCE = 1e-4  # bohr
+
+
+def read_coord_block(filename) -> tuple:
+    """
+    Returns (elements, (N, 3) coordinates in bohr) of the $coord group of a Turbomole coord file.
+    """
+    elements, positions = [], []
+    in_coord = False
+    with open(filename, 'r') as infile:
+        for line in infile:
+            if line.startswith('$'):
+                if in_coord:
+                    break
+                in_coord = line.startswith('$coord')
+            elif in_coord and line.strip():
+                parts = line.split()
+                positions.append([float(v) for v in parts[:3]])
+                elements.append(parts[3].lower())
+    return elements, np.array(positions).reshape(-1, 3)
+
+
+def same_geometry(coord_a, coord_b, tolerance: float = GEOMETRY_TOLERANCE) -> bool:
+    """
+    Returns True if two coord files hold the same atoms at the same positions.
+    """
+    elements_a, positions_a = read_coord_block(coord_a)
+    elements_b, positions_b = read_coord_block(coord_b)
+    return (elements_a == elements_b and positions_a.shape == positions_b.shape
+            and np.allclose(positions_a, positions_b, rtol=0.0, atol=tolerance))
+
+
+def functional_distance(functional_a: str, functional_b: str) -> float:
+    """
+    Returns 0 for the same functional, otherwise the difference in exact exchange (unknown: 0.5).
+    """
+    if functional_a == functional_b:
+        return 0.0
+    return abs(EXACT_EXCHANGE.get(functional_a, 0.5) - EXACT_EXCHANGE.get(functional_b, 0.5))
+
+
+def _completed_scf(calc_dir: Path) -> dict:
+    """
+    Returns the SCF record of a sibling whose ridft stage completed: its settings, the files
+    (coord and MOs) as they were right after the SCF, the SCF iteration count and, if the sibling
+    was itself warm-started, its warm start record. Returns None for incomplete calculations.
+    """
+    stage_dir = calc_dir / STAGE_DIR
+    if not (stage_dir / 'ridft.yml').is_file() or not (calc_dir / 'rendered_wano.yml').is_file():
+        return None
+    with open(stage_dir / 'ridft.yml', 'r') as infile:
+        marker = yaml.full_load(infile)
+    files = {name: stage_dir / 'blobs' / digest for name, digest in marker['files'].items()}
+    if 'coord' not in files or not any(name in files for name in MO_FILES):
+        return None
+    with open(calc_dir / 'rendered_wano.yml', 'r') as infile:
+        wano = yaml.full_load(infile)
+    warm_start = None
+    if (stage_dir / 'warmstart.yml').is_file():
+        with open(stage_dir / 'warmstart.yml', 'r') as infile:
+            warm_start = yaml.full_load(infile)['returned']
+    return {'dir': calc_dir, 'wano': wano, 'files': files, 'iterations': marker['returned'], 'warm start': warm_start}
+
+
+def find_warm_start(settings: dict, coord_file: str = 'coord', root: str = '../..') -> dict:
+    """
+    Searches the calculations two levels below `root` for completed ones with the same geometry,
+    basis set, charge and multiplicity as this one and returns the SCF record of the one with the
+    nearest functional (the same functional at another wavelength first), or None.
+    """
+    here = Path('.').resolve()
+    candidates = []
+    # Siblings sit at <root>/hyper_<nm>/<functional>; a fixed depth keeps the search cheap
+    for marker in Path(root).glob(f'*/*/{STAGE_DIR}/ridft.yml'):
+        calc_dir = marker.parent.parent
+        if calc_dir.resolve() == here:
+            continue
+        record = _completed_scf(calc_dir)
+        if record is None:
+            continue
+        wano = record['wano']
+        if (wano['Basis set']['Basis set type'] != settings['basis set']
+                or wano['Initial guess']['G1']['Charge'] != settings['charge']
+                or wano['Initial guess']['G1']['Multiplicity'] != settings['multiplicity']
+                or not same_geometry(coord_file, record['files']['coord'])):
+            continue
+        distance = functional_distance(settings['functional'], wano['DFT options']['Functional'])
+        candidates.append((distance, str(calc_dir), record))
+    return min(candidates, key=lambda c: c[:2])[2] if candidates else None
+
+
+def seed_orbitals(settings: dict, coord_file: str = 'coord', root: str = '../..') -> dict:
+    """
+    Replaces the extended Hueckel guess written by define with the converged MOs of the closest
+    completed sibling. Returns the warm start record (source and its functional, plus the nearest
+    cold-start SCF iteration count and the functional it was measured with, for a rough comparison),
+    or None if no sibling qualifies.
+    """
+    record = find_warm_start(settings, coord_file, root)
+    if record is None:
+        return None
+    for name in MO_FILES:
+        if name in record['files']:
+            shutil.copyfile(record['files'][name], name)
+    # A warm-started sibling passes on the cold start it was compared with
+    source_functional = record['wano']['DFT options']['Functional']
+    if record['warm start']:
+        reference = record['warm start']['reference iterations']
+        reference_functional = record['warm start'].get('reference functional', record['warm start']['source functional'])
+    else:
+        reference, reference_functional = record['iterations'], source_functional
+    print(f"Starting from the orbitals of {record['dir']}.")
+    return {
+        'source': str(record['dir']),
+        'source functional': source_functional,
+        'reference iterations': reference,
+        'reference functional': reference_functional,
+    }
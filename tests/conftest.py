@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The workflow scripts are flat modules next to the calculation they run in
+SCRIPT_DIR = Path(__file__).resolve().parent.parent / 'example_data' / 'f1_on' / 'hyper' / 'm062x'
+sys.path.insert(0, str(SCRIPT_DIR))
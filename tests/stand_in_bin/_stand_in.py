@@ -0,0 +1,36 @@
+"""
+Shared part of the stand-in Turbomole executables in this directory: they replay the outputs of the
+example calculation instead of computing anything, and log when they ran to stand_in.log.
+"""
+import os
+import sys
+import time
+import shutil
+from pathlib import Path
+
+EXAMPLE_DIR = Path(__file__).resolve().parents[2] / 'example_data' / 'f1_on' / 'hyper' / 'm062x'
+SLEEP = float(os.environ.get('STAND_IN_SLEEP', '0'))
+
+
+def log(program: str, event: str) -> None:
+    with open('stand_in.log', 'a') as outfile:
+        outfile.write(f'{program} {event} {time.time():.6f} {os.environ.get("PARNODES", "")}\n')
+
+
+def replay(program: str, output: str = None, files=(), sleep: bool = False, read_input: bool = False) -> None:
+    """
+    Logs the start, reads the piped input if `read_input`, waits STAND_IN_SLEEP s if `sleep`, prints
+    the example `output` to stdout, copies the example `files` into the working directory and ends
+    the way Turbomole modules do.
+    """
+    log(program, 'start')
+    if read_input:
+        sys.stdin.read()
+    if sleep:
+        time.sleep(SLEEP)
+    for filename in files:
+        shutil.copyfile(EXAMPLE_DIR / filename, filename)
+    if output:
+        sys.stdout.write((EXAMPLE_DIR / output).read_text())
+    log(program, 'end')
+    sys.stderr.write(f'{program} ended normally\n')
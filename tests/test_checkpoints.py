@@ -0,0 +1,87 @@
+import pytest
+from checkpoints import StageRunner
+
+
+@pytest.fixture
+def calc_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def run_pipeline(force=(), scf_result='mos 1\n', settings=None, stage_settings=None):
+    """
+    Runs a define -> ridft -> escf chain of stand-in stages and returns the names of those that ran.
+    """
+    ran = []
+
+    def define():
+        ran.append('define')
+        with open('control', 'w') as outfile:
+            outfile.write('$scfconv 7\n')
+
+    def ridft():
+        ran.append('ridft')
+        with open('mos', 'w') as outfile:
+            outfile.write(scf_result)
+
+    def escf():
+        ran.append('escf')
+        with open('mos') as infile, open('escf.out', 'w') as outfile:
+            outfile.write('from ' + infile.read())
+        results['escf'] = scf_result
+
+    settings, results = dict(settings or {'functional': 'b3-lyp'}), {}
+    stages = StageRunner(force, stage_settings=stage_settings)
+    for name, func in (('define', define), ('ridft', ridft), ('escf', escf)):
+        stages.run(name, func, settings, results)
+    return ran, results
+
+
+def test_restart_skips_completed_stages(calc_dir):
+    assert run_pipeline()[0] == ['define', 'ridft', 'escf']
+    ran, results = run_pipeline()
+    assert ran == []
+    assert results['escf'] == 'mos 1\n'
+
+
+def test_forced_ridft_reruns_escf(calc_dir):
+    run_pipeline()
+    ran, results = run_pipeline(force=('ridft',), scf_result='mos 2\n')
+    assert ran == ['ridft', 'escf']
+    assert (calc_dir / 'mos').read_text() == 'mos 2\n'
+    assert (calc_dir / 'escf.out').read_text() == 'from mos 2\n'
+    assert results['escf'] == 'mos 2\n'
+
+
+def test_only_settings_a_stage_reads_invalidate_it(calc_dir):
+    stage_settings = {'define': ('functional',), 'ridft': ('functional',), 'escf': ('hyperpol',)}
+    run_pipeline(settings={'functional': 'b3-lyp', 'hyperpol': True}, stage_settings=stage_settings)
+    ran, _ = run_pipeline(settings={'functional': 'b3-lyp', 'hyperpol': True, 'blob store': '/scratch/blobs'},
+                          stage_settings=stage_settings)
+    assert ran == []
+    ran, _ = run_pipeline(settings={'functional': 'b3-lyp', 'hyperpol': False}, stage_settings=stage_settings)
+    assert ran == ['escf']
+
+
+def test_edited_control_is_kept_and_reruns_later_stages(calc_dir):
+    run_pipeline()
+    (calc_dir / 'control').write_text('$scfconv 8\n')
+    ran, _ = run_pipeline()
+    assert ran == ['ridft', 'escf']
+    assert (calc_dir / 'control').read_text() == '$scfconv 8\n'
+    assert run_pipeline()[0] == []
+
+
+def test_interrupted_stage_reruns(calc_dir):
+    run_pipeline()
+    stages = StageRunner()
+    settings, results = {'functional': 'b3-lyp'}, {}
+    stages.run('define', lambda: None, settings, results)
+
+    def interrupted():
+        (calc_dir / 'mos').write_text('partial\n')
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        stages.run('ridft', interrupted, {'functional': 'pbe0'}, results)
+    assert run_pipeline()[0] == ['ridft', 'escf']
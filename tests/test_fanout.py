@@ -0,0 +1,66 @@
+import shutil
+import pytest
+from pathlib import Path
+from conftest import SCRIPT_DIR
+from fanout import ResourcePool, fan_out
+
+STAND_IN_BIN = Path(__file__).resolve().parent / 'stand_in_bin'
+
+
+def test_pool_hands_out_at_most_its_budget():
+    pool = ResourcePool(cores=4, memory_mb=8000)
+    assert pool.try_acquire(2, 4000)
+    assert not pool.try_acquire(1, 6000)
+    assert pool.try_acquire(2, 4000)
+    assert not pool.try_acquire(1, 1)
+    pool.release(2, 4000)
+    assert pool.try_acquire(1, 1000)
+    assert not pool.fits(5, 1000)
+    with pytest.raises(ValueError):
+        pool.acquire(1, 9000)
+
+
+def program_runs(job_dir: Path, program: str) -> list:
+    """
+    Returns the (start, end, PARNODES) of every run of a stand-in program in a job directory.
+    """
+    events = [line.split() for line in (job_dir / 'stand_in.log').read_text().splitlines()]
+    starts = [(float(t), cores) for name, event, t, cores in events if name == program and event == 'start']
+    ends = [float(t) for name, event, t, _ in events if name == program and event == 'end']
+    return [(start, end, cores) for (start, cores), end in zip(starts, ends)]
+
+
+@pytest.fixture
+def fanout_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('STAND_IN_SLEEP', '0.5')
+    monkeypatch.delenv('TM_BLOB_STORE', raising=False)
+    monkeypatch.delenv('TM_CALC_CACHE', raising=False)
+    for filename in ('coord', 'rendered_wano.yml'):
+        shutil.copyfile(SCRIPT_DIR / filename, filename)
+    return tmp_path
+
+
+def run_fan_out(memory_mb: int, max_workers: int = None) -> list:
+    jobs = fan_out('coord', ['b3-lyp', 'pbe0'], [1300.0], cores=2, memory_mb=memory_mb, cores_per_job=1,
+                   memory_per_job=4000, path_prepend=[STAND_IN_BIN], max_workers=max_workers)
+    for job in jobs:
+        assert job['returncode'] == 0, (job['dir'] / 'run_tm.stdout').read_text()
+        assert job['results'] is not None
+    return [program_runs(job['dir'], 'ridft')[0] for job in jobs]
+
+
+def test_jobs_within_budget_run_concurrently(fanout_dir):
+    (start_a, end_a, cores_a), (start_b, end_b, cores_b) = run_fan_out(memory_mb=8000)
+    assert start_a < end_b and start_b < end_a
+    assert cores_a == cores_b == '1'
+
+
+def test_jobs_beyond_budget_wait_for_each_other(fanout_dir):
+    (start_a, end_a, _), (start_b, end_b, _) = run_fan_out(memory_mb=6000)
+    assert end_a <= start_b or end_b <= start_a
+
+
+def test_max_workers_limits_concurrent_jobs(fanout_dir):
+    (start_a, end_a, _), (start_b, end_b, _) = run_fan_out(memory_mb=8000, max_workers=1)
+    assert end_a <= start_b or end_b <= start_a